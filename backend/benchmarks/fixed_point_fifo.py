@@ -0,0 +1,127 @@
+"""
+KONTROL Fixed Point Benchmark
+Compara el motor FIFO en enteros escalados con el camino Decimal de referencia
+
+Uso (desde backend/):
+    python -m benchmarks.fixed_point_fifo --lots 500000
+"""
+
+import argparse
+import dataclasses
+import random
+import time
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from typing import List, Optional
+
+from core.tax_engine.fixed_point import from_scaled, to_scaled
+from core.tax_engine.lots import create_inventory
+from core.tax_engine.models import DECIMAL_CONTEXT, Lot, RealizedGain, Transaction, TaxReport, quantize
+from core.tax_engine.tax_calculator import TaxCalculator
+
+class DecimalReferenceCalculator(TaxCalculator):
+    """
+    Camino Decimal anterior: mismo motor de lotes con lotes, transacciones e
+    importes Decimal y el cálculo de ganancia de precisión 80 original.
+    """
+
+    def calculate_gain(self, lot: Optional[Lot], sell_tx: Transaction, quantity: Decimal) -> RealizedGain:
+        unit_cost = lot.unit_cost if lot is not None else Decimal('0')
+        cost_basis = quantize(DECIMAL_CONTEXT.multiply(quantity, unit_cost))
+
+        gross = DECIMAL_CONTEXT.multiply(quantity, sell_tx.unit_price)
+        if sell_tx.fee and sell_tx.amount:
+            fee_share = DECIMAL_CONTEXT.divide(DECIMAL_CONTEXT.multiply(sell_tx.fee, quantity), sell_tx.amount)
+            gross = DECIMAL_CONTEXT.subtract(gross, fee_share)
+        proceeds = quantize(gross)
+
+        return RealizedGain(
+            asset=sell_tx.asset,
+            lot_id=lot.lot_id if lot is not None else None,
+            sell_tx_id=sell_tx.tx_id,
+            acquired_at=lot.acquired_at if lot is not None else None,
+            disposed_at=sell_tx.timestamp,
+            quantity=quantity,
+            cost_basis=cost_basis,
+            proceeds=proceeds,
+            # Resta exacta: con el contexto por defecto (28 dígitos) el camino
+            # anterior redondeaba ganancias de más de 10 dígitos enteros
+            gain=DECIMAL_CONTEXT.subtract(proceeds, cost_basis)
+        )
+
+def generate_transactions(lots: int, seed: int) -> List[Transaction]:
+    """Historial sintético: `lots` compras y una venta cada dos compras"""
+    rng = random.Random(seed)
+    timestamp = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    transactions = []
+    for index in range(lots):
+        timestamp += timedelta(seconds=30)
+        transactions.append(Transaction(
+            tx_id=f'buy-{index}',
+            timestamp=timestamp,
+            tx_type='BUY',
+            asset=rng.choice(('BTC', 'ETH')),
+            amount=rng.randint(1, 10 ** 12) * 10 ** rng.randint(0, 10),
+            unit_price=rng.randint(10 ** 4, 10 ** 10) * 10 ** rng.randint(10, 16)
+        ))
+        if index % 2:
+            transactions.append(Transaction(
+                tx_id=f'sell-{index}',
+                timestamp=timestamp,
+                tx_type='SELL',
+                asset=rng.choice(('BTC', 'ETH')),
+                amount=rng.randint(1, 2 * 10 ** 12) * 10 ** rng.randint(6, 10),
+                unit_price=rng.randint(10 ** 4, 10 ** 10) * 10 ** rng.randint(10, 16),
+                fee=rng.randint(0, 10 ** 6) * 10 ** rng.randint(12, 16)
+            ))
+    return transactions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[2])
+    parser.add_argument('--lots', type=int, default=500000, help='Número de lotes (compras)')
+    parser.add_argument('--seed', type=int, default=42, help='Semilla del generador')
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    transactions = generate_transactions(args.lots, args.seed)
+    decimal_transactions = [
+        dataclasses.replace(
+            tx, amount=from_scaled(tx.amount), unit_price=from_scaled(tx.unit_price), fee=from_scaled(tx.fee)
+        )
+        for tx in transactions
+    ]
+    print(f"Generadas {len(transactions)} transacciones en {time.perf_counter() - started:.2f}s")
+
+    reference = TaxReport(method='FIFO')
+    started = time.perf_counter()
+    DecimalReferenceCalculator('benchmark', 'ES').run_lot_engine(
+        decimal_transactions, create_inventory('FIFO'), reference
+    )
+    decimal_seconds = time.perf_counter() - started
+
+    calculator = TaxCalculator('benchmark', 'ES')
+    report = TaxReport(method='FIFO')
+    started = time.perf_counter()
+    calculator.run_lot_engine(transactions, create_inventory('FIFO'), report)
+    scaled_seconds = time.perf_counter() - started
+
+    # Identidad bit a bit de cada línea y del total
+    mismatches = abs(len(report.realized_gains) - len(reference.realized_gains))
+    total = Decimal('0')
+    for gain, expected in zip(report.realized_gains, reference.realized_gains):
+        total = DECIMAL_CONTEXT.add(total, expected.gain)
+        if (gain.lot_id, gain.quantity, gain.cost_basis, gain.proceeds, gain.gain) != (
+            expected.lot_id, to_scaled(expected.quantity), to_scaled(expected.cost_basis),
+            to_scaled(expected.proceeds), to_scaled(expected.gain)
+        ):
+            mismatches += 1
+    identical_total = to_scaled(total) == report.total_realized_gain
+
+    print(f"Líneas de ganancia: {len(reference.realized_gains)}")
+    print(f"Decimal:          {decimal_seconds:.2f}s")
+    print(f"Punto fijo:       {scaled_seconds:.2f}s")
+    print(f"Aceleración:      {decimal_seconds / scaled_seconds:.2f}x")
+    print(f"Diferencias:      {mismatches} (total idéntico: {identical_total})")
+
+if __name__ == '__main__':
+    main()
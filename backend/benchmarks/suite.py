@@ -0,0 +1,257 @@
+"""
+KONTROL Benchmark Suite
+Mide parseo Cointracking, carga masiva, matching y motores fiscales sobre un portfolio sintético
+
+Uso (desde backend/):
+    python -m benchmarks.suite --transactions 100000
+    python -m benchmarks.suite --transactions 1000000 --database-url postgresql+asyncpg://localhost/kontrol
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+import warnings
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, List, Optional
+
+from benchmarks.synthetic import SyntheticPortfolio, write_cointracking_csv
+
+STAGES = ('generate', 'parse', 'load', 'match', 'tax')
+
+@dataclass
+class StageResult:
+    """
+    Resultado de una etapa.
+
+    Attributes:
+        name: Etapa
+        seconds: Duración
+        items: Elementos procesados (filas, transacciones...)
+        peak_rss_mb: RSS máximo del proceso al terminar la etapa
+        extra: Métricas propias de la etapa (precisión, filas escritas...)
+    """
+    name: str
+    seconds: float
+    items: int
+    peak_rss_mb: float
+    extra: Dict[str, Any] = field(default_factory=dict)
+
+    @property
+    def throughput(self) -> float:
+        return self.items / self.seconds if self.seconds else 0.0
+
+def peak_rss_mb() -> float:
+    """RSS máximo del proceso (ru_maxrss está en KB en Linux y en bytes en macOS)"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+class Stopwatch:
+    """Cronómetro de una etapa que anota el resultado al salir"""
+
+    def __init__(self, results: List[StageResult], name: str):
+        self.results = results
+        self.name = name
+        self.items = 0
+        self.extra: Dict[str, Any] = {}
+
+    def __enter__(self) -> 'Stopwatch':
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is None:
+            self.results.append(StageResult(
+                self.name, time.perf_counter() - self.started, self.items, peak_rss_mb(), self.extra
+            ))
+
+def bench_generate(portfolio: SyntheticPortfolio, results: List[StageResult]) -> None:
+    with Stopwatch(results, 'generate') as stage:
+        stage.items = sum(1 for _ in portfolio.rows())
+        stage.extra['transfers'] = len(portfolio.transfers)
+
+def bench_parse(csv_path: str, portfolio: SyntheticPortfolio, chunk_size: int, workers: int,
+                results: List[StageResult]) -> None:
+    from core.ingestion_service.cointracking_parser import CointrackingBackupParser
+
+    parser = CointrackingBackupParser(chunk_size=chunk_size, user_id=portfolio.user_id)
+    with Stopwatch(results, 'parse') as stage:
+        for batch in parser.iter_csv_batches(csv_path, workers=workers):
+            stage.items += len(batch)
+            stage.extra['skipped'] = stage.extra.get('skipped', 0) + batch.skipped
+        stage.extra['workers'] = workers
+
+def bench_load_sqlite(csv_path: str, portfolio: SyntheticPortfolio, database_url: str, chunk_size: int,
+                      results: List[StageResult]) -> None:
+    """Parseo + INSERT por lotes con SQLAlchemy (SQLite no tiene COPY)"""
+    import uuid
+
+    from sqlalchemy import create_engine
+
+    from core.ingestion_service.cointracking_parser import CointrackingBackupParser
+    from models.database import CanonicalTransaction
+
+    engine = create_engine(database_url)
+    table = CanonicalTransaction.__table__
+    table.create(engine, checkfirst=True)
+    user_id = uuid.UUID(portfolio.user_id)
+    parser = CointrackingBackupParser(chunk_size=chunk_size, user_id=portfolio.user_id)
+    with warnings.catch_warnings():
+        # SQLite guarda DECIMAL como REAL y SQLAlchemy avisa en cada lote
+        warnings.simplefilter('ignore')
+        with Stopwatch(results, 'load') as stage:
+            for batch in parser.iter_csv_batches(csv_path):
+                rows = batch.to_dicts()
+                for row in rows:
+                    row['user_id'] = user_id
+                with engine.begin() as connection:
+                    connection.execute(table.insert(), rows)
+                stage.items += len(rows)
+            stage.extra['backend'] = 'sqlite (parse + insert)'
+    engine.dispose()
+
+async def bench_load_postgres(csv_path: str, portfolio: SyntheticPortfolio, database_url: str, chunk_size: int,
+                              keep_data: bool, results: List[StageResult]) -> None:
+    """Parseo + COPY y merge de CanonicalTransactionLoader contra un PostgreSQL local"""
+    from sqlalchemy import text
+    from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+
+    from core.ingestion_service.bulk_loader import CanonicalTransactionLoader
+    from core.ingestion_service.cointracking_parser import CointrackingBackupParser
+
+    engine = create_async_engine(database_url)
+    parser = CointrackingBackupParser(chunk_size=chunk_size, user_id=portfolio.user_id)
+    async with AsyncSession(engine) as session:
+        await session.execute(
+            text(
+                "INSERT INTO users (id, email, hashed_password) VALUES (:id, :email, '!') "
+                "ON CONFLICT (id) DO NOTHING"
+            ),
+            {'id': portfolio.user_id, 'email': f'benchmark+{portfolio.user_id}@kontrol.local'}
+        )
+        await session.commit()
+        try:
+            with Stopwatch(results, 'load') as stage:
+                result = await CanonicalTransactionLoader(session).load(
+                    portfolio.user_id, parser.iter_csv_batches(csv_path)
+                )
+                stage.items = result.rows
+                stage.extra.update(backend='postgresql (parse + COPY/merge)', written=result.written)
+        finally:
+            if not keep_data:
+                await session.execute(text("DELETE FROM users WHERE id = :id"), {'id': portfolio.user_id})
+                await session.commit()
+    await engine.dispose()
+
+def bench_match(portfolio: SyntheticPortfolio, results: List[StageResult]):
+    from core.matching_engine.internal_transfers import InternalTransferMatcher
+    from core.transaction_frame import TransactionFrame
+
+    with Stopwatch(results, 'frame') as stage:
+        frame = TransactionFrame.from_rows(portfolio.rows())
+        stage.items = len(frame)
+        stage.extra['nbytes_mb'] = round(frame.nbytes / (1024 * 1024), 1)
+
+    with Stopwatch(results, 'match') as stage:
+        matches = InternalTransferMatcher().match(frame)
+        stage.items = len(frame)
+        found = {(out_id, in_id) for out_id, in_id, _ in matches.pairs()}
+        correct = len(found & portfolio.transfers)
+        stage.extra.update(
+            pairs=len(found),
+            expected=len(portfolio.transfers),
+            precision=round(correct / len(found), 6) if found else 1.0,
+            recall=round(correct / len(portfolio.transfers), 6) if portfolio.transfers else 1.0
+        )
+    return frame
+
+def bench_tax(frame, results: List[StageResult]) -> None:
+    from core.tax_engine.lots import INVENTORY_CLASSES, create_inventory
+    from core.tax_engine.models import TaxReport
+    from core.tax_engine.tax_calculator import TaxCalculator
+
+    with Stopwatch(results, 'tax:events') as stage:
+        transactions = frame.to_tax_transactions()
+        stage.items = len(transactions)
+
+    calculator = TaxCalculator('benchmark', 'ES')
+    for method in INVENTORY_CLASSES:
+        with Stopwatch(results, f'tax:{method}') as stage:
+            report = calculator.run_lot_engine(transactions, create_inventory(method), TaxReport(method=method))
+            stage.items = len(transactions)
+            stage.extra['gain_lines'] = len(report.realized_gains)
+
+def print_results(portfolio: SyntheticPortfolio, results: List[StageResult]) -> None:
+    print(f"Portfolio sintético: {portfolio.transactions} transacciones, semilla {portfolio.seed}")
+    print(f"{'Etapa':<22}{'Segundos':>10}{'Elementos/s':>14}{'RSS pico (MB)':>15}  Detalle")
+    for result in results:
+        detail = ', '.join(f"{key}={value}" for key, value in result.extra.items())
+        print(
+            f"{result.name:<22}{result.seconds:>10.2f}{result.throughput:>14.0f}"
+            f"{result.peak_rss_mb:>15.1f}  {detail}"
+        )
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[2])
+    parser.add_argument('--transactions', type=int, default=100000, help='Transacciones del portfolio (10k-10M)')
+    parser.add_argument('--seed', type=int, default=42, help='Semilla del generador')
+    parser.add_argument('--years', type=float, default=3.0, help='Años que abarca el historial')
+    parser.add_argument('--stages', default=','.join(STAGES), help=f"Etapas separadas por comas ({', '.join(STAGES)})")
+    parser.add_argument('--database-url', default='sqlite://',
+                        help='sqlite:///ruta.db (o sqlite:// en memoria) o postgresql+asyncpg://... local')
+    parser.add_argument('--chunk-size', type=int, default=10000, help='Filas por lote de parseo y carga')
+    parser.add_argument('--workers', type=int, default=1, help='Procesos de parseo')
+    parser.add_argument('--keep-data', action='store_true', help='No borrar las filas cargadas en PostgreSQL')
+    parser.add_argument('--json', help='Guardar los resultados en este archivo')
+    args = parser.parse_args()
+
+    stages = [stage.strip() for stage in args.stages.split(',') if stage.strip()]
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        parser.error(f"Etapas desconocidas: {', '.join(sorted(unknown))}")
+
+    portfolio = SyntheticPortfolio(args.transactions, args.seed, years=args.years)
+    results: List[StageResult] = []
+    frame = None
+
+    if 'generate' in stages:
+        bench_generate(portfolio, results)
+
+    with tempfile.TemporaryDirectory(prefix='kontrol-bench-') as workdir:
+        csv_path: Optional[str] = None
+        if 'parse' in stages or 'load' in stages:
+            csv_path = os.path.join(workdir, 'cointracking.csv')
+            write_cointracking_csv(portfolio.rows(), csv_path)
+        if 'parse' in stages:
+            bench_parse(csv_path, portfolio, args.chunk_size, args.workers, results)
+        if 'load' in stages:
+            if args.database_url.startswith('sqlite'):
+                bench_load_sqlite(csv_path, portfolio, args.database_url, args.chunk_size, results)
+            else:
+                asyncio.run(bench_load_postgres(
+                    csv_path, portfolio, args.database_url, args.chunk_size, args.keep_data, results
+                ))
+
+    if 'match' in stages:
+        frame = bench_match(portfolio, results)
+    if 'tax' in stages:
+        if frame is None:
+            from core.transaction_frame import TransactionFrame
+            frame = TransactionFrame.from_rows(portfolio.rows())
+        bench_tax(frame, results)
+
+    print_results(portfolio, results)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as handle:
+            json.dump({
+                'transactions': args.transactions,
+                'seed': args.seed,
+                'stages': [dict(asdict(result), throughput=result.throughput) for result in results]
+            }, handle, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,215 @@
+"""
+KONTROL Synthetic Portfolio
+Generador determinista (con semilla) de historiales multi-exchange y multi-wallet para los benchmarks
+"""
+
+import csv
+import heapq
+import random
+import uuid
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from typing import Any, Dict, Iterator, List, Set, Tuple
+
+FIAT = 'EUR'
+
+# Asset -> precio inicial en EUR
+ASSET_PRICES = {'BTC': 30000.0, 'ETH': 2000.0, 'SOL': 50.0, 'ADA': 0.5, 'DOT': 10.0}
+
+EXCHANGES = ('Binance', 'Kraken', 'Coinbase', 'Bitvavo', 'Bybit', 'OKX')
+WALLETS = ('Ledger', 'Trezor', 'MetaMask', 'Phantom')
+
+# Peso de cada tipo de evento (una transferencia interna genera dos filas)
+EVENT_WEIGHTS = {
+    'dca': 40,
+    'transfer': 20,
+    'sell': 15,
+    'reward': 10,
+    'external_deposit': 10,
+    'external_withdrawal': 5,
+}
+
+# Retraso máximo del depósito de una transferencia interna y comisión máxima
+# (dentro de la ventana de 90 s y de la tolerancia del 0,1% del matching engine)
+MAX_TRANSFER_DELAY_SECONDS = 60
+MAX_TRANSFER_FEE_SHARE = 0.0009
+
+_CRYPTO_QUANTUM = Decimal('0.00000001')
+_FIAT_QUANTUM = Decimal('0.01')
+
+def _crypto(value: float) -> Decimal:
+    return Decimal(repr(value)).quantize(_CRYPTO_QUANTUM)
+
+def _fiat(value: float) -> Decimal:
+    return Decimal(repr(value)).quantize(_FIAT_QUANTUM)
+
+class SyntheticPortfolio:
+    """
+    Historial sintético de un usuario.
+
+    Mezcla planes DCA (compras periódicas del mismo importe en EUR en un
+    exchange), ventas, recompensas de staking, movimientos externos y
+    transferencias internas entre exchanges y wallets propias (retirada +
+    depósito unos segundos después, con una pequeña comisión). Las
+    transferencias internas son la verdad de referencia del matching.
+
+    Cada llamada a rows() regenera el mismo historial desde la semilla sin
+    guardarlo, así que la memoria del generador no crece con el tamaño.
+
+    Attributes:
+        transactions: Filas a generar
+        seed: Semilla del generador
+        user_id: Usuario sintético (determinista a partir de la semilla)
+        transfers: Pares (tx_id retirada, tx_id depósito) de la última generación
+    """
+
+    def __init__(self, transactions: int, seed: int = 42, years: float = 3.0,
+                 start: datetime = datetime(2021, 1, 1, tzinfo=timezone.utc)):
+        self.transactions = transactions
+        self.seed = seed
+        self.start = start
+        # Separación media entre eventos para repartir el historial en `years`
+        self.mean_gap_seconds = years * 365 * 86400 / max(transactions, 1)
+        self.user_id = str(uuid.UUID(int=random.Random(seed).getrandbits(128)))
+        self.transfers: Set[Tuple[str, str]] = set()
+
+    def rows(self) -> Iterator[Dict[str, Any]]:
+        """Filas canónicas en orden cronológico (diccionarios de canonical_transactions)"""
+        rng = random.Random(self.seed)
+        self.transfers = set()
+        prices = dict(ASSET_PRICES)
+        assets = list(prices)
+        # Cantidad adquirida (compras y recompensas) que aún puede venderse
+        holdings = {asset: 0.0 for asset in assets}
+        plans = [
+            (rng.choice(assets), rng.choice(EXCHANGES), _fiat(rng.choice((25, 50, 100, 250, 500))))
+            for _ in range(6)
+        ]
+        kinds = list(EVENT_WEIGHTS)
+        weights = list(EVENT_WEIGHTS.values())
+        locations = EXCHANGES + WALLETS
+
+        pending: List[Tuple[datetime, int, Dict[str, Any]]] = []
+        sequence = 0
+        emitted = 0
+        clock = self.start
+
+        def row(tx_type: str, kontorl_type: str, location: str, **values) -> Dict[str, Any]:
+            nonlocal sequence
+            sequence += 1
+            return {
+                'id': None,
+                'tx_id_kontrol': f'synthetic_{self.seed}_{sequence:010d}',
+                'timestamp_utc': clock,
+                'tx_type': tx_type,
+                'kontorl_type': kontorl_type,
+                'asset_in': None,
+                'asset_out': None,
+                'amount_in': None,
+                'amount_out': None,
+                'fiat_cost_basis_unit': None,
+                'exchange_rate': None,
+                'fees': Decimal('0'),
+                'exchange_id': location.lower(),
+                **values
+            }
+
+        while emitted < self.transactions:
+            clock += timedelta(seconds=rng.expovariate(1 / self.mean_gap_seconds))
+            while pending and pending[0][0] <= clock and emitted < self.transactions:
+                emitted += 1
+                yield heapq.heappop(pending)[2]
+            if emitted >= self.transactions:
+                break
+
+            for asset in assets:
+                prices[asset] *= 1 + rng.gauss(0, 0.002)
+            kind = rng.choices(kinds, weights)[0]
+            asset = rng.choice(assets)
+            price = prices[asset]
+            if kind == 'sell' and holdings[asset] <= 0:
+                kind = 'dca'
+
+            if kind == 'dca':
+                asset, exchange, spend = rng.choice(plans)
+                price = prices[asset]
+                amount = _crypto(float(spend) / price)
+                holdings[asset] += float(amount)
+                event = row(
+                    'BUY', 'TRADE', exchange, asset_in=asset, amount_in=amount, asset_out=FIAT, amount_out=spend,
+                    fiat_cost_basis_unit=_fiat(price)
+                )
+            elif kind == 'sell':
+                amount = _crypto(holdings[asset] * rng.uniform(0.1, 0.5))
+                holdings[asset] -= float(amount)
+                event = row(
+                    'SELL', 'SALE', rng.choice(EXCHANGES), asset_out=asset, amount_out=amount, asset_in=FIAT,
+                    amount_in=_fiat(float(amount) * price), exchange_rate=_fiat(price)
+                )
+            elif kind == 'transfer':
+                source, target = rng.sample(locations, 2)
+                sent = _crypto(rng.uniform(10, 5000) / price)
+                received = _crypto(float(sent) * (1 - rng.uniform(0, MAX_TRANSFER_FEE_SHARE)))
+                withdrawal = row('TRANSFER', 'WITHDRAWAL', source, asset_out=asset, amount_out=sent)
+                deposit = row('TRANSFER', 'DEPOSIT', target, asset_in=asset, amount_in=min(received, sent))
+                deposit['timestamp_utc'] = clock + timedelta(
+                    microseconds=rng.randint(0, MAX_TRANSFER_DELAY_SECONDS * 1_000_000)
+                )
+                self.transfers.add((withdrawal['tx_id_kontrol'], deposit['tx_id_kontrol']))
+                heapq.heappush(pending, (deposit['timestamp_utc'], sequence, deposit))
+                event = withdrawal
+            elif kind == 'reward':
+                amount = _crypto(rng.uniform(0.5, 20) / price)
+                holdings[asset] += float(amount)
+                event = row(
+                    'STAKING', 'DEPOSIT', rng.choice(locations), asset_in=asset, amount_in=amount,
+                    fiat_cost_basis_unit=_fiat(price)
+                )
+            elif kind == 'external_deposit':
+                # Sin coste de adquisición: no cuenta para las ventas
+                amount = _crypto(rng.uniform(10, 5000) / price)
+                event = row('TRANSFER', 'DEPOSIT', rng.choice(locations), asset_in=asset, amount_in=amount)
+            else:
+                amount = _crypto(rng.uniform(10, 5000) / price)
+                event = row('TRANSFER', 'WITHDRAWAL', rng.choice(locations), asset_out=asset, amount_out=amount)
+
+            emitted += 1
+            yield event
+
+        # Transferencias cuya retirada quedó dentro pero el depósito no
+        dropped = {item[2]['tx_id_kontrol'] for item in pending}
+        self.transfers = {pair for pair in self.transfers if pair[1] not in dropped}
+
+# Tipo Cointracking de cada (tx_type, kontorl_type) sintético
+_COINTRACKING_TYPES = {
+    ('BUY', 'TRADE'): 'Trade',
+    ('SELL', 'SALE'): 'Trade',
+    ('TRANSFER', 'DEPOSIT'): 'Deposit',
+    ('TRANSFER', 'WITHDRAWAL'): 'Withdrawal',
+    ('STAKING', 'DEPOSIT'): 'Staking',
+}
+
+COINTRACKING_HEADER = ('Type', 'Buy', 'Cur.', 'Sell', 'Cur.', 'Fee', 'Cur.', 'Exchange', 'Group', 'Comment', 'Date')
+
+def write_cointracking_csv(rows: Iterator[Dict[str, Any]], path: str) -> int:
+    """
+    Escribir filas sintéticas como exportación "Trade Table" de Cointracking.
+
+    Returns:
+        Filas escritas
+    """
+    written = 0
+    with open(path, 'w', newline='', encoding='utf-8') as handle:
+        writer = csv.writer(handle, quoting=csv.QUOTE_ALL)
+        writer.writerow(COINTRACKING_HEADER)
+        for row in rows:
+            writer.writerow((
+                _COINTRACKING_TYPES[(row['tx_type'], row['kontorl_type'])],
+                row['amount_in'] or '', row['asset_in'] or '',
+                row['amount_out'] or '', row['asset_out'] or '',
+                '', '',
+                row['exchange_id'], '', '',
+                row['timestamp_utc'].strftime('%d.%m.%Y %H:%M:%S')
+            ))
+            written += 1
+    return written
@@ -74,11 +74,22 @@ class Settings(BaseSettings):
     # Storage
     storage_bucket: str = Field(default="kontrol-documents", env="STORAGE_BUCKET")
     max_file_size_mb: int = Field(default=10, env="MAX_FILE_SIZE_MB")
+    upload_spool_max_memory_mb: int = Field(default=4, env="UPLOAD_SPOOL_MAX_MEMORY_MB")
+    
+    # Ingestion Service
+    import_chunk_size: int = Field(default=10000, env="IMPORT_CHUNK_SIZE")
+    import_parse_workers: int = Field(default=0, env="IMPORT_PARSE_WORKERS")  # 0 = un proceso por CPU
+    import_parallel_min_mb: int = Field(default=8, env="IMPORT_PARALLEL_MIN_MB")  # Por debajo se parsea en un solo proceso
+    normalization_aliases_path: Optional[str] = Field(default=None, env="NORMALIZATION_ALIASES_PATH")
+    import_fail_fast: bool = Field(default=False, env="IMPORT_FAIL_FAST")  # Abortar ante la primera fila inválida
     
     # Matching Engine
     matching_engine_batch_size: int = Field(default=1000, env="MATCHING_ENGINE_BATCH_SIZE")
     matching_engine_time_window_seconds: int = Field(default=90, env="MATCHING_ENGINE_TIME_WINDOW_SECONDS")
     matching_engine_confidence_threshold: float = Field(default=0.8, env="MATCHING_ENGINE_CONFIDENCE_THRESHOLD")
+    # memory: sólo para un único proceso (API o worker); con varios, redis
+    matching_engine_index_backend: str = Field(default="memory", env="MATCHING_ENGINE_INDEX_BACKEND")  # memory | redis
+    matching_engine_index_ttl_seconds: int = Field(default=86400, env="MATCHING_ENGINE_INDEX_TTL_SECONDS")
     
     # Tax Engine
     tax_engine_default_method: str = Field(default="FIFO", env="TAX_ENGINE_DEFAULT_METHOD")
@@ -86,6 +97,16 @@ class Settings(BaseSettings):
         default=["ES", "US", "DE", "FR", "IT", "GB", "NL", "BE", "AT", "CH"],
         env="TAX_ENGINE_SUPPORTED_JURISDICTIONS"
     )
+    tax_report_cache_enabled: bool = Field(default=True, env="TAX_REPORT_CACHE_ENABLED")
+    tax_bulk_workers: int = Field(default=0, env="TAX_BULK_WORKERS")  # 0 = un proceso por CPU
+    tax_bulk_shard_size: int = Field(default=25, env="TAX_BULK_SHARD_SIZE")
+    tax_bulk_write_batch_size: int = Field(default=200, env="TAX_BULK_WRITE_BATCH_SIZE")
+    tax_bulk_tiers: list = Field(default=["compliance", "enterprise"], env="TAX_BULK_TIERS")
+    
+    # Compliance Engine
+    dac8_xsd_path: Optional[str] = Field(default=None, env="DAC8_XSD_PATH")
+    dac8_namespace: str = Field(default="urn:kontrol:dac8:v1", env="DAC8_NAMESPACE")
+    dac8_batch_size: int = Field(default=5000, env="DAC8_BATCH_SIZE")
     
     # Agent Configuration
     agent_max_tokens: int = Field(default=4000, env="AGENT_MAX_TOKENS")
@@ -0,0 +1,322 @@
+"""
+KONTROL DAC8 Reporter
+Generación en streaming de reportes DAC8 (XML) con validación XSD elemento a elemento
+"""
+
+import copy
+import hashlib
+import logging
+import os
+import tempfile
+import uuid
+from contextlib import ExitStack
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from decimal import Decimal
+from functools import lru_cache
+from typing import Any, BinaryIO, Dict, Optional, Sequence, Union
+
+from lxml import etree
+
+from config.settings import get_settings
+from utils.database import AsyncSessionLocal, TransactionRepository
+
+logger = logging.getLogger(__name__)
+
+# Elementos del documento (en el espacio de nombres DAC8_NAMESPACE)
+ROOT_ELEMENT = 'DAC8Report'
+HEADER_ELEMENT = 'MessageSpec'
+TRANSACTION_ELEMENT = 'ReportableTransaction'
+SUMMARY_ELEMENT = 'ReportSummary'
+
+# Los movimientos entre cuentas propias y las comisiones sueltas no son
+# transacciones reportables
+DAC8_REPORTABLE_TYPES = (
+    'CAPITAL_GAIN_SELL', 'TRADE', 'SALE', 'EXCHANGE', 'DEPOSIT', 'WITHDRAWAL'
+)
+
+# Columnas de canonical_transactions que se vuelcan en cada elemento
+DAC8_COLUMNS = (
+    'tx_id_kontrol', 'timestamp_utc', 'kontorl_type', 'asset_in', 'asset_out',
+    'amount_in', 'amount_out', 'fiat_cost_basis_unit', 'exchange_rate', 'fees',
+    'exchange_id', 'tx_hash'
+)
+
+# (columna, elemento XML) en el orden que fija el esquema
+_TRANSACTION_FIELDS = (
+    ('tx_id_kontrol', 'TxId'),
+    ('timestamp_utc', 'Timestamp'),
+    ('kontorl_type', 'TxType'),
+    ('asset_in', 'AssetIn'),
+    ('amount_in', 'AmountIn'),
+    ('asset_out', 'AssetOut'),
+    ('amount_out', 'AmountOut'),
+    ('fiat_cost_basis_unit', 'FiatCostBasisUnit'),
+    ('exchange_rate', 'ExchangeRate'),
+    ('fees', 'Fees'),
+    ('exchange_id', 'ExchangeId'),
+    ('tx_hash', 'TxHash'),
+)
+
+class DAC8ValidationError(ValueError):
+    """Un elemento del reporte DAC8 no cumple el esquema XSD"""
+
+@dataclass
+class DAC8ReportSummary:
+    """
+    Resultado de una generación DAC8 en streaming.
+
+    Attributes:
+        message_ref_id: Identificador del mensaje
+        transaction_count: Transacciones reportadas
+        sha256: Hash del documento escrito
+        size_bytes: Tamaño del documento
+        location: Ruta en storage (si se subió)
+    """
+    message_ref_id: str
+    transaction_count: int
+    sha256: str
+    size_bytes: int
+    location: Optional[str] = None
+
+@lru_cache(maxsize=None)
+def load_dac8_schema(xsd_path: Optional[str] = None) -> etree.XMLSchema:
+    """
+    Cargar (una vez por proceso) el esquema XSD de DAC8.
+
+    Raises:
+        ValueError: Si no hay esquema configurado (DAC8_XSD_PATH)
+    """
+    xsd_path = xsd_path or get_settings().dac8_xsd_path
+    if not xsd_path:
+        raise ValueError("Esquema DAC8 no configurado (DAC8_XSD_PATH)")
+    return etree.XMLSchema(etree.parse(xsd_path))
+
+def _format_value(value: Any) -> Optional[str]:
+    """Texto de un valor de columna (None si no debe emitirse)"""
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return value.astimezone(timezone.utc).isoformat()
+    if isinstance(value, Decimal):
+        return format(value, 'f')
+    return str(value)
+
+class _HashingWriter:
+    """Envoltorio de un destino binario que calcula hash y tamaño al vuelo"""
+
+    def __init__(self, output: BinaryIO):
+        self.output = output
+        self.digest = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data: bytes) -> int:
+        self.digest.update(data)
+        self.size += len(data)
+        return self.output.write(data)
+
+class DAC8StreamWriter:
+    """
+    Escritor incremental de un documento DAC8.
+
+    Cada elemento (cabecera, transacción, resumen) se construye, se valida
+    y se vuelca al destino antes de pasar al siguiente, de modo que la
+    memoria no depende del número de transacciones.
+
+    La validación usa libxml2 (lxml) sobre un sobre mínimo: la cabecera ya
+    escrita, el elemento nuevo y un resumen provisional. Así cada elemento
+    se comprueba contra su declaración real en el XSD sin retener el
+    documento.
+
+    Uso:
+        with DAC8StreamWriter(output, schema) as writer:
+            writer.write_header(user_id, jurisdiction, year)
+            for row in rows:
+                writer.write_transaction(row)
+    """
+
+    def __init__(self, output: BinaryIO, schema: Optional[etree.XMLSchema] = None, namespace: Optional[str] = None):
+        self.namespace = namespace or get_settings().dac8_namespace
+        self.schema = schema
+        self.message_ref_id = str(uuid.uuid4())
+        self.transaction_count = 0
+        self._output = _HashingWriter(output)
+        self._stack = ExitStack()
+        self._file = None
+        self._envelope: Optional[etree._Element] = None
+
+    def __enter__(self) -> 'DAC8StreamWriter':
+        self._file = self._stack.enter_context(etree.xmlfile(self._output, encoding='utf-8'))
+        self._file.write_declaration()
+        self._stack.enter_context(self._file.element(self._tag(ROOT_ELEMENT), nsmap={None: self.namespace}))
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is None:
+            self._write(self._build(SUMMARY_ELEMENT, (
+                ('MessageRefId', self.message_ref_id),
+                ('TransactionCount', self.transaction_count),
+            )))
+        self._stack.close()
+
+    @property
+    def sha256(self) -> str:
+        return self._output.digest.hexdigest()
+
+    @property
+    def size_bytes(self) -> int:
+        return self._output.size
+
+    def write_header(self, user_id: str, jurisdiction: str, year: int) -> None:
+        """Escribir la cabecera del mensaje"""
+        header = self._build(HEADER_ELEMENT, (
+            ('MessageRefId', self.message_ref_id),
+            ('ReportingPeriod', year),
+            ('Jurisdiction', jurisdiction),
+            ('UserId', user_id),
+            ('Timestamp', datetime.now(timezone.utc).replace(microsecond=0)),
+        ))
+        if self.schema is not None:
+            # Sobre de validación: cabecera + resumen provisional
+            self._envelope = etree.Element(self._tag(ROOT_ELEMENT), nsmap={None: self.namespace})
+            self._envelope.append(header)
+            self._envelope.append(self._build(SUMMARY_ELEMENT, (
+                ('MessageRefId', self.message_ref_id),
+                ('TransactionCount', 0),
+            )))
+            self._validate(header)
+            header = copy.deepcopy(header)
+        self._write(header)
+
+    def write_transaction(self, row: Union[Dict[str, Any], Sequence[Any]]) -> None:
+        """
+        Escribir una transacción reportable.
+
+        Args:
+            row: Fila con las columnas DAC8_COLUMNS (diccionario o tupla en ese orden)
+
+        Raises:
+            DAC8ValidationError: Si el elemento no cumple el esquema
+        """
+        if not isinstance(row, dict):
+            row = dict(zip(DAC8_COLUMNS, row))
+        self._write(self._build(TRANSACTION_ELEMENT, (
+            (name, row.get(column)) for column, name in _TRANSACTION_FIELDS
+        )))
+        self.transaction_count += 1
+
+    def _tag(self, name: str) -> str:
+        return f'{{{self.namespace}}}{name}'
+
+    def _build(self, name: str, fields) -> etree._Element:
+        element = etree.Element(self._tag(name), nsmap={None: self.namespace})
+        for child, value in fields:
+            text = _format_value(value)
+            if text is not None:
+                etree.SubElement(element, self._tag(child)).text = text
+        return element
+
+    def _write(self, element: etree._Element) -> None:
+        """Validar un elemento nuevo (transacción o resumen) y volcarlo"""
+        if self.schema is not None and etree.QName(element).localname != HEADER_ELEMENT:
+            if self._envelope is None:
+                raise ValueError("La cabecera DAC8 debe escribirse antes que el resto de elementos")
+            # Se valida una copia: mover el elemento al sobre y sacarlo le deja
+            # un prefijo nsN redeclarado en cada volcado
+            candidate = copy.deepcopy(element)
+            summary = self._envelope[-1]
+            if etree.QName(element).localname == SUMMARY_ELEMENT:
+                self._envelope.replace(summary, candidate)
+                try:
+                    self._validate(candidate)
+                finally:
+                    self._envelope.replace(candidate, summary)
+            else:
+                summary.addprevious(candidate)
+                try:
+                    self._validate(candidate)
+                finally:
+                    self._envelope.remove(candidate)
+        self._file.write(element)
+        self._file.flush()
+
+    def _validate(self, element: etree._Element) -> None:
+        """Validar el sobre que contiene el elemento"""
+        if self.schema.validate(self._envelope):
+            return
+        error = self.schema.error_log.last_error
+        tx_id = element.findtext(self._tag('TxId'))
+        where = f" (transacción {tx_id})" if tx_id else ""
+        raise DAC8ValidationError(
+            f"Elemento {etree.QName(element).localname} inválido{where}: {error.message}"
+        )
+
+async def write_dac8_report(
+    user_id: str,
+    jurisdiction: str,
+    year: int,
+    output: BinaryIO,
+    validate: bool = True,
+    batch_size: Optional[int] = None
+) -> DAC8ReportSummary:
+    """
+    Generar el reporte DAC8 de un usuario y año directamente sobre un destino binario.
+
+    Las transacciones se leen del cursor de servidor por lotes y se
+    escriben (y validan) una a una: el pico de memoria es el de un lote.
+
+    Args:
+        user_id: ID del usuario
+        jurisdiction: Jurisdicción del usuario
+        year: Periodo de reporte
+        output: Destino binario (archivo, SpooledTemporaryFile...)
+        validate: Validar cada elemento contra el XSD configurado
+        batch_size: Filas por lote del cursor
+
+    Returns:
+        DAC8ReportSummary del documento escrito
+    """
+    schema = load_dac8_schema() if validate else None
+    batch_size = batch_size or get_settings().dac8_batch_size
+    start = datetime(year, 1, 1, tzinfo=timezone.utc)
+    end = datetime(year, 12, 31, 23, 59, 59, 999999, tzinfo=timezone.utc)
+
+    with DAC8StreamWriter(output, schema) as writer:
+        writer.write_header(user_id, jurisdiction, year)
+        async with AsyncSessionLocal() as session:
+            async for rows in TransactionRepository(session).stream_columns(
+                user_id, DAC8_COLUMNS, start, end, batch_size, kontorl_types=DAC8_REPORTABLE_TYPES
+            ):
+                for row in rows:
+                    writer.write_transaction(tuple(row))
+
+    logger.info(f"Reporte DAC8 {year} de {user_id}: {writer.transaction_count} transacciones, {writer.size_bytes} bytes")
+    return DAC8ReportSummary(
+        message_ref_id=writer.message_ref_id,
+        transaction_count=writer.transaction_count,
+        sha256=writer.sha256,
+        size_bytes=writer.size_bytes
+    )
+
+async def upload_dac8_report(user_id: str, jurisdiction: str, year: int, storage_service=None) -> DAC8ReportSummary:
+    """
+    Generar el reporte DAC8 en un archivo temporal y subirlo a storage.
+
+    El documento nunca se carga entero en memoria: se escribe a disco y se
+    sube desde el archivo.
+    """
+    from utils.supabase import SupabaseStorageService
+    storage_service = storage_service or SupabaseStorageService()
+
+    handle, local_path = tempfile.mkstemp(suffix='.xml', prefix='dac8-')
+    try:
+        with os.fdopen(handle, 'wb') as output:
+            summary = await write_dac8_report(user_id, jurisdiction, year, output)
+        summary.location = await storage_service.upload_local_file(
+            f"dac8/{user_id}/{year}/{summary.message_ref_id}.xml", local_path, content_type="application/xml"
+        )
+    finally:
+        os.unlink(local_path)
+    return summary
@@ -0,0 +1,217 @@
+"""
+KONTROL Bulk Loader
+Carga masiva de transacciones canónicas con COPY a una tabla de staging y merge ON CONFLICT
+"""
+
+import json
+import logging
+from dataclasses import dataclass
+from typing import Any, AsyncIterable, Awaitable, Callable, Iterable, Iterator, List, Optional, Tuple, Union
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from core.ingestion_service.models import CANONICAL_COLUMNS, CanonicalBatch
+from core.ingestion_service.tx_identity import assign_tx_ids
+
+logger = logging.getLogger(__name__)
+
+STAGING_TABLE = 'canonical_transactions_staging'
+
+# Columnas que se cargan (user_id + columnas canónicas)
+LOAD_COLUMNS = ('user_id',) + CANONICAL_COLUMNS
+
+# Columnas que actualiza una reimportación de una transacción ya existente;
+# tags/metadata se fusionan para no perder anotaciones del usuario
+_MERGE_COLUMNS = (
+    'tx_hash', 'timestamp_utc', 'tx_type', 'asset_in', 'asset_out',
+    'amount_in', 'amount_out', 'exchange_id', 'fiat_cost_basis_unit', 'exchange_rate', 'fees'
+)
+
+# El archivo sólo trae DEPOSIT/WITHDRAWAL: la clasificación del matching
+# engine (INTERNAL_TRANSFER_IN/OUT) se conserva al reimportar
+_MERGED_KONTORL_TYPE = """(CASE
+    WHEN canonical_transactions.kontorl_type IN ('INTERNAL_TRANSFER_IN', 'INTERNAL_TRANSFER_OUT')
+    THEN canonical_transactions.kontorl_type
+    ELSE EXCLUDED.kontorl_type
+END)"""
+
+_JSON_COLUMNS = frozenset({'tags', 'metadata'})
+
+# Tabla temporal sin restricciones con los tipos de canonical_transactions;
+# se vacía al confirmar cada transacción
+_CREATE_STAGING = f"""
+CREATE TEMP TABLE IF NOT EXISTS {STAGING_TABLE} ON COMMIT DELETE ROWS AS
+SELECT {', '.join(LOAD_COLUMNS)} FROM canonical_transactions WITH NO DATA
+"""
+
+# Fusión de tags (unión sin duplicados, como _APPLY_CATEGORIES de
+# metadata_sync) y de metadata (las claves importadas pisan a las guardadas)
+_MERGED_TAGS = """(
+    SELECT coalesce(jsonb_agg(DISTINCT element), '[]'::jsonb)
+    FROM jsonb_array_elements(
+        coalesce(canonical_transactions.tags, '[]'::jsonb) || coalesce(EXCLUDED.tags, '[]'::jsonb)
+    ) element
+)"""
+_MERGED_METADATA = (
+    "(coalesce(canonical_transactions.metadata, '{}'::jsonb) || coalesce(EXCLUDED.metadata, '{}'::jsonb))"
+)
+
+# Las filas que tras la fusión quedan idénticas a las ya guardadas no se
+# reescriben: no cambian updated_at ni invalidan la caché de reportes
+# (transaction_digests). RETURNING devuelve sólo las insertadas o
+# actualizadas (las que pasan al matching engine)
+_MERGE = f"""
+INSERT INTO canonical_transactions ({', '.join(LOAD_COLUMNS)})
+SELECT {', '.join(LOAD_COLUMNS)} FROM {STAGING_TABLE}
+ON CONFLICT (tx_id_kontrol) DO UPDATE SET
+    {', '.join(f'{column} = EXCLUDED.{column}' for column in _MERGE_COLUMNS)},
+    kontorl_type = {_MERGED_KONTORL_TYPE},
+    tags = {_MERGED_TAGS},
+    metadata = {_MERGED_METADATA}
+WHERE canonical_transactions.user_id = EXCLUDED.user_id
+  AND ({', '.join(f'canonical_transactions.{column}' for column in _MERGE_COLUMNS)},
+       canonical_transactions.kontorl_type,
+       coalesce(canonical_transactions.tags, '[]'::jsonb), coalesce(canonical_transactions.metadata, '{{}}'::jsonb))
+      IS DISTINCT FROM ({', '.join(f'EXCLUDED.{column}' for column in _MERGE_COLUMNS)},
+       {_MERGED_KONTORL_TYPE},
+       {_MERGED_TAGS}, {_MERGED_METADATA})
+RETURNING tx_id_kontrol
+"""
+
+@dataclass
+class LoadResult:
+    """
+    Resultado de una carga masiva.
+
+    Attributes:
+        rows: Filas enviadas con COPY
+        written: Filas insertadas o actualizadas
+        batches: Lotes confirmados
+    """
+    rows: int = 0
+    written: int = 0
+    batches: int = 0
+
+    @property
+    def unchanged(self) -> int:
+        """Filas que ya existían idénticas (o de otro usuario) y no se tocaron"""
+        return self.rows - self.written
+
+def _copy_records(user_id: str, batch: CanonicalBatch) -> Iterator[Tuple[Any, ...]]:
+    """Tuplas para COPY en el orden de LOAD_COLUMNS (JSON serializado)"""
+    json_positions = [index for index, column in enumerate(CANONICAL_COLUMNS) if column in _JSON_COLUMNS]
+    for record in batch.records():
+        record = list(record)
+        for index in json_positions:
+            if record[index] is not None:
+                record[index] = json.dumps(record[index], default=str)
+        yield (user_id, *record)
+
+class CanonicalTransactionLoader:
+    """
+    Cargador masivo de canonical_transactions.
+
+    Cada lote se vuelca con COPY binario (asyncpg copy_records_to_table) a
+    una tabla temporal y se fusiona con un único INSERT ... ON CONFLICT en
+    la misma transacción, que se confirma por lote.
+    """
+
+    def __init__(self, session: AsyncSession):
+        self.session = session
+
+    async def _driver_connection(self):
+        """
+        Conexión asyncpg de la transacción en curso, con la tabla de staging creada.
+
+        Tras cada commit la sesión puede devolver su conexión al pool, así
+        que se obtiene (y se asegura la staging, que es por conexión) en
+        cada lote. La staging se crea a través de SQLAlchemy: el adaptador
+        de asyncpg abre la transacción con la primera sentencia que ejecuta
+        él mismo, y sin ella el COPY se confirmaría solo y ON COMMIT DELETE
+        ROWS vaciaría la staging antes del merge.
+        """
+        connection = await self.session.connection()
+        await connection.execute(text(_CREATE_STAGING))
+        raw = await connection.get_raw_connection()
+        return raw.driver_connection
+
+    async def load_batch(self, user_id: str, batch: CanonicalBatch, commit: bool = True) -> int:
+        """
+        Cargar un lote.
+
+        Args:
+            user_id: ID del usuario
+            batch: Lote canónico
+            commit: Confirmar la transacción tras el merge
+
+        Returns:
+            Filas insertadas o actualizadas
+        """
+        return len(await self.merge_batch(user_id, batch, commit))
+
+    async def merge_batch(self, user_id: str, batch: CanonicalBatch, commit: bool = True) -> List[str]:
+        """
+        Cargar un lote y devolver los tx_id_kontrol de las filas insertadas o actualizadas.
+
+        Args:
+            user_id: ID del usuario
+            batch: Lote canónico
+            commit: Confirmar la transacción tras el merge
+        """
+        if not len(batch):
+            return []
+        frame = batch.frame
+        if frame['tx_id_kontrol'].isna().any():
+            # Lotes de orígenes que no calculan el id: mismo id determinista
+            # que daría el importador (origen tomado de metadata)
+            assign_tx_ids(frame, user_id, [(metadata or {}).get('source') for metadata in frame['metadata']])
+        driver = await self._driver_connection()
+        await driver.copy_records_to_table(
+            STAGING_TABLE, records=_copy_records(user_id, batch), columns=list(LOAD_COLUMNS)
+        )
+        written = [record['tx_id_kontrol'] for record in await driver.fetch(_MERGE)]
+        if commit:
+            await self.session.commit()
+        else:
+            # La transacción sigue abierta: vaciar la staging para el siguiente lote
+            await driver.execute(f"TRUNCATE {STAGING_TABLE}")
+        return written
+
+    async def load(
+        self,
+        user_id: str,
+        batches: Union[Iterable[CanonicalBatch], AsyncIterable[CanonicalBatch]],
+        on_written: Optional[Callable[[CanonicalBatch, List[str]], Awaitable[None]]] = None
+    ) -> LoadResult:
+        """
+        Cargar un flujo de lotes, confirmando cada uno.
+
+        Args:
+            user_id: ID del usuario
+            batches: Lotes canónicos (iterable síncrono o asíncrono)
+            on_written: Llamada tras confirmar cada lote con el lote y los
+                tx_id_kontrol escritos (p.ej. el matching incremental)
+
+        Returns:
+            LoadResult con filas enviadas y escritas
+        """
+        result = LoadResult()
+
+        async def consume(batch: CanonicalBatch) -> None:
+            written = await self.merge_batch(user_id, batch)
+            if on_written is not None and written:
+                await on_written(batch, written)
+            result.written += len(written)
+            result.rows += len(batch)
+            result.batches += 1
+
+        if hasattr(batches, '__aiter__'):
+            async for batch in batches:
+                await consume(batch)
+        else:
+            for batch in batches:
+                await consume(batch)
+
+        logger.info(f"Carga masiva de {user_id}: {result.rows} filas, {result.written} escritas en {result.batches} lotes")
+        return result
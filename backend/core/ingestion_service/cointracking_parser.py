@@ -0,0 +1,664 @@
+"""
+KONTROL Cointracking Parser
+Parser por chunks y vectorizado de exportaciones CSV de Cointracking a transacciones canónicas
+"""
+
+import io
+import logging
+import multiprocessing
+import os
+import re
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from contextlib import ExitStack
+from decimal import Decimal, InvalidOperation
+from functools import lru_cache
+from itertools import compress, islice
+from typing import Any, BinaryIO, Deque, Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from config.settings import get_settings
+from core.ingestion_service.models import (
+    CANONICAL_COLUMNS, CanonicalBatch, CointrackingData, CriticalMetadata, ImportValidationError, ParseError,
+    TransactionAnnotation, ValidationReport
+)
+from core.ingestion_service.normalization import get_normalization_index
+from core.ingestion_service.tx_identity import (
+    IdentityCounter, compute_tx_ids, digest_identities, identity_keys, tx_identities
+)
+from core.tax_engine.models import FIAT_CURRENCIES
+
+logger = logging.getLogger(__name__)
+
+SOURCE = 'cointracking'
+
+# Columnas obligatorias de la "Trade Table" de Cointracking
+REQUIRED_COLUMNS = ('Date', 'Type', 'Buy', 'Sell', 'Fee')
+
+# Formato de fecha de las exportaciones (día primero)
+DATE_FORMAT = '%d.%m.%Y %H:%M:%S'
+
+# Tipo Cointracking (en minúsculas) -> (tx_type, kontorl_type, lado)
+# lado: 'in' usa las columnas Buy, 'out' las Sell y 'trade' ambas (el
+# tipo final de un trade depende de qué lado es fiat)
+COINTRACKING_TYPES = {
+    'trade': ('SELL', 'EXCHANGE', 'trade'),
+    'deposit': ('TRANSFER', 'DEPOSIT', 'in'),
+    'withdrawal': ('TRANSFER', 'WITHDRAWAL', 'out'),
+    'income': ('REWARD', 'DEPOSIT', 'in'),
+    'income (non taxable)': ('REWARD', 'DEPOSIT', 'in'),
+    'interest income': ('REWARD', 'DEPOSIT', 'in'),
+    'lending income': ('REWARD', 'DEPOSIT', 'in'),
+    'reward / bonus': ('REWARD', 'DEPOSIT', 'in'),
+    'airdrop': ('REWARD', 'DEPOSIT', 'in'),
+    'gift/tip': ('REWARD', 'DEPOSIT', 'in'),
+    'staking': ('STAKING', 'DEPOSIT', 'in'),
+    'mining': ('MINING', 'DEPOSIT', 'in'),
+    'mining (commercial)': ('MINING', 'DEPOSIT', 'in'),
+    'spend': ('SELL', 'SALE', 'out'),
+    'gift': ('TRANSFER', 'WITHDRAWAL', 'out'),
+    'donation': ('TRANSFER', 'WITHDRAWAL', 'out'),
+    'lost': ('TRANSFER', 'WITHDRAWAL', 'out'),
+    'stolen': ('TRANSFER', 'WITHDRAWAL', 'out'),
+    'other fee': ('FEE', 'FEE_DEDUCTION', 'out'),
+}
+
+# Motivos de rechazo de filas, en orden de prioridad
+REJECTION_REASONS = ('unknown_type', 'invalid_date', 'invalid_amount', 'missing_amount', 'field_too_long')
+
+# Límites de las columnas de canonical_transactions
+MAX_AMOUNT = Decimal(10) ** 20
+MAX_ASSET_LENGTH = 20
+MAX_EXCHANGE_LENGTH = 100
+MAX_TX_HASH_LENGTH = 255
+
+_VALUE_COLUMN = re.compile(r'^(Buy|Sell) Value in (\w+)$')
+_TX_HASH_COLUMNS = ('Tx-ID', 'Trade-ID', 'Trade ID', 'Tx ID')
+
+def resolve_columns(columns: List[str]) -> Dict[str, str]:
+    """
+    Resolver la cabecera de una exportación a nombres internos.
+
+    Cointracking repite "Cur." tras Buy, Sell y Fee (pandas las renombra
+    a "Cur.", "Cur..1"...), así que cada divisa se asigna a la columna de
+    importe que la precede.
+
+    Raises:
+        ParseError: Si faltan columnas obligatorias
+    """
+    missing = [column for column in REQUIRED_COLUMNS if column not in columns]
+    if missing:
+        raise ParseError(f"Columnas faltantes: {missing}")
+
+    resolved = {name.lower(): name for name in REQUIRED_COLUMNS}
+    amount_column = None
+    for column in columns:
+        if column in ('Buy', 'Sell', 'Fee'):
+            amount_column = column.lower()
+        elif column.startswith('Cur.') and amount_column is not None:
+            resolved[f'{amount_column}_currency'] = column
+            amount_column = None
+        elif column in ('Exchange', 'Group', 'Comment'):
+            resolved[column.lower()] = column
+        elif column in _TX_HASH_COLUMNS and 'tx_hash' not in resolved:
+            resolved['tx_hash'] = column
+        else:
+            match = _VALUE_COLUMN.match(column)
+            if match:
+                resolved[f'{match.group(1).lower()}_value'] = column
+                resolved['value_currency'] = match.group(2)
+    return resolved
+
+def _iter_record_blocks(stream: BinaryIO, max_lines: int) -> Iterator[Tuple[bytes, int]]:
+    """
+    Cortar un CSV (sin cabecera) en bloques de unas max_lines líneas.
+
+    Un bloque sólo termina fuera de comillas (número par de comillas
+    acumuladas): si la última línea deja abierto un campo multilínea, se
+    añaden líneas hasta cerrarlo.
+
+    Yields:
+        (bytes del bloque, tamaño en bytes)
+    """
+    while True:
+        lines = list(islice(stream, max_lines))
+        if not lines:
+            return
+        block = b''.join(lines)
+        quotes = block.count(b'"')
+        while quotes % 2:
+            line = stream.readline()
+            if not line:
+                break
+            block += line
+            quotes += line.count(b'"')
+        yield block, len(block)
+
+def _iter_offset_blocks(stream: BinaryIO, max_lines: int, offset: int) -> Iterator[Tuple[bytes, int]]:
+    """Bloques con registros (los vacíos se saltan) y el byte en que termina cada uno"""
+    for block, size in _iter_record_blocks(stream, max_lines):
+        offset += size
+        if block.strip():
+            yield block, offset
+
+class _BoundedReader:
+    """Vista de las próximas `size` bytes de un stream, leída por líneas"""
+
+    def __init__(self, stream: BinaryIO, size: int):
+        self.stream = stream
+        self.remaining = size
+
+    def __iter__(self) -> '_BoundedReader':
+        return self
+
+    def __next__(self) -> bytes:
+        line = self.readline()
+        if not line:
+            raise StopIteration
+        return line
+
+    def readline(self) -> bytes:
+        if self.remaining <= 0:
+            return b''
+        line = self.stream.readline(self.remaining)
+        self.remaining -= len(line)
+        return line
+
+def _skip_bytes(stream: BinaryIO, count: int) -> None:
+    """Avanzar count bytes (seek si el stream lo permite)"""
+    if stream.seekable():
+        stream.seek(count, io.SEEK_CUR)
+        return
+    while count > 0:
+        data = stream.read(min(count, 1 << 20))
+        if not data:
+            break
+        count -= len(data)
+
+def _text_column(chunk: pd.DataFrame, column: Optional[str]) -> pd.Series:
+    """Columna de texto sin espacios, con '' como valor ausente"""
+    if column is None:
+        return pd.Series('', index=chunk.index, dtype=object)
+    return pd.Series(
+        [value.strip() if isinstance(value, str) else '' for value in chunk[column].to_numpy(dtype=object)],
+        index=chunk.index,
+        dtype=object
+    )
+
+def _parse_decimal(value: str) -> Any:
+    """Decimal finito, None si está vacío o _INVALID si no es numérico"""
+    if not value:
+        return None
+    try:
+        number = Decimal(value)
+    except InvalidOperation:
+        return _INVALID
+    return number if number.is_finite() else _INVALID
+
+_INVALID = object()
+
+def _decimal_column(values: pd.Series) -> pd.Series:
+    """
+    Convertir una columna de texto a Decimal exacto.
+
+    Los valores vacíos quedan como None; los no numéricos también, y se
+    marcan en el atributo `invalid` de la serie devuelta.
+    """
+    parsed = [_parse_decimal(value) for value in values.to_numpy(dtype=object)]
+    invalid = pd.Series([value is _INVALID for value in parsed], index=values.index, dtype=bool)
+    result = pd.Series(parsed, index=values.index, dtype=object)
+    if invalid.any():
+        result[invalid] = None
+    result.attrs['invalid'] = invalid
+    return result
+
+def _divide(numerator: pd.Series, denominator: pd.Series, mask: pd.Series) -> pd.Series:
+    """Cociente Decimal elemento a elemento donde mask y el divisor no es cero"""
+    mask = mask & numerator.notna() & denominator.notna()
+    mask &= denominator.where(mask, 1) != 0
+    result = pd.Series(None, index=numerator.index, dtype=object)
+    if mask.any():
+        result[mask] = numerator[mask] / denominator[mask]
+    return result
+
+def _out_of_range(values: pd.Series) -> pd.Series:
+    """Importes que no caben en DECIMAL(38, 18)"""
+    return pd.Series(
+        [value is not None and abs(value) >= MAX_AMOUNT for value in values.to_numpy(dtype=object)],
+        index=values.index,
+        dtype=bool
+    )
+
+class CointrackingBackupParser:
+    """
+    Parser de exportaciones de Cointracking.
+
+    Lee el CSV por chunks y normaliza cada chunk con operaciones de columna
+    (mapeo de tipos y lados, fechas, importes y comisiones), produciendo
+    lotes canónicos a medida que avanza la lectura.
+
+    Attributes:
+        timezone: Zona horaria en que Cointracking exportó las fechas
+        chunk_size: Filas por chunk
+        user_id: Usuario importador; si se indica, cada lote sale con su
+            tx_id_kontrol determinista (ver tx_identity)
+        fail_fast: Abortar en el primer lote con filas rechazadas en lugar
+            de descartarlas y seguir (el informe va en cada lote)
+    """
+
+    def __init__(self, timezone: str = 'UTC', chunk_size: int = 10000, user_id: Optional[str] = None, fail_fast: bool = False):
+        self.timezone = timezone
+        self.chunk_size = chunk_size
+        self.user_id = user_id
+        self.fail_fast = fail_fast
+        self.supported_formats = ['csv', 'backup']
+
+    def iter_csv_batches(
+        self,
+        source: Union[str, BinaryIO],
+        encoding: str = 'utf-8-sig',
+        start_offset: int = 0,
+        start_row: int = 0,
+        workers: int = 1,
+        identity_changes: Optional[Sequence[bytes]] = None
+    ) -> Iterator[CanonicalBatch]:
+        """
+        Recorrer una exportación CSV como lotes canónicos.
+
+        El archivo se corta en bloques de chunk_size registros en límites de
+        línea (respetando campos entre comillas), de modo que cada lote
+        conoce el byte exacto en que termina y una importación interrumpida
+        puede reanudarse desde ahí (start_offset/start_row de un checkpoint).
+
+        Con workers > 1 los bloques se normalizan en un pool de procesos
+        (con unos pocos bloques en vuelo por proceso) y se devuelven en el
+        orden del archivo: el resultado es idéntico al secuencial.
+
+        Con user_id, las repeticiones exactas de una transacción se numeran
+        en el orden de todo el archivo (IdentityCounter), de modo que los
+        ids no dependen de chunk_size ni de workers. Cada lote lleva los
+        cambios del contador (CanonicalBatch.identity_changes); al reanudar,
+        el contador se reconstruye con los guardados hasta el checkpoint o,
+        si no se pasan, volviendo a parsear lo ya importado.
+
+        Args:
+            source: Ruta o stream binario del CSV
+            encoding: Codificación del archivo
+            start_offset: Byte desde el que reanudar (CanonicalBatch.byte_offset)
+            start_row: Filas ya consumidas hasta start_offset (CanonicalBatch.rows_read)
+            workers: Procesos para normalizar bloques (1 = en este proceso)
+            identity_changes: identity_changes de los lotes hasta start_offset
+
+        La validación de filas va en la misma pasada: la cabecera se
+        comprueba antes del primer bloque y cada lote trae su informe de
+        filas rechazadas (CanonicalBatch.report).
+
+        Yields:
+            CanonicalBatch por cada bloque leído
+
+        Raises:
+            ParseError: Si el archivo no es un CSV de Cointracking válido
+            ImportValidationError: En modo fail_fast, con el informe del
+                primer lote con filas rechazadas
+        """
+        with ExitStack() as stack:
+            stream = stack.enter_context(open(source, 'rb')) if isinstance(source, str) else source
+            try:
+                header = stream.readline()
+                names = list(pd.read_csv(io.BytesIO(header), encoding=encoding, nrows=0).columns)
+                columns = resolve_columns(names)
+                offset = len(header)
+                # El BOM sólo puede estar en la cabecera
+                block_encoding = 'utf-8' if encoding.lower().replace('_', '-') == 'utf-8-sig' else encoding
+                counter = IdentityCounter() if self.user_id is not None else None
+                if start_offset > offset:
+                    if counter is not None and identity_changes is None:
+                        # Checkpoint sin estado del contador: se cuenta lo ya importado
+                        prefix = _iter_offset_blocks(_BoundedReader(stream, start_offset - offset), self.chunk_size, offset)
+                        for batch, _ in self._parse_blocks(prefix, names, columns, block_encoding, workers):
+                            counter.ordinals(batch.identity_keys)
+                    else:
+                        _skip_bytes(stream, start_offset - offset)
+                        if counter is not None:
+                            counter = IdentityCounter.restore(identity_changes)
+                    offset = start_offset
+
+                blocks = _iter_offset_blocks(stream, self.chunk_size, offset)
+                rows_read = start_row
+                for batch, end_offset in self._parse_blocks(blocks, names, columns, block_encoding, workers):
+                    batch.shift_rows(rows_read)
+                    rows_read = batch.rows_read
+                    batch.byte_offset = end_offset
+                    if counter is not None:
+                        self._number_repeats(batch, counter)
+                        batch.identity_changes = counter.take_changes()
+                    if self.fail_fast and batch.report.total:
+                        raise ImportValidationError(batch.report)
+                    yield batch
+            except ParseError:
+                raise
+            except (ValueError, UnicodeDecodeError, pd.errors.ParserError) as e:
+                raise ParseError(f"Error parsing CSV backup: {str(e)}")
+
+    def parse_block(self, block: bytes, names: List[str], columns: Dict[str, str], encoding: str = 'utf-8') -> CanonicalBatch:
+        """
+        Normalizar un bloque de registros CSV sin cabecera.
+
+        Las filas se numeran desde 1 dentro del bloque (ver CanonicalBatch.shift_rows).
+        """
+        chunk = pd.read_csv(
+            io.BytesIO(block),
+            encoding=encoding,
+            header=None,
+            names=names,
+            dtype=object,
+            keep_default_na=False
+        )
+        return self.convert_chunk(chunk, columns)
+
+    def _parse_blocks(
+        self,
+        blocks: Iterator[Tuple[bytes, int]],
+        names: List[str],
+        columns: Dict[str, str],
+        encoding: str,
+        workers: int
+    ) -> Iterator[Tuple[CanonicalBatch, int]]:
+        """Normalizar bloques (en el pool si workers > 1), en el orden del archivo"""
+        if workers > 1:
+            return self._parse_blocks_in_pool(blocks, names, columns, encoding, workers)
+        return ((self.parse_block(block, names, columns, encoding), end_offset) for block, end_offset in blocks)
+
+    def _number_repeats(self, batch: CanonicalBatch, counter: IdentityCounter) -> None:
+        """
+        Renumerar las repeticiones de un lote con su ordinal en el archivo.
+
+        Cada bloque se parsea por separado y numera sus repeticiones desde
+        cero; sólo las filas con ordinal > 0 en el archivo (pocas) se
+        vuelven a calcular aquí.
+        """
+        ordinals = counter.ordinals(batch.identity_keys)
+        repeats = np.flatnonzero(ordinals)
+        if len(repeats):
+            batch.frame.loc[repeats, 'tx_id_kontrol'] = compute_tx_ids(
+                batch.frame.iloc[repeats], self.user_id, SOURCE, ordinals[repeats]
+            )
+
+    def _parse_blocks_in_pool(
+        self,
+        blocks: Iterator[Tuple[bytes, int]],
+        names: List[str],
+        columns: Dict[str, str],
+        encoding: str,
+        workers: int
+    ) -> Iterator[Tuple[CanonicalBatch, int]]:
+        """Normalizar bloques en el pool de procesos, devolviéndolos en orden"""
+        pool = get_parse_pool(workers)
+        pending: Deque[Tuple[Future, int]] = deque()
+        try:
+            for block, end_offset in blocks:
+                pending.append((pool.submit(_parse_block, self, block, names, columns, encoding), end_offset))
+                if len(pending) >= workers * BLOCKS_PER_WORKER:
+                    future, offset = pending.popleft()
+                    yield future.result(), offset
+            while pending:
+                future, offset = pending.popleft()
+                yield future.result(), offset
+        finally:
+            for future, _ in pending:
+                future.cancel()
+
+    def parse_full_backup(self, source: Union[str, BinaryIO], workers: Optional[int] = None) -> CointrackingData:
+        """
+        Parsear un backup completo repartiendo los bloques en el pool de procesos.
+
+        Args:
+            source: Ruta o stream binario del backup
+            workers: Procesos (por defecto IMPORT_PARSE_WORKERS, 0 = uno por CPU)
+        """
+        workers = workers or get_settings().import_parse_workers or os.cpu_count() or 1
+        return self._collect(self.iter_csv_batches(source, workers=workers), 'backup')
+
+    def parse_backup(self, source: Union[str, BinaryIO], file_type: str = 'csv') -> CointrackingData:
+        """
+        Parsear un backup según su formato.
+
+        Args:
+            source: Ruta o stream binario (p.ej. SpooledUpload.stream()); el
+                contenido nunca se copia entero a memoria
+            file_type: Formato del archivo ('csv' en este proceso, 'backup'
+                en el pool de procesos)
+
+        Raises:
+            ValueError: Si el formato no está soportado
+        """
+        if file_type == 'backup':
+            return self.parse_full_backup(source)
+        if file_type not in self.supported_formats:
+            raise ValueError(f"Formato no soportado: {file_type}")
+        return self.parse_csv_backup(source)
+
+    def parse_csv_backup(self, source: Union[str, BinaryIO]) -> CointrackingData:
+        """Parsear una exportación completa (para archivos pequeños; ver iter_csv_batches)"""
+        return self._collect(self.iter_csv_batches(source), 'csv')
+
+    def extract_critical_metadata(self, data: CointrackingData) -> CriticalMetadata:
+        """
+        Extraer las categorías (Group) y notas (Comment) de las transacciones importadas.
+
+        Sólo se recogen las filas anotadas; las wallets no vienen en la
+        exportación de operaciones y se añaden aparte.
+        """
+        metadata = CriticalMetadata()
+        for batch in data.batches:
+            frame = batch.frame
+            comments = [row_metadata.get('comment') for row_metadata in frame['metadata']]
+            annotated = [bool(tags) or bool(comment) for tags, comment in zip(frame['tags'], comments)]
+            for row, comment in zip(frame[annotated].itertuples(index=False), compress(comments, annotated)):
+                metadata.annotations.append(TransactionAnnotation(
+                    timestamp_utc=row.timestamp_utc,
+                    asset_in=row.asset_in,
+                    amount_in=row.amount_in,
+                    asset_out=row.asset_out,
+                    amount_out=row.amount_out,
+                    categories=list(row.tags),
+                    note=comment
+                ))
+        return metadata
+
+    def _collect(self, batches: Iterator[CanonicalBatch], file_type: str) -> CointrackingData:
+        data = CointrackingData(batches=list(batches), file_type=file_type)
+        report = ValidationReport()
+        for batch in data.batches:
+            report.merge(batch.report)
+        data.metadata = {
+            'source': SOURCE,
+            'rows': data.batches[-1].rows_read if data.batches else 0,
+            'transactions': data.transaction_count,
+            'skipped': report.total,
+            'validation': report.to_dict()
+        }
+        return data
+
+    def convert_chunk(self, chunk: pd.DataFrame, columns: Dict[str, str], first_row: int = 1) -> CanonicalBatch:
+        """
+        Normalizar un chunk de la exportación a columnas canónicas.
+
+        Args:
+            chunk: Filas del CSV (todas las columnas como texto)
+            columns: Cabecera resuelta (ver resolve_columns)
+            first_row: Número de fila de datos de la primera fila del chunk
+
+        Returns:
+            CanonicalBatch con las filas importables del chunk
+        """
+        chunk = chunk.reset_index(drop=True)
+        source_rows = pd.Series(np.arange(first_row, first_row + len(chunk)))
+
+        # Tipo y lado
+        type_key = _text_column(chunk, columns['type']).str.lower()
+        tx_type = type_key.map({key: spec[0] for key, spec in COINTRACKING_TYPES.items()})
+        kontorl_type = type_key.map({key: spec[1] for key, spec in COINTRACKING_TYPES.items()})
+        side = type_key.map({key: spec[2] for key, spec in COINTRACKING_TYPES.items()})
+
+        # Importes y divisas
+        buy = _decimal_column(_text_column(chunk, columns['buy']))
+        sell = _decimal_column(_text_column(chunk, columns['sell']))
+        fee = _decimal_column(_text_column(chunk, columns['fee']))
+        assets = get_normalization_index().assets
+        buy_currency = assets.normalize(_text_column(chunk, columns.get('buy_currency'))).fillna('')
+        sell_currency = assets.normalize(_text_column(chunk, columns.get('sell_currency'))).fillna('')
+        fee_currency = assets.normalize(_text_column(chunk, columns.get('fee_currency'))).fillna('')
+
+        uses_buy = side.isin(('in', 'trade'))
+        uses_sell = side.isin(('out', 'trade'))
+
+        # Trades contra fiat: compra (fiat -> cripto) o venta (cripto -> fiat)
+        is_trade = side == 'trade'
+        buy_fiat = buy_currency.isin(FIAT_CURRENCIES)
+        sell_fiat = sell_currency.isin(FIAT_CURRENCIES)
+        fiat_purchase = is_trade & sell_fiat & ~buy_fiat
+        fiat_sale = is_trade & buy_fiat & ~sell_fiat
+        tx_type = tx_type.mask(fiat_purchase, 'BUY')
+        kontorl_type = kontorl_type.mask(fiat_purchase, 'TRADE').mask(fiat_sale, 'SALE')
+
+        # Precios en fiat: del propio trade o de las columnas de valoración
+        fiat_cost_basis_unit = _divide(sell, buy, fiat_purchase)
+        exchange_rate = _divide(buy, sell, fiat_sale)
+        if 'buy_value' in columns:
+            buy_value = _decimal_column(_text_column(chunk, columns['buy_value']))
+            fiat_cost_basis_unit = fiat_cost_basis_unit.where(
+                fiat_cost_basis_unit.notna(), _divide(buy_value, buy, uses_buy & ~fiat_purchase & ~fiat_sale)
+            )
+        if 'sell_value' in columns:
+            sell_value = _decimal_column(_text_column(chunk, columns['sell_value']))
+            exchange_rate = exchange_rate.where(
+                exchange_rate.notna(), _divide(sell_value, sell, uses_sell & ~fiat_purchase & ~fiat_sale)
+            )
+
+        # Fechas en la zona horaria de la cuenta -> UTC
+        raw_dates = _text_column(chunk, columns['date'])
+        timestamps = pd.to_datetime(raw_dates, format=DATE_FORMAT, errors='coerce')
+        retry = timestamps.isna() & (raw_dates != '')
+        if retry.any():
+            timestamps[retry] = pd.to_datetime(raw_dates[retry], dayfirst=True, errors='coerce', format='mixed')
+        localized = timestamps.dt.tz_localize(self.timezone, ambiguous='NaT', nonexistent='shift_forward')
+        # Horas repetidas al volver al horario estándar: se toma la primera
+        # (horario de verano, como fold=0 en Python) y la fila queda avisada
+        ambiguous = localized.isna() & timestamps.notna()
+        if ambiguous.any():
+            localized = timestamps.dt.tz_localize(
+                self.timezone, ambiguous=np.ones(len(timestamps), dtype=bool), nonexistent='shift_forward'
+            )
+        timestamps = localized.dt.tz_convert('UTC')
+
+        exchange = _text_column(chunk, columns.get('exchange'))
+        group = _text_column(chunk, columns.get('group'))
+        comment = _text_column(chunk, columns.get('comment'))
+        tx_hash = _text_column(chunk, columns.get('tx_hash'))
+        exchange_id = get_normalization_index().exchanges.normalize(exchange)
+
+        # Validación con máscaras por motivo: cada fila rechazada cuenta en el
+        # primer motivo que falla (orden de REJECTION_REASONS)
+        checks = {
+            'unknown_type': tx_type.isna(),
+            'invalid_date': timestamps.isna(),
+            'invalid_amount': (
+                buy.attrs['invalid'] | sell.attrs['invalid'] | fee.attrs['invalid']
+                | _out_of_range(buy) | _out_of_range(sell) | _out_of_range(fee)
+            ),
+            'missing_amount': (
+                (uses_buy & (buy.isna() | (buy_currency == '')))
+                | (uses_sell & (sell.isna() | (sell_currency == '')))
+            ),
+            'field_too_long': (
+                (buy_currency.str.len() > MAX_ASSET_LENGTH)
+                | (sell_currency.str.len() > MAX_ASSET_LENGTH)
+                | (fee_currency.str.len() > MAX_ASSET_LENGTH)
+                | (exchange_id.str.len() > MAX_EXCHANGE_LENGTH).fillna(False)
+                | (tx_hash.str.len() > MAX_TX_HASH_LENGTH)
+            ),
+        }
+        report = ValidationReport()
+        rejected = pd.Series(False, index=chunk.index)
+        for reason in REJECTION_REASONS:
+            failed = checks[reason] & ~rejected
+            if failed.any():
+                report.add(reason, source_rows[failed].tolist())
+                rejected |= failed
+        valid = ~rejected
+
+        frame = pd.DataFrame({
+            'tx_id_kontrol': None,
+            'tx_hash': tx_hash.where(tx_hash != '', None),
+            'timestamp_utc': timestamps,
+            'tx_type': tx_type,
+            'kontorl_type': kontorl_type,
+            'asset_in': buy_currency.where(uses_buy, None),
+            'asset_out': sell_currency.where(uses_sell, None),
+            'amount_in': buy.where(uses_buy, None),
+            'amount_out': sell.where(uses_sell, None),
+            'exchange_id': exchange_id,
+            'fiat_cost_basis_unit': fiat_cost_basis_unit,
+            'exchange_rate': exchange_rate,
+            'fees': fee.where(fee.notna(), Decimal('0')),
+            'tags': [[value] if value else [] for value in group],
+            'metadata': [
+                _row_metadata(row, fee_asset, comment_text, value_currency=columns.get('value_currency'))
+                for row, fee_asset, comment_text in zip(source_rows, fee_currency, comment)
+            ],
+        }, columns=list(CANONICAL_COLUMNS))
+
+        if ambiguous.any():
+            noted = (ambiguous & valid).to_numpy()
+            for position in np.flatnonzero(noted):
+                frame['metadata'].iloc[position]['ambiguous_time'] = True
+            report.note('ambiguous_time', source_rows[noted].tolist())
+
+        frame = frame[valid].reset_index(drop=True)
+        keys = None
+        if self.user_id is not None:
+            identities = tx_identities(frame, self.user_id, SOURCE)
+            frame['tx_id_kontrol'] = digest_identities(identities)
+            keys = identity_keys(identities)
+        if report.total:
+            logger.debug(f"Chunk desde fila {first_row}: {report.summary()}")
+
+        return CanonicalBatch(
+            frame=frame,
+            source_rows=source_rows[valid].tolist(),
+            rows_read=first_row - 1 + len(chunk),
+            skipped=report.total,
+            report=report,
+            identity_keys=keys
+        )
+
+def _row_metadata(source_row: int, fee_asset: str, comment: str, value_currency: Optional[str] = None) -> Dict[str, Any]:
+    """Metadatos de origen de una fila importada"""
+    metadata: Dict[str, Any] = {'source': SOURCE, 'source_row': int(source_row)}
+    if fee_asset:
+        metadata['fee_asset'] = fee_asset
+    if comment:
+        metadata['comment'] = comment
+    if value_currency:
+        metadata['fiat_currency'] = value_currency
+    return metadata
+
+# Bloques en vuelo por proceso del pool de parseo
+BLOCKS_PER_WORKER = 2
+
+@lru_cache(maxsize=None)
+def get_parse_pool(workers: int) -> ProcessPoolExecutor:
+    """
+    Pool de procesos de parseo (uno por tamaño, compartido por todo el proceso).
+
+    spawn: los procesos no heredan el bucle de eventos ni las conexiones del
+    proceso de la API.
+    """
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+
+def _parse_block(parser: CointrackingBackupParser, block: bytes, names: List[str], columns: Dict[str, str], encoding: str) -> CanonicalBatch:
+    """Punto de entrada en el proceso worker"""
+    return parser.parse_block(block, names, columns, encoding)
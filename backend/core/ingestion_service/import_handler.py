@@ -0,0 +1,311 @@
+"""
+KONTROL Import Handler
+Importación de backups de Cointracking a canonical_transactions
+"""
+
+import asyncio
+import io
+import logging
+import os
+from contextlib import aclosing
+from dataclasses import dataclass, field
+from typing import AsyncIterator, BinaryIO, Iterable, Iterator, List, Optional, Sequence, TypeVar, Union
+
+from config.settings import get_settings
+from core.ingestion_service.bulk_loader import CanonicalTransactionLoader, LoadResult
+from core.ingestion_service.cointracking_parser import CointrackingBackupParser
+from core.ingestion_service.metadata_sync import MetadataSync, MetadataSyncResult
+from core.ingestion_service.models import CanonicalBatch, CointrackingData, ValidationReport, WalletLabel
+from core.matching_engine.internal_transfers import INFLOW_TYPE, OUTFLOW_TYPE
+from core.matching_engine.service import MatchingEngineService
+from utils.database import AsyncSessionLocal, SyncJobRepository
+from utils.uploads import SpooledUpload
+
+logger = logging.getLogger(__name__)
+
+IMPORT_JOB_TYPE = 'csv_import'
+
+T = TypeVar('T')
+_EXHAUSTED = object()
+
+@dataclass
+class ImportResult:
+    """
+    Resultado de una importación con seguimiento en sync_jobs.
+
+    Attributes:
+        job_id: ID del SyncJob
+        load: Filas enviadas y escritas en esta ejecución
+        rows_read: Filas del archivo consumidas en total
+        resumed_from_row: Fila del checkpoint desde la que se reanudó (0 si no)
+        report: Filas rechazadas en esta ejecución
+    """
+    job_id: str
+    load: LoadResult
+    rows_read: int
+    resumed_from_row: int = 0
+    report: ValidationReport = field(default_factory=ValidationReport)
+
+def _source_size(source: Union[str, BinaryIO]) -> Optional[int]:
+    """Tamaño en bytes del origen (None si no se puede saber sin leerlo)"""
+    if isinstance(source, str):
+        return os.path.getsize(source)
+    if source.seekable():
+        position = source.tell()
+        size = source.seek(0, io.SEEK_END)
+        source.seek(position)
+        return size
+    return None
+
+async def iterate_off_loop(iterator: Iterator[T]) -> AsyncIterator[T]:
+    """
+    Consumir un iterador bloqueante (lectura y parseo) en el pool de hilos.
+
+    El bucle de eventos queda libre mientras se lee y normaliza cada lote,
+    así que una importación grande no bloquea el resto de peticiones del worker.
+
+    Al terminar (también por cancelación) se espera al next() en curso y el
+    iterador se cierra en el pool: cerrarlo mientras otro hilo lo avanza
+    falla con "generator already executing". Usar con contextlib.aclosing
+    para que el cierre ocurra al salir del bucle y no al recolectarlo.
+    """
+    loop = asyncio.get_running_loop()
+    pending = None
+    try:
+        while True:
+            pending = loop.run_in_executor(None, next, iterator, _EXHAUSTED)
+            # shield: una cancelación no abandona el next() que sigue en el hilo
+            item = await asyncio.shield(pending)
+            if item is _EXHAUSTED:
+                return
+            yield item
+    finally:
+        if pending is not None:
+            await asyncio.wait([pending])
+        close = getattr(iterator, 'close', None)
+        if close is not None:
+            await loop.run_in_executor(None, close)
+
+class ImportHandler:
+    """
+    Orquestador de importaciones.
+
+    Los lotes del parser se cargan a medida que se producen: la memoria
+    queda acotada por IMPORT_CHUNK_SIZE. El parseo corre fuera del bucle
+    de eventos, en el pool de procesos (IMPORT_PARSE_WORKERS) si el archivo
+    llega a IMPORT_PARALLEL_MIN_MB. En las importaciones con SyncJob
+    cada lote se confirma junto con su checkpoint (byte y fila del archivo,
+    y el estado del contador de identidades), así que un trabajo
+    interrumpido se reanuda justo tras el último lote confirmado, sin
+    releer ni duplicar filas.
+
+    Tras confirmar cada lote, las retiradas y depósitos escritos pasan al
+    matching incremental (MatchingEngineService.match_new_transactions).
+    """
+
+    def __init__(self, session=None):
+        self.session = session
+        self.settings = get_settings()
+
+    async def migrate_transactions(self, user_id: str, batches: Iterable[CanonicalBatch]) -> LoadResult:
+        """
+        Cargar lotes canónicos con COPY + merge ON CONFLICT.
+
+        Args:
+            user_id: ID del usuario
+            batches: Lotes canónicos en el orden del archivo
+
+        Returns:
+            LoadResult con filas enviadas y escritas
+        """
+        if self.session is not None:
+            return await self._load(self.session, user_id, batches)
+        async with AsyncSessionLocal() as session:
+            return await self._load(session, user_id, batches)
+
+    async def _load(self, session, user_id: str, batches: Iterable[CanonicalBatch]) -> LoadResult:
+        async def match(batch: CanonicalBatch, written: List[str]) -> None:
+            await self._match_written(session, user_id, batch, written)
+
+        return await CanonicalTransactionLoader(session).load(user_id, batches, on_written=match)
+
+    async def _match_written(self, session, user_id: str, batch: CanonicalBatch, written: List[str]) -> None:
+        """
+        Emparejar las retiradas y depósitos escritos de un lote ya confirmado.
+
+        Un fallo aquí no deshace la importación: lo que quede sin emparejar
+        lo recoge la reconciliación completa (reconcile_internal_transfers).
+        """
+        frame = batch.frame
+        movements = frame[frame['tx_id_kontrol'].isin(written) & frame['kontorl_type'].isin((OUTFLOW_TYPE, INFLOW_TYPE))]
+        if not len(movements):
+            return
+        rows = movements.astype(object).where(movements.notna(), None).to_dict('records')
+        try:
+            await MatchingEngineService(session).match_new_transactions(user_id, rows)
+        except Exception as e:
+            await session.rollback()
+            logger.error(f"Matching incremental de {user_id} fallido tras la fila {batch.rows_read}: {e}")
+
+    async def enrich_automated_sync(
+        self,
+        user_id: str,
+        data: CointrackingData,
+        wallet_labels: Sequence[WalletLabel] = ()
+    ) -> MetadataSyncResult:
+        """
+        Trasladar las categorías, notas y etiquetas de un backup a la sincronización automática.
+
+        Args:
+            user_id: ID del usuario
+            data: Backup parseado
+            wallet_labels: Etiquetas de wallets del backup
+        """
+        metadata = CointrackingBackupParser().extract_critical_metadata(data)
+        metadata.wallet_labels.extend(wallet_labels)
+        if self.session is not None:
+            return await MetadataSync(self.session).enrich_automated_sync(user_id, metadata)
+        async with AsyncSessionLocal() as session:
+            return await MetadataSync(session).enrich_automated_sync(user_id, metadata)
+
+    async def handle_cointracking_import(
+        self,
+        user_id: str,
+        source: Union[str, BinaryIO],
+        timezone: str = 'UTC',
+        chunk_size: Optional[int] = None,
+        job_id: Optional[str] = None,
+        target_id: Optional[str] = None,
+        fail_fast: Optional[bool] = None
+    ) -> ImportResult:
+        """
+        Importar una exportación CSV de Cointracking con checkpoints.
+
+        Args:
+            user_id: ID del usuario
+            source: Ruta o stream binario del CSV (el mismo archivo al reanudar)
+            timezone: Zona horaria de las fechas del archivo
+            chunk_size: Filas por lote (por defecto IMPORT_CHUNK_SIZE)
+            job_id: SyncJob a reanudar; si no se indica se crea uno nuevo
+            target_id: Identificador del archivo guardado en el SyncJob nuevo
+            fail_fast: Abortar ante la primera fila inválida (por defecto
+                IMPORT_FAIL_FAST); si no, se descartan y se informan
+
+        Returns:
+            ImportResult con el SyncJob, los totales y las filas rechazadas
+
+        Raises:
+            ValueError: Si el SyncJob no existe o no es una importación del usuario
+            ImportValidationError: En modo fail-fast (el SyncJob queda como failed)
+        """
+        parser = CointrackingBackupParser(
+            timezone=timezone,
+            chunk_size=chunk_size or self.settings.import_chunk_size,
+            user_id=user_id,
+            fail_fast=self.settings.import_fail_fast if fail_fast is None else fail_fast
+        )
+        if self.session is not None:
+            return await self._run_import(self.session, parser, user_id, source, job_id, target_id)
+        async with AsyncSessionLocal() as session:
+            return await self._run_import(session, parser, user_id, source, job_id, target_id)
+
+    async def handle_upload(self, user_id: str, upload: SpooledUpload, timezone: str = 'UTC') -> ImportResult:
+        """
+        Importar un archivo recibido con SpooledUpload.
+
+        El checksum del archivo identifica el trabajo: volver a subir el
+        mismo archivo tras un fallo reanuda su SyncJob en lugar de empezar
+        de cero (el merge es idempotente, así que una reanudación duplicada
+        no duplica filas).
+
+        Args:
+            user_id: ID del usuario
+            upload: Subida ya recibida (se lee como stream, sin copiarla a memoria)
+            timezone: Zona horaria de las fechas del archivo
+        """
+        if self.session is not None:
+            job = await SyncJobRepository(self.session).get_resumable(user_id, IMPORT_JOB_TYPE, upload.sha256)
+        else:
+            async with AsyncSessionLocal() as session:
+                job = await SyncJobRepository(session).get_resumable(user_id, IMPORT_JOB_TYPE, upload.sha256)
+        return await self.handle_cointracking_import(
+            user_id,
+            upload.stream(),
+            timezone=timezone,
+            job_id=str(job.id) if job is not None else None,
+            target_id=upload.sha256
+        )
+
+    def parse_workers(self, total_bytes: Optional[int]) -> int:
+        """
+        Procesos de parseo para un archivo.
+
+        Arrancar el pool (spawn) cuesta más que parsear un archivo pequeño:
+        por debajo de IMPORT_PARALLEL_MIN_MB se parsea en un solo proceso.
+        """
+        if total_bytes is not None and total_bytes < self.settings.import_parallel_min_mb * 1024 * 1024:
+            return 1
+        return self.settings.import_parse_workers or os.cpu_count() or 1
+
+    async def _run_import(self, session, parser, user_id, source, job_id, target_id) -> ImportResult:
+        jobs = SyncJobRepository(session)
+        loader = CanonicalTransactionLoader(session)
+        total_bytes = _source_size(source)
+
+        if job_id is None:
+            target_id = target_id or (os.path.basename(source) if isinstance(source, str) else None)
+            job = await jobs.create_job(user_id, IMPORT_JOB_TYPE, target_id, total_bytes)
+            job_id = str(job.id)
+            start_offset = start_row = 0
+            identity_changes = None
+        else:
+            job = await jobs.get_job(job_id)
+            if job is None or str(job.user_id) != str(user_id) or job.job_type != IMPORT_JOB_TYPE:
+                raise ValueError(f"Trabajo de importación no encontrado: {job_id}")
+            start_offset, start_row = job.checkpoint_offset or 0, job.checkpoint_row or 0
+            if job.status == 'completed':
+                return ImportResult(job_id, LoadResult(), start_row, start_row)
+            identity_changes = await jobs.get_identity_changes(job_id, start_offset) if start_offset else None
+            await jobs.set_status(job_id, 'running')
+            logger.info(f"Reanudando importación {job_id} desde la fila {start_row} (byte {start_offset})")
+
+        result = ImportResult(job_id, LoadResult(), start_row, start_row)
+        batches = parser.iter_csv_batches(
+            source,
+            start_offset=start_offset,
+            start_row=start_row,
+            workers=self.parse_workers(total_bytes),
+            identity_changes=identity_changes
+        )
+        try:
+            async with aclosing(iterate_off_loop(batches)) as stream:
+                async for batch in stream:
+                    written = await loader.merge_batch(user_id, batch, commit=False)
+                    result.load.written += len(written)
+                    result.load.rows += len(batch)
+                    result.load.batches += 1
+                    result.rows_read = batch.rows_read
+                    result.report.merge(batch.report)
+                    progress = min(99, batch.byte_offset * 100 // total_bytes) if total_bytes else 0
+                    await jobs.save_checkpoint(
+                        job_id, batch.byte_offset, batch.rows_read, batch.rows_read, progress, batch.identity_changes
+                    )
+                    await session.commit()
+                    await self._match_written(session, user_id, batch, written)
+        except Exception as e:
+            await session.rollback()
+            logger.error(f"Importación {job_id} interrumpida tras la fila {result.rows_read}: {e}")
+            await jobs.set_status(job_id, 'failed', error_message=str(e))
+            raise
+
+        await jobs.clear_identity_changes(job_id)
+        await jobs.set_status(job_id, 'completed', progress=100, total_items=result.rows_read)
+        logger.info(
+            f"Importación Cointracking {job_id} de {user_id}: {result.load.written} transacciones nuevas o "
+            f"modificadas, {result.load.unchanged} sin cambios"
+        )
+        if result.report.total:
+            logger.warning(f"Importación {job_id}: filas rechazadas: {result.report.summary()}")
+        if result.report.notices:
+            logger.info(f"Importación {job_id}: filas con aviso: {result.report.notice_summary()}")
+        return result
@@ -0,0 +1,201 @@
+"""
+KONTROL Metadata Sync
+Aplicación masiva (set-based) de metadatos históricos de Cointracking a wallets y transacciones
+"""
+
+import json
+import logging
+from dataclasses import dataclass
+from typing import Dict, List, Sequence, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from core.ingestion_service.cointracking_parser import SOURCE
+from core.ingestion_service.models import CriticalMetadata, TransactionAnnotation, WalletLabel
+
+logger = logging.getLogger(__name__)
+
+# Clave de metadata donde se guarda la nota histórica
+NOTE_KEY = 'historical_note'
+
+# Cada tipo de metadato se aplica en su propia transacción: COPY a una tabla
+# temporal (que desaparece al confirmar) y un único UPDATE ... FROM
+
+_WALLET_LABEL_STAGING = """
+CREATE TEMP TABLE wallet_label_staging (
+    address TEXT NOT NULL,
+    blockchain TEXT,
+    label TEXT NOT NULL
+) ON COMMIT DROP
+"""
+
+# Sólo se rellenan las wallets sin etiqueta: las puestas en KONTROL mandan
+_APPLY_WALLET_LABELS = """
+UPDATE wallet_addresses w
+SET label = left(s.label, 100)
+FROM wallet_label_staging s
+WHERE w.user_id = $1
+  AND lower(w.address) = lower(s.address)
+  AND (s.blockchain IS NULL OR w.blockchain = s.blockchain)
+  AND w.label IS NULL
+"""
+
+_ANNOTATION_STAGING = """
+CREATE TEMP TABLE transaction_annotation_staging (
+    timestamp_utc TIMESTAMPTZ NOT NULL,
+    asset_in TEXT,
+    amount_in NUMERIC,
+    asset_out TEXT,
+    amount_out NUMERIC,
+    patch JSONB NOT NULL
+) ON COMMIT DROP
+"""
+
+_ANNOTATION_COLUMNS = ['timestamp_utc', 'asset_in', 'amount_in', 'asset_out', 'amount_out', 'patch']
+
+# Cruce por contenido (independiente del origen); usa idx_tx_user_asset_timestamp.
+# Las filas del propio backup ($2) ya llevan sus grupos y comentarios
+_ANNOTATION_JOIN = """
+FROM transaction_annotation_staging s
+WHERE t.user_id = $1
+  AND t.metadata->>'source' IS DISTINCT FROM $2
+  AND t.timestamp_utc = s.timestamp_utc
+  AND t.asset_in IS NOT DISTINCT FROM s.asset_in
+  AND t.amount_in IS NOT DISTINCT FROM s.amount_in
+  AND t.asset_out IS NOT DISTINCT FROM s.asset_out
+  AND t.amount_out IS NOT DISTINCT FROM s.amount_out
+"""
+
+# Categorías: unión sin duplicados con los tags existentes. Las filas que ya
+# las contienen no se reescriben (ni invalidan la caché de reportes)
+_APPLY_CATEGORIES = """
+UPDATE canonical_transactions t
+SET tags = (
+    SELECT coalesce(jsonb_agg(DISTINCT element), '[]'::jsonb)
+    FROM jsonb_array_elements(coalesce(t.tags, '[]'::jsonb) || s.patch) element
+)
+""" + _ANNOTATION_JOIN + """
+  AND NOT coalesce(t.tags, '[]'::jsonb) @> s.patch
+"""
+
+_APPLY_NOTES = """
+UPDATE canonical_transactions t
+SET metadata = coalesce(t.metadata, '{}'::jsonb) || s.patch
+""" + _ANNOTATION_JOIN + """
+  AND NOT coalesce(t.metadata, '{}'::jsonb) @> s.patch
+"""
+
+@dataclass
+class MetadataSyncResult:
+    """
+    Filas actualizadas por tipo de metadato.
+
+    Attributes:
+        wallet_labels: Wallets etiquetadas
+        categories: Transacciones con categorías añadidas
+        notes: Transacciones con nota añadida
+    """
+    wallet_labels: int = 0
+    categories: int = 0
+    notes: int = 0
+
+def _merge_annotations(annotations: Sequence[TransactionAnnotation]) -> Tuple[Dict, Dict]:
+    """Agrupar por clave de contenido: categorías unidas y última nota"""
+    categories: Dict[Tuple, List[str]] = {}
+    notes: Dict[Tuple, str] = {}
+    for annotation in annotations:
+        if annotation.categories:
+            merged = categories.setdefault(annotation.key, [])
+            merged.extend(category for category in annotation.categories if category not in merged)
+        if annotation.note:
+            notes[annotation.key] = annotation.note
+    return categories, notes
+
+class MetadataSync:
+    """
+    Traslado de metadatos históricos (etiquetas de wallets, categorías y
+    notas) a los datos de la sincronización automática.
+
+    Cada tipo se resuelve con un COPY a staging y un solo UPDATE ... FROM
+    en una transacción propia, en lugar de una actualización por fila.
+    """
+
+    def __init__(self, session: AsyncSession):
+        self.session = session
+
+    async def _driver_connection(self, staging_sql: str):
+        """
+        Conexión asyncpg de la transacción en curso, con la staging creada.
+
+        La staging se crea a través de SQLAlchemy (como en bulk_loader): el
+        adaptador de asyncpg abre la transacción con la primera sentencia
+        que ejecuta él mismo, y sin ella el CREATE se confirmaría solo y ON
+        COMMIT DROP borraría la tabla antes del COPY.
+        """
+        connection = await self.session.connection()
+        await connection.execute(text(staging_sql))
+        raw = await connection.get_raw_connection()
+        return raw.driver_connection
+
+    async def _apply(self, staging_sql: str, staging_table: str, columns: List[str], records: List[tuple], update_sql: str, *args) -> int:
+        """Cargar la staging y aplicar el UPDATE en una única transacción"""
+        if not records:
+            return 0
+        try:
+            driver = await self._driver_connection(staging_sql)
+            await driver.copy_records_to_table(staging_table, records=records, columns=columns)
+            status = await driver.execute(update_sql, *args)
+            await self.session.commit()
+        except Exception:
+            await self.session.rollback()
+            raise
+        return int(status.rsplit(' ', 1)[-1])
+
+    async def apply_wallet_labels(self, user_id: str, labels: Sequence[WalletLabel]) -> int:
+        """Etiquetar las wallets sin etiqueta con las históricas"""
+        records = [(label.address, label.blockchain, label.label) for label in labels if label.address and label.label]
+        return await self._apply(
+            _WALLET_LABEL_STAGING, 'wallet_label_staging', ['address', 'blockchain', 'label'],
+            records, _APPLY_WALLET_LABELS, user_id
+        )
+
+    async def preserve_custom_categories(self, user_id: str, annotations: Sequence[TransactionAnnotation]) -> int:
+        """Añadir las categorías históricas a los tags de las transacciones"""
+        categories, _ = _merge_annotations(annotations)
+        records = [(*key, json.dumps(values)) for key, values in categories.items()]
+        return await self._apply(
+            _ANNOTATION_STAGING, 'transaction_annotation_staging', _ANNOTATION_COLUMNS,
+            records, _APPLY_CATEGORIES, user_id, SOURCE
+        )
+
+    async def preserve_transaction_notes(self, user_id: str, annotations: Sequence[TransactionAnnotation]) -> int:
+        """Guardar las notas históricas en metadata (clave historical_note)"""
+        _, notes = _merge_annotations(annotations)
+        records = [(*key, json.dumps({NOTE_KEY: note})) for key, note in notes.items()]
+        return await self._apply(
+            _ANNOTATION_STAGING, 'transaction_annotation_staging', _ANNOTATION_COLUMNS,
+            records, _APPLY_NOTES, user_id, SOURCE
+        )
+
+    async def enrich_automated_sync(self, user_id: str, metadata: CriticalMetadata) -> MetadataSyncResult:
+        """
+        Aplicar todos los metadatos históricos de un usuario.
+
+        Args:
+            user_id: ID del usuario
+            metadata: Metadatos extraídos del backup (ver extract_critical_metadata)
+
+        Returns:
+            MetadataSyncResult con las filas actualizadas por tipo
+        """
+        result = MetadataSyncResult(
+            wallet_labels=await self.apply_wallet_labels(user_id, metadata.wallet_labels),
+            categories=await self.preserve_custom_categories(user_id, metadata.annotations),
+            notes=await self.preserve_transaction_notes(user_id, metadata.annotations)
+        )
+        logger.info(
+            f"Metadatos históricos de {user_id}: {result.wallet_labels} wallets, "
+            f"{result.categories} categorías, {result.notes} notas"
+        )
+        return result
@@ -0,0 +1,226 @@
+"""
+KONTROL Ingestion Models
+Estructuras compartidas por los importadores (lotes canónicos y datos de backups)
+"""
+
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+# Columnas de canonical_transactions que producen los importadores (en el
+# orden en que se cargan); user_id lo añade el cargador
+CANONICAL_COLUMNS = (
+    'tx_id_kontrol', 'tx_hash', 'timestamp_utc', 'tx_type', 'kontorl_type',
+    'asset_in', 'asset_out', 'amount_in', 'amount_out', 'exchange_id',
+    'fiat_cost_basis_unit', 'exchange_rate', 'fees', 'tags', 'metadata'
+)
+
+class ParseError(Exception):
+    """Error de parseo de un archivo de importación"""
+
+# Filas de ejemplo que se guardan por motivo de rechazo
+MAX_REPORTED_ROWS = 20
+
+@dataclass
+class ValidationReport:
+    """
+    Resumen compacto de las filas rechazadas de un archivo.
+
+    Cada fila rechazada cuenta en un único motivo (el primero que falla);
+    por motivo se guardan el total y los primeros números de fila. Los
+    avisos (filas importadas con alguna corrección, p. ej. una hora
+    ambigua por el cambio de horario) se llevan aparte y no cuentan
+    como rechazos.
+
+    Attributes:
+        counts: Filas rechazadas por motivo
+        rows: Primeras filas (numeración de datos del archivo) por motivo
+        notices: Filas importadas con aviso, por motivo
+        notice_rows: Primeras filas con aviso, por motivo
+    """
+    counts: Dict[str, int] = field(default_factory=dict)
+    rows: Dict[str, List[int]] = field(default_factory=dict)
+    notices: Dict[str, int] = field(default_factory=dict)
+    notice_rows: Dict[str, List[int]] = field(default_factory=dict)
+
+    @property
+    def total(self) -> int:
+        return sum(self.counts.values())
+
+    def add(self, reason: str, rows: List[int]) -> None:
+        """Registrar filas rechazadas por un motivo"""
+        _count(self.counts, self.rows, reason, len(rows), rows)
+
+    def note(self, reason: str, rows: List[int]) -> None:
+        """Registrar filas importadas con un aviso"""
+        _count(self.notices, self.notice_rows, reason, len(rows), rows)
+
+    def merge(self, other: 'ValidationReport') -> None:
+        """Acumular el informe de otro lote (en orden de archivo)"""
+        for reason, count in other.counts.items():
+            _count(self.counts, self.rows, reason, count, other.rows.get(reason, []))
+        for reason, count in other.notices.items():
+            _count(self.notices, self.notice_rows, reason, count, other.notice_rows.get(reason, []))
+
+    def shift(self, rows_before: int) -> None:
+        """Renumerar las filas tras rows_before filas anteriores"""
+        self.rows = {reason: [row + rows_before for row in rows] for reason, rows in self.rows.items()}
+        self.notice_rows = {reason: [row + rows_before for row in rows] for reason, rows in self.notice_rows.items()}
+
+    def summary(self) -> str:
+        """Texto breve de los rechazos: 'invalid_date: 3 (filas 4, 9, 12); ...'"""
+        return _summarize(self.counts, self.rows)
+
+    def notice_summary(self) -> str:
+        """Texto breve de los avisos, con el mismo formato que summary"""
+        return _summarize(self.notices, self.notice_rows)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'total': self.total,
+            'counts': dict(self.counts),
+            'rows': {k: list(v) for k, v in self.rows.items()},
+            'notices': dict(self.notices),
+            'notice_rows': {k: list(v) for k, v in self.notice_rows.items()}
+        }
+
+def _count(counts: Dict[str, int], examples: Dict[str, List[int]], reason: str, count: int, rows: List[int]) -> None:
+    if not count:
+        return
+    counts[reason] = counts.get(reason, 0) + count
+    kept = examples.setdefault(reason, [])
+    kept.extend(rows[:MAX_REPORTED_ROWS - len(kept)])
+
+def _summarize(counts: Dict[str, int], examples: Dict[str, List[int]]) -> str:
+    parts = []
+    for reason, count in counts.items():
+        rows = ', '.join(str(row) for row in examples.get(reason, []))
+        more = '...' if count > len(examples.get(reason, [])) else ''
+        parts.append(f"{reason}: {count} (filas {rows}{more})")
+    return '; '.join(parts)
+
+class ImportValidationError(ParseError):
+    """Filas inválidas en modo fail-fast"""
+
+    def __init__(self, report: ValidationReport):
+        super().__init__(f"Filas inválidas: {report.summary()}")
+        self.report = report
+
+@dataclass
+class CanonicalBatch:
+    """
+    Lote de transacciones canónicas producido por un importador.
+
+    Attributes:
+        frame: DataFrame con CANONICAL_COLUMNS (importes Decimal o None)
+        source_rows: Número de fila de datos en el archivo de origen (1 = primera
+            fila tras la cabecera) de cada transacción
+        rows_read: Filas de datos del archivo consumidas hasta el final del lote
+        skipped: Filas del chunk rechazadas
+        byte_offset: Byte del archivo en que termina el lote (punto de
+            reanudación), si el importador lo conoce
+        report: Motivos y números de fila de las filas rechazadas
+        identity_keys: Huella de la identidad de cada transacción (ver
+            tx_identity.IdentityCounter), si el importador asignó los ids
+        identity_changes: Cambios del contador de identidades del archivo
+            hasta este lote (IdentityCounter.take_changes), para guardarlos
+            con el checkpoint
+    """
+    frame: pd.DataFrame
+    source_rows: List[int]
+    rows_read: int
+    skipped: int = 0
+    byte_offset: Optional[int] = None
+    report: ValidationReport = field(default_factory=ValidationReport)
+    identity_keys: Optional[np.ndarray] = None
+    identity_changes: Optional[bytes] = None
+
+    def __len__(self) -> int:
+        return len(self.frame)
+
+    def shift_rows(self, rows_before: int) -> None:
+        """
+        Renumerar un lote parseado de forma aislada (filas desde 1) tras las
+        rows_before filas anteriores del archivo.
+        """
+        if not rows_before:
+            return
+        self.source_rows = [row + rows_before for row in self.source_rows]
+        self.rows_read += rows_before
+        self.report.shift(rows_before)
+        for metadata, row in zip(self.frame['metadata'], self.source_rows):
+            if 'source_row' in metadata:
+                metadata['source_row'] = row
+
+    def records(self) -> Iterator[Tuple[Any, ...]]:
+        """Tuplas en el orden de CANONICAL_COLUMNS (None en lugar de NaN/NaT)"""
+        frame = self.frame.astype(object).where(self.frame.notna(), None)
+        return frame.itertuples(index=False, name=None)
+
+    def to_dicts(self) -> List[Dict[str, Any]]:
+        """Filas como diccionarios columna -> valor"""
+        return [dict(zip(CANONICAL_COLUMNS, record)) for record in self.records()]
+
+@dataclass
+class CointrackingData:
+    """
+    Contenido de un backup de Cointracking normalizado.
+
+    Attributes:
+        batches: Lotes de transacciones canónicas en el orden del archivo
+        metadata: Metadatos del archivo (columnas, filas, divisas de valoración...)
+        file_type: Formato de origen ('csv', 'json', 'backup')
+    """
+    batches: List[CanonicalBatch] = field(default_factory=list)
+    metadata: Dict[str, Any] = field(default_factory=dict)
+    file_type: str = 'csv'
+
+    @property
+    def transaction_count(self) -> int:
+        return sum(len(batch) for batch in self.batches)
+
+    def transactions(self) -> Iterator[Dict[str, Any]]:
+        """Iterar las transacciones canónicas como diccionarios"""
+        for batch in self.batches:
+            yield from batch.to_dicts()
+
+    def frame(self) -> Optional[pd.DataFrame]:
+        """Todas las transacciones en un único DataFrame (o None si no hay)"""
+        if not self.batches:
+            return None
+        return pd.concat([batch.frame for batch in self.batches], ignore_index=True)
+
+@dataclass
+class WalletLabel:
+    """Etiqueta histórica de una dirección (blockchain None = cualquier red)"""
+    address: str
+    label: str
+    blockchain: Optional[str] = None
+
+@dataclass
+class TransactionAnnotation:
+    """
+    Anotación histórica de una transacción, identificada por su contenido.
+
+    La clave (instante, activos e importes) no depende del origen, así que
+    casa con la misma operación traída por la sincronización automática.
+    """
+    timestamp_utc: Any
+    asset_in: Optional[str]
+    amount_in: Any
+    asset_out: Optional[str]
+    amount_out: Any
+    categories: List[str] = field(default_factory=list)
+    note: Optional[str] = None
+
+    @property
+    def key(self) -> Tuple[Any, ...]:
+        return (self.timestamp_utc, self.asset_in, self.amount_in, self.asset_out, self.amount_out)
+
+@dataclass
+class CriticalMetadata:
+    """Metadatos de Cointracking que se trasladan a la sincronización automática"""
+    wallet_labels: List[WalletLabel] = field(default_factory=list)
+    annotations: List[TransactionAnnotation] = field(default_factory=list)
@@ -0,0 +1,153 @@
+"""
+KONTROL Normalization Index
+Índice compartido de normalización de exchanges y símbolos de activos para los importadores
+"""
+
+import json
+import logging
+import re
+from functools import lru_cache
+from typing import Dict, Iterable, Mapping, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from config.settings import get_settings
+
+logger = logging.getLogger(__name__)
+
+# Exchange canónico -> etiquetas con que aparece en exportaciones de terceros
+EXCHANGE_ALIASES: Dict[str, Tuple[str, ...]] = {
+    'binance': ('binance', 'binance.com', 'binance spot', 'binance margin', 'binance futures', 'binance earn'),
+    'coinbase': ('coinbase', 'coinbase.com', 'coinbase pro', 'coinbase advanced', 'coinbase prime', 'gdax'),
+    'kraken': ('kraken', 'kraken.com', 'kraken pro', 'kraken futures'),
+    'ftx': ('ftx', 'ftx.com', 'ftx international'),
+    'kucoin': ('kucoin', 'ku coin', 'kucoin futures'),
+    'bybit': ('bybit', 'bybit.com', 'bybit spot'),
+    'okx': ('okx', 'okex', 'okx.com', 'okex.com'),
+}
+
+# Símbolo canónico -> tickers alternativos (Kraken, redenominaciones...).
+# Sólo nombres del mismo activo: los derivados de staking (ETH2, ETH2.S)
+# son otros activos; quien quiera unirlos puede hacerlo en NORMALIZATION_ALIASES_PATH
+ASSET_ALIASES: Dict[str, Tuple[str, ...]] = {
+    'BTC': ('XBT', 'XXBT', 'XBT.M'),
+    'ETH': ('XETH',),
+    'DOGE': ('XDG', 'XXDG'),
+    'XRP': ('XXRP',),
+    'LTC': ('XLTC',),
+    'XLM': ('XXLM', 'STR'),
+    'BCH': ('BCHABC', 'BCC'),
+    'IOTA': ('MIOTA', 'IOT'),
+    'EUR': ('ZEUR',),
+    'USD': ('ZUSD',),
+    'GBP': ('ZGBP',),
+    'JPY': ('ZJPY',),
+    'CAD': ('ZCAD',),
+}
+
+# Valores distintos memorizados por tabla: las etiquetas libres de un
+# archivo grande no deben hacer crecer la caché sin límite
+RESOLVE_CACHE_SIZE = 4096
+
+_WHITESPACE = re.compile(r'\s+')
+
+# Sufijos con que Cointracking distingue varias cuentas del mismo exchange
+# ("Binance (API)", "Kraken Margin 2", "Bybit 3"), sobre la clave ya
+# normalizada. Sólo se quitan estos: "Binance.US" o "Coinbase Wallet" son
+# otras plataformas y únicamente se resuelven si figuran como alias.
+_ACCOUNT_SUFFIX = re.compile(
+    r' (?:\((?:api|csv|import|manual)\)|(?:margin|futures|spot|earn|staking|savings)(?: #?\d+)?|#?\d+)$'
+)
+
+def _fold(value: str) -> str:
+    """Clave de búsqueda: sin espacios sobrantes y en minúsculas sin distinción Unicode"""
+    return _WHITESPACE.sub(' ', value.strip()).casefold()
+
+class NormalizationTable:
+    """
+    Tabla de normalización de un tipo de valor.
+
+    La resolución prueba, en orden: coincidencia exacta con la clave
+    normalizada (casefold), la misma búsqueda tras quitar sufijos de cuenta
+    conocidos (_ACCOUNT_SUFFIX: "Binance (API)", "Kraken Margin 2"...) y,
+    si nada coincide, el propio valor con el formato por defecto. Se
+    memorizan los RESOLVE_CACHE_SIZE valores resueltos más recientes (LRU).
+    """
+
+    def __init__(self, aliases: Mapping[str, Iterable[str]], default_case: str, account_suffixes: bool):
+        self.default_case = default_case
+        self.exact: Dict[str, str] = {}
+        for canonical, labels in aliases.items():
+            self.exact[_fold(canonical)] = canonical
+            for label in labels:
+                self.exact[_fold(label)] = canonical
+        self.account_suffixes = account_suffixes
+        self._resolve_cached = lru_cache(maxsize=RESOLVE_CACHE_SIZE)(self._resolve)
+
+    def _default(self, value: str) -> str:
+        value = _WHITESPACE.sub(' ', value.strip())
+        return value.upper() if self.default_case == 'upper' else value.casefold()
+
+    def resolve(self, value: Optional[str]) -> Optional[str]:
+        """Valor canónico de una etiqueta (None/'' -> None)"""
+        if not value:
+            return None
+        return self._resolve_cached(value)
+
+    def _resolve(self, value: str) -> str:
+        key = _fold(value)
+        resolved = self.exact.get(key)
+        while resolved is None and self.account_suffixes:
+            # "Coinbase Pro Margin (API)" -> "coinbase pro margin" -> "coinbase pro"
+            suffix = _ACCOUNT_SUFFIX.search(key)
+            if suffix is None:
+                break
+            key = key[:suffix.start()]
+            resolved = self.exact.get(key)
+        if resolved is None:
+            resolved = self._default(value)
+        return resolved
+
+    def normalize(self, values: pd.Series) -> pd.Series:
+        """
+        Normalizar una columna entera.
+
+        Sólo se resuelven los valores distintos de la columna (factorize);
+        el resto es un take vectorizado sobre los resueltos.
+        """
+        codes, uniques = pd.factorize(values.to_numpy(dtype=object))
+        # El código -1 (valor nulo) toma el None añadido al final
+        resolved = np.array([self.resolve(value) for value in uniques] + [None], dtype=object)
+        return pd.Series(resolved[codes], index=values.index, dtype=object)
+
+class NormalizationIndex:
+    """Tablas de exchanges y activos"""
+
+    def __init__(self, exchanges: Mapping[str, Iterable[str]], assets: Mapping[str, Iterable[str]]):
+        self.exchanges = NormalizationTable(exchanges, default_case='lower', account_suffixes=True)
+        self.assets = NormalizationTable(assets, default_case='upper', account_suffixes=False)
+
+def _merge_aliases(base: Mapping[str, Iterable[str]], extra: Mapping[str, Iterable[str]]) -> Dict[str, Tuple[str, ...]]:
+    merged = {canonical: tuple(labels) for canonical, labels in base.items()}
+    for canonical, labels in extra.items():
+        merged[canonical] = merged.get(canonical, ()) + tuple(labels)
+    return merged
+
+@lru_cache(maxsize=1)
+def get_normalization_index() -> NormalizationIndex:
+    """
+    Índice de normalización del proceso (se construye en el primer uso).
+
+    A las tablas incluidas se añaden las de NORMALIZATION_ALIASES_PATH, un
+    JSON {"exchanges": {canónico: [alias...]}, "assets": {...}}.
+    """
+    exchanges, assets = EXCHANGE_ALIASES, ASSET_ALIASES
+    path = get_settings().normalization_aliases_path
+    if path:
+        with open(path, encoding='utf-8') as handle:
+            extra = json.load(handle)
+        exchanges = _merge_aliases(exchanges, extra.get('exchanges', {}))
+        assets = _merge_aliases(assets, extra.get('assets', {}))
+        logger.info(f"Alias de normalización cargados desde {path}")
+    return NormalizationIndex(exchanges, assets)
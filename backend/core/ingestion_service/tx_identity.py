@@ -0,0 +1,294 @@
+"""
+KONTROL Transaction Identity
+Identificador determinista (tx_id_kontrol) derivado del contenido de cada transacción
+"""
+
+import hashlib
+from datetime import datetime, timezone
+from decimal import Decimal
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Union
+
+import numpy as np
+import pandas as pd
+
+# Prefijo y versión de la identidad: cambiar los campos o su formato
+# exige una versión nueva (y los ids existentes dejan de coincidir)
+TX_ID_PREFIX = 'kontrol_'
+TX_IDENTITY_VERSION = 'v1'
+
+_TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+# La identidad cubre quién, de dónde, cuándo, qué activos y qué importes.
+# El tipo, las comisiones, la valoración y las etiquetas quedan fuera: una
+# reimportación que sólo los corrige actualiza la fila en lugar de duplicarla.
+#
+# generate_tx_id_kontrol() (supabase_schema.sql) construye la misma cadena
+# para las filas que llegan sin id; ambos lados deben cambiar a la vez.
+
+def _text(value: Any) -> str:
+    if value.__class__ is str:
+        return value.strip()
+    if value is None or value is pd.NaT or (isinstance(value, float) and value != value):
+        return ''
+    return str(value).strip()
+
+def format_amount(value: Any) -> str:
+    """Importe sin ceros no significativos ('1.50' y '1.5' dan lo mismo; equivale a trim_scale)"""
+    if value is None or (isinstance(value, float) and value != value):
+        return ''
+    amount = value if isinstance(value, Decimal) else Decimal(str(value))
+    if amount.is_nan():
+        return ''
+    if amount == 0:
+        return '0'
+    return format(amount.normalize(), 'f')
+
+def format_timestamp(value: Any) -> str:
+    """Instante en UTC con microsegundos (las fechas sin zona se toman como UTC)"""
+    if value is None or value is pd.NaT:
+        return ''
+    if not isinstance(value, datetime):
+        value = pd.Timestamp(value)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc).strftime(_TIMESTAMP_FORMAT)
+
+def canonical_identity(
+    user_id: str,
+    source: Optional[str],
+    exchange_id: Optional[str],
+    tx_hash: Optional[str],
+    timestamp: Any,
+    asset_in: Optional[str],
+    amount_in: Any,
+    asset_out: Optional[str],
+    amount_out: Any
+) -> str:
+    """Cadena canónica de la identidad de una transacción"""
+    return '|'.join((
+        TX_IDENTITY_VERSION,
+        _text(user_id).lower(),
+        _text(source).lower(),
+        _text(exchange_id).lower(),
+        _text(tx_hash),
+        format_timestamp(timestamp),
+        _text(asset_in).upper(),
+        format_amount(amount_in),
+        _text(asset_out).upper(),
+        format_amount(amount_out),
+    ))
+
+def _digest(identity: str, ordinal: int = 0) -> str:
+    # Las repeticiones exactas (p.ej. dos compras idénticas en el mismo
+    # segundo) se distinguen por su ordinal en el archivo
+    if ordinal:
+        identity = f'{identity}|{ordinal}'
+    return TX_ID_PREFIX + hashlib.sha256(identity.encode('utf-8')).hexdigest()
+
+def compute_tx_id(user_id: str, transaction: dict, source: Optional[str] = None) -> str:
+    """
+    tx_id_kontrol de una transacción suelta (sincronización de exchanges, altas manuales).
+
+    Args:
+        user_id: ID del usuario
+        transaction: Diccionario con las columnas canónicas
+        source: Origen (por defecto metadata['source'])
+    """
+    if source is None:
+        source = (transaction.get('metadata') or {}).get('source')
+    return _digest(canonical_identity(
+        user_id, source, transaction.get('exchange_id'), transaction.get('tx_hash'),
+        transaction.get('timestamp_utc'), transaction.get('asset_in'), transaction.get('amount_in'),
+        transaction.get('asset_out'), transaction.get('amount_out')
+    ))
+
+def tx_identities(frame: pd.DataFrame, user_id: str, source: Union[str, Iterable[Optional[str]], None]) -> List[str]:
+    """
+    Cadenas canónicas de identidad de cada fila de un lote (ver canonical_identity).
+
+    Args:
+        frame: DataFrame con las columnas canónicas
+        user_id: ID del usuario
+        source: Origen común del lote o uno por fila
+    """
+    if not len(frame):
+        return []
+    timestamps = frame['timestamp_utc']
+    if isinstance(timestamps.dtype, pd.DatetimeTZDtype):
+        # Formateo en bloque (numpy) en lugar de strftime por fila
+        instants = timestamps.dt.tz_convert('UTC').dt.tz_localize(None).to_numpy(dtype='datetime64[us]')
+        timestamp_text = [
+            '' if text == 'NaT' else text for text in np.datetime_as_string(instants, unit='us').tolist()
+        ]
+    else:
+        timestamp_text = [format_timestamp(value) for value in timestamps.to_numpy(dtype=object)]
+
+    prefix = f"{TX_IDENTITY_VERSION}|{_text(user_id).lower()}|"
+    if source is None or isinstance(source, str):
+        sources = [_text(source).lower()] * len(frame)
+    else:
+        sources = [_text(value).lower() for value in source]
+    exchanges = [_text(value).lower() for value in frame['exchange_id'].to_numpy(dtype=object)]
+    hashes = [_text(value) for value in frame['tx_hash'].to_numpy(dtype=object)]
+    assets_in = [_text(value).upper() for value in frame['asset_in'].to_numpy(dtype=object)]
+    assets_out = [_text(value).upper() for value in frame['asset_out'].to_numpy(dtype=object)]
+    amounts_in = [format_amount(value) for value in frame['amount_in'].to_numpy(dtype=object)]
+    amounts_out = [format_amount(value) for value in frame['amount_out'].to_numpy(dtype=object)]
+
+    return [
+        prefix + '|'.join(fields)
+        for fields in zip(sources, exchanges, hashes, timestamp_text, assets_in, amounts_in, assets_out, amounts_out)
+    ]
+
+def batch_ordinals(values: Sequence[Any]) -> np.ndarray:
+    """Ocurrencias anteriores de cada valor dentro de la propia secuencia (0 la primera vez)"""
+    if not len(values):
+        return np.zeros(0, dtype=np.int64)
+    return pd.Series(values, dtype=object).groupby(values, sort=False).cumcount().to_numpy(dtype=np.int64)
+
+def digest_identities(identities: Sequence[str], ordinals: Optional[Sequence[int]] = None) -> List[str]:
+    """
+    tx_id_kontrol de cada identidad.
+
+    Args:
+        identities: Cadenas de tx_identities
+        ordinals: Ordinal de cada fila en el archivo (por defecto, dentro de la secuencia)
+    """
+    if ordinals is None:
+        ordinals = batch_ordinals(identities)
+    return [_digest(identity, int(ordinal)) for identity, ordinal in zip(identities, ordinals)]
+
+def compute_tx_ids(
+    frame: pd.DataFrame,
+    user_id: str,
+    source: Union[str, Iterable[Optional[str]], None],
+    ordinals: Optional[Sequence[int]] = None
+) -> List[str]:
+    """
+    tx_id_kontrol de cada fila de un lote canónico.
+
+    Args:
+        frame: DataFrame con las columnas canónicas
+        user_id: ID del usuario
+        source: Origen común del lote o uno por fila
+        ordinals: Ordinal de cada fila entre las repeticiones de su identidad
+            en el archivo (por defecto se numeran dentro del lote; ver
+            IdentityCounter para archivos leídos en varios lotes)
+
+    Returns:
+        Lista de ids en el orden del lote
+    """
+    return digest_identities(tx_identities(frame, user_id, source), ordinals)
+
+def identity_keys(identities: Sequence[str]) -> np.ndarray:
+    """Huella de 64 bits de cada identidad (clave compacta para IdentityCounter)"""
+    return np.fromiter(
+        (
+            int.from_bytes(hashlib.blake2b(identity.encode('utf-8'), digest_size=8).digest(), 'little')
+            for identity in identities
+        ),
+        dtype=np.uint64,
+        count=len(identities)
+    )
+
+class IdentityCounter:
+    """
+    Ocurrencias de cada identidad en lo ya leído de un archivo.
+
+    El ordinal de una repetición es su posición entre las filas idénticas
+    de todo el archivo, no del lote: sin este contador el ordinal se
+    reiniciaría en cada bloque y dos filas idénticas en bloques distintos
+    recibirían el mismo id (y la segunda se fusionaría con la primera).
+
+    Guarda la huella de 8 bytes de cada identidad en tramos ordenados de
+    numpy (fusionados al duplicarse, como un contador binario) y un
+    diccionario sólo para las identidades repetidas.
+
+    Lo añadido desde el último take_changes() se puede guardar con el
+    checkpoint de una importación y reconstruir el contador con restore().
+    """
+
+    def __init__(self):
+        self._runs: List[np.ndarray] = []
+        self._repeated: Dict[int, int] = {}
+        self._new_keys: List[np.ndarray] = []
+        self._new_repeats: Dict[int, int] = {}
+
+    def __len__(self) -> int:
+        return sum(len(run) for run in self._runs)
+
+    def ordinals(self, keys: np.ndarray) -> np.ndarray:
+        """
+        Ordinal en el archivo de cada fila de un lote (y registrar el lote).
+
+        Los lotes deben llegar en el orden del archivo.
+
+        Args:
+            keys: identity_keys de las filas del lote, en su orden
+        """
+        if not len(keys):
+            return np.zeros(0, dtype=np.int64)
+        unique, inverse, counts = np.unique(keys, return_inverse=True, return_counts=True)
+        seen = self._contains(unique)
+        previous = np.zeros(len(unique), dtype=np.int64)
+        for position in np.flatnonzero(seen):
+            previous[position] = self._repeated.get(int(unique[position]), 1)
+        for position in np.flatnonzero(seen | (counts > 1)):
+            key = int(unique[position])
+            self._repeated[key] = self._new_repeats[key] = int(previous[position] + counts[position])
+        self._new_keys.append(unique[~seen])
+        self._add(unique[~seen])
+        return previous[inverse] + batch_ordinals(inverse.tolist())
+
+    def take_changes(self) -> bytes:
+        """
+        Identidades nuevas y repeticiones actualizadas desde la última llamada.
+
+        Formato: número de claves y de repeticiones, las claves y los pares
+        (clave, ocurrencias), todo en uint64 little-endian.
+        """
+        keys = np.concatenate(self._new_keys) if self._new_keys else np.zeros(0, dtype=np.uint64)
+        repeats = np.array(list(self._new_repeats.items()), dtype=np.uint64).reshape(-1, 2)
+        self._new_keys, self._new_repeats = [], {}
+        header = np.array([len(keys), len(repeats)], dtype='<u8')
+        return header.tobytes() + keys.astype('<u8').tobytes() + repeats.astype('<u8').tobytes()
+
+    @classmethod
+    def restore(cls, changes: Iterable[bytes]) -> 'IdentityCounter':
+        """Reconstruir un contador a partir de sus take_changes(), en orden"""
+        counter = cls()
+        runs = []
+        for data in changes:
+            key_count, repeat_count = (int(value) for value in np.frombuffer(data, dtype='<u8', count=2))
+            runs.append(np.frombuffer(data, dtype='<u8', count=key_count, offset=16))
+            repeats = np.frombuffer(data, dtype='<u8', count=2 * repeat_count, offset=16 + 8 * key_count)
+            counter._repeated.update(zip(repeats[0::2].tolist(), repeats[1::2].tolist()))
+        if runs:
+            counter._add(np.sort(np.concatenate(runs)).astype(np.uint64))
+        return counter
+
+    def _contains(self, keys: np.ndarray) -> np.ndarray:
+        found = np.zeros(len(keys), dtype=bool)
+        for run in self._runs:
+            positions = np.minimum(np.searchsorted(run, keys), len(run) - 1)
+            found |= run[positions] == keys
+        return found
+
+    def _add(self, keys: np.ndarray) -> None:
+        if not len(keys):
+            return
+        self._runs.append(keys)
+        while len(self._runs) > 1 and len(self._runs[-2]) <= 2 * len(self._runs[-1]):
+            newest = self._runs.pop()
+            self._runs[-1] = np.sort(np.concatenate((self._runs[-1], newest)))
+
+def assign_tx_ids(frame: pd.DataFrame, user_id: str, source: Union[str, Iterable[Optional[str]], None]) -> pd.DataFrame:
+    """Rellenar (en el propio DataFrame) los tx_id_kontrol que falten"""
+    missing = frame['tx_id_kontrol'].isna()
+    if missing.any():
+        if isinstance(source, str) or source is None:
+            rows_source = source
+        else:
+            rows_source = [value for value, is_missing in zip(source, missing) if is_missing]
+        frame.loc[missing, 'tx_id_kontrol'] = compute_tx_ids(frame[missing], user_id, rows_source)
+    return frame
@@ -0,0 +1,350 @@
+"""
+KONTROL Incremental Matching
+Emparejamiento de transferencias internas a medida que se ingieren transacciones, contra un índice de ventana
+"""
+
+import bisect
+import logging
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+
+from config.settings import get_settings
+from core.matching_engine.internal_transfers import InternalTransferMatcher, compare_addresses
+from core.transaction_frame import CategoryIndex, TransactionFrame
+
+logger = logging.getLogger(__name__)
+
+# Sentido de un movimiento en el índice
+OUT = 'out'
+IN = 'in'
+_OPPOSITE = {OUT: IN, IN: OUT}
+
+@dataclass(frozen=True)
+class Movement:
+    """
+    Retirada o depósito sin emparejar.
+
+    Attributes:
+        tx_id: tx_id_kontrol
+        timestamp_us: Epoch UTC en microsegundos
+        amount: Importe (float, sólo para scoring)
+        source_address / destination_address: Direcciones en minúsculas (None si no constan)
+    """
+    tx_id: str
+    timestamp_us: int
+    amount: float
+    source_address: Optional[str] = None
+    destination_address: Optional[str] = None
+
+@dataclass
+class IncrementalMatches:
+    """
+    Pares emparejados en una pasada incremental.
+
+    Attributes:
+        out_ids / in_ids: tx_id_kontrol de retirada y depósito de cada par
+        confidence: Confianza de cada par
+        indexed: Movimientos que quedaron pendientes en el índice
+    """
+    out_ids: List[str] = field(default_factory=list)
+    in_ids: List[str] = field(default_factory=list)
+    confidence: List[float] = field(default_factory=list)
+    indexed: int = 0
+
+    def __len__(self) -> int:
+        return len(self.out_ids)
+
+def frame_movements(frame: TransactionFrame, matcher: InternalTransferMatcher) -> List[Tuple[str, str, Movement]]:
+    """(sentido, asset, movimiento) de las retiradas y depósitos sin clasificar de un frame, en orden cronológico"""
+    outflows, inflows = matcher.candidate_masks(frame)
+    amount_out = frame.amount_out.to_float()
+    amount_in = frame.amount_in.to_float()
+    movements = []
+    for row in np.flatnonzero(outflows | inflows)[np.argsort(frame.timestamps[outflows | inflows], kind='stable')]:
+        if outflows[row]:
+            direction, asset, amount = OUT, frame.asset_out[row], amount_out[row]
+        else:
+            direction, asset, amount = IN, frame.asset_in[row], amount_in[row]
+        movements.append((
+            direction,
+            frame.assets.decode(int(asset)),
+            Movement(
+                frame.tx_ids[row], int(frame.timestamps[row]), float(amount),
+                frame.addresses.decode(int(frame.source_address[row])),
+                frame.addresses.decode(int(frame.destination_address[row]))
+            )
+        ))
+    return movements
+
+class InMemoryWindowIndex:
+    """
+    Índice de ventana en memoria del proceso.
+
+    Por (usuario, asset, sentido) guarda los movimientos pendientes
+    ordenados por tiempo; la búsqueda de la ventana es una bisección y la
+    caducidad recorta el principio de la lista.
+
+    Sólo es coherente con un único proceso: con varios workers cada uno
+    tiene su propio índice y un movimiento emparejado en otro seguiría
+    siendo reclamable aquí (apply_transfer_matches descarta esos pares y
+    MatchingEngineService recarga el índice). Con varios procesos, RedisWindowIndex.
+    """
+
+    def __init__(self):
+        self._entries: Dict[Tuple[str, str, str], List[Tuple[int, str, float, str, str]]] = {}
+        self._coverage: Dict[str, int] = {}
+
+    @staticmethod
+    def _entry(movement: Movement) -> Tuple[int, str, float, str, str]:
+        # '' en lugar de None: las tuplas deben poder compararse enteras
+        return (
+            movement.timestamp_us, movement.tx_id, movement.amount,
+            movement.source_address or '', movement.destination_address or ''
+        )
+
+    async def candidates(self, user_id: str, asset: str, direction: str, timestamp_us: int, window_us: int) -> List[Movement]:
+        entries = self._entries.get((user_id, asset, direction), [])
+        start = bisect.bisect_left(entries, (timestamp_us - window_us,))
+        end = bisect.bisect_left(entries, (timestamp_us + window_us + 1,))
+        return [
+            Movement(tx_id, ts, amount, source or None, destination or None)
+            for ts, tx_id, amount, source, destination in entries[start:end]
+        ]
+
+    async def add(self, user_id: str, asset: str, direction: str, movement: Movement) -> None:
+        entries = self._entries.setdefault((user_id, asset, direction), [])
+        entry = self._entry(movement)
+        position = bisect.bisect_left(entries, entry)
+        if position == len(entries) or entries[position] != entry:
+            entries.insert(position, entry)
+
+    async def claim(self, user_id: str, asset: str, direction: str, movement: Movement) -> bool:
+        """Retirar un movimiento emparejado (False si ya no estaba)"""
+        entries = self._entries.get((user_id, asset, direction), [])
+        entry = self._entry(movement)
+        position = bisect.bisect_left(entries, entry)
+        if position < len(entries) and entries[position] == entry:
+            del entries[position]
+            return True
+        return False
+
+    async def expire(self, user_id: str, keys: Iterable[Tuple[str, str]], cutoff_us: int) -> None:
+        for asset, direction in keys:
+            entries = self._entries.get((user_id, asset, direction))
+            if entries is None:
+                continue
+            del entries[:bisect.bisect_left(entries, (cutoff_us,))]
+            if not entries:
+                del self._entries[(user_id, asset, direction)]
+
+    async def get_coverage(self, user_id: str) -> Optional[int]:
+        return self._coverage.get(user_id)
+
+    async def set_coverage(self, user_id: str, from_us: int) -> None:
+        self._coverage[user_id] = from_us
+
+    async def clear(self, user_id: str) -> None:
+        for key in [key for key in self._entries if key[0] == user_id]:
+            del self._entries[key]
+        self._coverage.pop(user_id, None)
+
+class RedisWindowIndex:
+    """
+    Índice de ventana en Redis, compartido por todos los workers.
+
+    Cada (usuario, asset, sentido) es un sorted set con el tiempo como
+    score y "tx_id|importe|origen|destino" como miembro. Reclamar un movimiento es un
+    ZREM: si dos workers compiten por la misma contrapartida sólo uno lo
+    consigue. Las claves caducan (MATCHING_ENGINE_INDEX_TTL_SECONDS) si el
+    usuario deja de sincronizar.
+    """
+
+    def __init__(self, client=None, prefix: str = 'kontrol:transfers', ttl_seconds: Optional[int] = None):
+        settings = get_settings()
+        if client is None:
+            from redis import asyncio as redis_asyncio
+            client = redis_asyncio.from_url(settings.redis_url, password=settings.redis_password)
+        self.client = client
+        self.prefix = prefix
+        self.ttl_seconds = ttl_seconds if ttl_seconds is not None else settings.matching_engine_index_ttl_seconds
+
+    def _key(self, user_id: str, asset: str, direction: str) -> str:
+        return f"{self.prefix}:{user_id}:{asset}:{direction}"
+
+    def _coverage_key(self, user_id: str) -> str:
+        return f"{self.prefix}:{user_id}:coverage"
+
+    @staticmethod
+    def _member(movement: Movement) -> str:
+        return (
+            f"{movement.tx_id}|{movement.amount!r}|"
+            f"{movement.source_address or ''}|{movement.destination_address or ''}"
+        )
+
+    async def candidates(self, user_id: str, asset: str, direction: str, timestamp_us: int, window_us: int) -> List[Movement]:
+        entries = await self.client.zrangebyscore(
+            self._key(user_id, asset, direction), timestamp_us - window_us, timestamp_us + window_us, withscores=True
+        )
+        movements = []
+        for member, score in entries:
+            tx_id, amount, source, destination = (member.decode() if isinstance(member, bytes) else member).rsplit('|', 3)
+            movements.append(Movement(tx_id, int(score), float(amount), source or None, destination or None))
+        return movements
+
+    async def add(self, user_id: str, asset: str, direction: str, movement: Movement) -> None:
+        key = self._key(user_id, asset, direction)
+        async with self.client.pipeline(transaction=False) as pipe:
+            pipe.zadd(key, {self._member(movement): movement.timestamp_us})
+            pipe.expire(key, self.ttl_seconds)
+            await pipe.execute()
+
+    async def claim(self, user_id: str, asset: str, direction: str, movement: Movement) -> bool:
+        return bool(await self.client.zrem(self._key(user_id, asset, direction), self._member(movement)))
+
+    async def expire(self, user_id: str, keys: Iterable[Tuple[str, str]], cutoff_us: int) -> None:
+        async with self.client.pipeline(transaction=False) as pipe:
+            for asset, direction in keys:
+                pipe.zremrangebyscore(self._key(user_id, asset, direction), '-inf', f'({cutoff_us}')
+            await pipe.execute()
+
+    async def get_coverage(self, user_id: str) -> Optional[int]:
+        value = await self.client.get(self._coverage_key(user_id))
+        return int(value) if value is not None else None
+
+    async def set_coverage(self, user_id: str, from_us: int) -> None:
+        await self.client.set(self._coverage_key(user_id), from_us, ex=self.ttl_seconds)
+
+    async def clear(self, user_id: str) -> None:
+        keys = [key async for key in self.client.scan_iter(match=f"{self.prefix}:{user_id}:*")]
+        if keys:
+            await self.client.delete(*keys)
+
+@lru_cache(maxsize=None)
+def get_window_index(backend: Optional[str] = None):
+    """Índice del proceso según MATCHING_ENGINE_INDEX_BACKEND ('memory' o 'redis')"""
+    backend = backend or get_settings().matching_engine_index_backend
+    if backend == 'redis':
+        return RedisWindowIndex()
+    if backend == 'memory':
+        return InMemoryWindowIndex()
+    raise ValueError(f"Índice de matching no soportado: {backend}")
+
+class IncrementalTransferMatcher:
+    """
+    Emparejador incremental de transferencias internas.
+
+    El índice guarda, por usuario y asset, las retiradas y depósitos aún
+    sin pareja cuyo tiempo está dentro de la ventana del último movimiento
+    visto. Cada movimiento nuevo sólo se compara con los del sentido
+    contrario en su ventana: si el mejor supera el umbral se empareja y
+    sale del índice; si no, queda pendiente. Los que se salen de la
+    ventana caducan.
+
+    La asignación es online (la mejor contrapartida disponible al llegar),
+    con el mismo scoring, tolerancia y umbral que el emparejador completo.
+
+    La cobertura de un usuario es el instante desde el que el índice
+    contiene todos sus movimientos pendientes; los tramos anteriores se
+    cargan desde la base de datos con seed (ver MatchingEngineService).
+
+    Attributes:
+        index: InMemoryWindowIndex o RedisWindowIndex
+        matcher: Emparejador completo del que se toman ventana y scoring
+    """
+
+    def __init__(self, index=None, matcher: Optional[InternalTransferMatcher] = None):
+        self.index = index if index is not None else get_window_index()
+        self.matcher = matcher or InternalTransferMatcher()
+
+    async def seed(self, user_id: str, frame: TransactionFrame) -> int:
+        """Cargar en el índice movimientos pendientes ya guardados (sin emparejarlos)"""
+        movements = frame_movements(frame, self.matcher)
+        for direction, asset, movement in movements:
+            await self.index.add(user_id, asset, direction, movement)
+        return len(movements)
+
+    async def process(self, user_id: str, frame: TransactionFrame) -> IncrementalMatches:
+        """
+        Emparejar los movimientos nuevos de un usuario contra el índice.
+
+        Args:
+            user_id: ID del usuario
+            frame: Transacciones recién ingeridas
+
+        Returns:
+            IncrementalMatches con los pares y los movimientos que quedan pendientes
+        """
+        window_us = self.matcher.window_us
+        result = IncrementalMatches()
+        touched: Set[Tuple[str, str]] = set()
+        latest: Optional[int] = None
+
+        for direction, asset, movement in frame_movements(frame, self.matcher):
+            opposite = _OPPOSITE[direction]
+            touched.add((asset, direction))
+            latest = movement.timestamp_us if latest is None else max(latest, movement.timestamp_us)
+
+            candidates = await self.index.candidates(user_id, asset, opposite, movement.timestamp_us, window_us)
+            counterpart = await self._claim_best(user_id, asset, direction, movement, candidates)
+            if counterpart is None:
+                await self.index.add(user_id, asset, direction, movement)
+                result.indexed += 1
+                continue
+
+            other, confidence = counterpart
+            out_movement, in_movement = (movement, other) if direction == OUT else (other, movement)
+            result.out_ids.append(out_movement.tx_id)
+            result.in_ids.append(in_movement.tx_id)
+            result.confidence.append(confidence)
+
+        if latest is not None:
+            await self.index.expire(
+                user_id, touched | {(asset, _OPPOSITE[direction]) for asset, direction in touched}, latest - window_us
+            )
+        return result
+
+    async def _claim_best(
+        self,
+        user_id: str,
+        asset: str,
+        direction: str,
+        movement: Movement,
+        candidates: List[Movement]
+    ) -> Optional[Tuple[Movement, float]]:
+        """
+        Reclamar la contrapartida de mayor confianza que supere el umbral.
+
+        La confianza incluye la evidencia de direcciones (compare_addresses),
+        como en el emparejador completo.
+        """
+        if not candidates:
+            return None
+        amounts = np.array([candidate.amount for candidate in candidates], dtype=np.float64)
+        times = np.array([candidate.timestamp_us for candidate in candidates], dtype=np.int64)
+        addresses = CategoryIndex()
+        sources = np.array([addresses.code(candidate.source_address) for candidate in candidates], dtype=np.int32)
+        destinations = np.array([addresses.code(candidate.destination_address) for candidate in candidates], dtype=np.int32)
+        own_source = np.full(len(candidates), addresses.code(movement.source_address), dtype=np.int32)
+        own_destination = np.full(len(candidates), addresses.code(movement.destination_address), dtype=np.int32)
+        if direction == OUT:
+            evidence = compare_addresses(own_source, own_destination, sources, destinations)
+            confidence = self.matcher.score(
+                np.full(len(candidates), movement.amount), amounts, times - movement.timestamp_us, evidence
+            )
+        else:
+            evidence = compare_addresses(sources, destinations, own_source, own_destination)
+            confidence = self.matcher.score(
+                amounts, np.full(len(candidates), movement.amount), movement.timestamp_us - times, evidence
+            )
+
+        opposite = _OPPOSITE[direction]
+        for position in np.argsort(-np.nan_to_num(confidence, nan=-1.0), kind='stable').tolist():
+            if not confidence[position] >= self.matcher.confidence_threshold:
+                break
+            # Otro worker puede haberla emparejado entre la búsqueda y el ZREM
+            if await self.index.claim(user_id, asset, opposite, candidates[position]):
+                return candidates[position], float(confidence[position])
+        return None
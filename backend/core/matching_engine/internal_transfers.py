@@ -0,0 +1,415 @@
+"""
+KONTROL Internal Transfers
+Detección de transferencias internas (retirada de una cuenta propia y depósito en otra) por barrido ordenado
+y asignación de máxima confianza
+"""
+
+import logging
+from dataclasses import dataclass, field
+from decimal import Decimal
+from typing import Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from config.settings import get_settings
+from core.transaction_frame import TransactionFrame
+
+logger = logging.getLogger(__name__)
+
+# Tolerancia de comisión: lo recibido puede ser hasta un 0,1% menor que lo enviado
+FEE_TOLERANCE = 0.001
+
+# Penalizaciones de la confianza (1.0 = mismo instante e importe exacto):
+# proporcionales al retraso dentro de la ventana y a la comisión dentro de
+# la tolerancia, más una fija si el depósito consta antes que la retirada
+# (relojes de exchanges distintos)
+TIME_PENALTY = 0.1
+AMOUNT_PENALTY = 0.1
+EARLY_ARRIVAL_PENALTY = 0.1
+
+# Direcciones: coincidir en origen o destino suma (hasta 1.0); dos destinos
+# conocidos y distintos delatan transferencias diferentes
+ADDRESS_MATCH_BONUS = 0.1
+ADDRESS_MISMATCH_PENALTY = 0.5
+
+# Lado máximo de un componente que se resuelve con el algoritmo húngaro
+# (matriz densa); los mayores se asignan por confianza descendente
+MAX_ASSIGNMENT_SIZE = 500
+
+# Movimientos candidatos (tx_type TRANSFER sin clasificar como internos)
+OUTFLOW_TYPE = 'WITHDRAWAL'
+INFLOW_TYPE = 'DEPOSIT'
+
+_MICROSECONDS = 1_000_000
+
+@dataclass
+class TransferMatches:
+    """
+    Pares retirada -> depósito emparejados, en formato columnar.
+
+    Attributes:
+        out_rows / in_rows: Filas del frame de la retirada y del depósito
+        confidence: Confianza de cada par (0-1)
+        delay_us: Retraso del depósito respecto a la retirada (microsegundos)
+    """
+    frame: TransactionFrame
+    out_rows: np.ndarray = field(default_factory=lambda: np.empty(0, dtype=np.int64))
+    in_rows: np.ndarray = field(default_factory=lambda: np.empty(0, dtype=np.int64))
+    confidence: np.ndarray = field(default_factory=lambda: np.empty(0, dtype=np.float64))
+    delay_us: np.ndarray = field(default_factory=lambda: np.empty(0, dtype=np.int64))
+
+    def __len__(self) -> int:
+        return len(self.out_rows)
+
+    def pairs(self) -> Iterator[Tuple[str, str, float]]:
+        """Iterar (tx_id retirada, tx_id depósito, confianza)"""
+        out_ids = self.frame.tx_ids[self.out_rows]
+        in_ids = self.frame.tx_ids[self.in_rows]
+        yield from zip(out_ids.tolist(), in_ids.tolist(), self.confidence.tolist())
+
+    def labels(self) -> Tuple[List[str], List[str], List[str], List[Decimal]]:
+        """
+        Columnas para la reclasificación masiva: (tx_id, kontorl_type,
+        tx_id de la contrapartida, confianza DECIMAL(3, 2)), primero retiradas
+        y luego depósitos.
+        """
+        return transfer_labels(
+            self.frame.tx_ids[self.out_rows].tolist(),
+            self.frame.tx_ids[self.in_rows].tolist(),
+            self.confidence.tolist()
+        )
+
+def transfer_labels(out_ids: List[str], in_ids: List[str],
+                    confidences: List[float]) -> Tuple[List[str], List[str], List[str], List[Decimal]]:
+    """Columnas de TransactionRepository.apply_transfer_matches para pares (retirada, depósito)"""
+    confidence = [Decimal(f'{value:.2f}') for value in confidences]
+    return (
+        out_ids + in_ids,
+        ['INTERNAL_TRANSFER_OUT'] * len(out_ids) + ['INTERNAL_TRANSFER_IN'] * len(in_ids),
+        in_ids + out_ids,
+        confidence + confidence
+    )
+
+def sweep_candidates(
+    out_assets: np.ndarray,
+    out_times: np.ndarray,
+    in_assets: np.ndarray,
+    in_times: np.ndarray,
+    window_us: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Pares (retirada, depósito) del mismo asset a no más de window_us.
+
+    Cada lado se ordena por (asset, tiempo) y, dentro de cada asset, los
+    límites de la ventana de cada depósito se obtienen con dos búsquedas
+    binarias sobre las retiradas ordenadas (el barrido de dos punteros,
+    vectorizado). El coste es O(n log n + pares), no O(salidas x entradas).
+
+    Returns:
+        Índices de posición en los arrays de entrada de cada par candidato
+    """
+    out_order = np.lexsort((out_times, out_assets))
+    in_order = np.lexsort((in_times, in_assets))
+    sorted_out_assets = out_assets[out_order]
+    sorted_out_times = out_times[out_order]
+    sorted_in_assets = in_assets[in_order]
+    sorted_in_times = in_times[in_order]
+
+    # Tramo [lo, hi) de retiradas del mismo asset dentro de la ventana de cada depósito
+    lo = np.empty(len(in_order), dtype=np.int64)
+    hi = np.empty(len(in_order), dtype=np.int64)
+    assets, in_starts = np.unique(sorted_in_assets, return_index=True)
+    in_ends = np.append(in_starts[1:], len(in_order))
+    out_starts = np.searchsorted(sorted_out_assets, assets, side='left')
+    out_ends = np.searchsorted(sorted_out_assets, assets, side='right')
+    for in_start, in_end, out_start, out_end in zip(in_starts, in_ends, out_starts, out_ends):
+        times = sorted_in_times[in_start:in_end]
+        segment = sorted_out_times[out_start:out_end]
+        lo[in_start:in_end] = out_start + np.searchsorted(segment, times - window_us, side='left')
+        hi[in_start:in_end] = out_start + np.searchsorted(segment, times + window_us, side='right')
+
+    counts = hi - lo
+    total = int(counts.sum())
+    in_positions = np.repeat(np.arange(len(in_order)), counts)
+    offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+    out_positions = np.repeat(lo, counts) + offsets
+    return out_order[out_positions], in_order[in_positions]
+
+def compare_addresses(out_source: np.ndarray, out_destination: np.ndarray,
+                      in_source: np.ndarray, in_destination: np.ndarray) -> np.ndarray:
+    """
+    Coincidencia de direcciones de cada par (int8) a partir de sus códigos (-1 = desconocida).
+
+    1 si retirada y depósito comparten dirección de origen o de destino,
+    -1 si ambos tienen destino y no coincide, 0 si no hay datos.
+    """
+    known = (out_destination >= 0) & (in_destination >= 0)
+    same = (known & (out_destination == in_destination)) | (
+        (out_source >= 0) & (in_source >= 0) & (out_source == in_source)
+    )
+    return np.where(same, 1, np.where(known, -1, 0)).astype(np.int8)
+
+def address_evidence(frame: TransactionFrame, out_index: np.ndarray, in_index: np.ndarray) -> np.ndarray:
+    """Coincidencia de direcciones de los pares (retirada, depósito) de un frame (ver compare_addresses)"""
+    return compare_addresses(
+        frame.source_address[out_index], frame.destination_address[out_index],
+        frame.source_address[in_index], frame.destination_address[in_index]
+    )
+
+def solve_assignment(value: np.ndarray) -> np.ndarray:
+    """
+    Asignación de valor total máximo (algoritmo húngaro, O(n² m)).
+
+    Versión de potenciales con caminos de aumento más cortos; el bucle
+    interior (actualizar las distancias de todas las columnas) está
+    vectorizado con NumPy.
+
+    Args:
+        value: Matriz n x m (0 = sin arista)
+
+    Returns:
+        Columna asignada a cada fila (-1 si la fila queda libre)
+    """
+    rows, columns = value.shape
+    if rows > columns:
+        assigned = np.full(rows, -1, dtype=np.int64)
+        by_column = solve_assignment(value.T)
+        assigned[by_column[by_column >= 0]] = np.flatnonzero(by_column >= 0)
+        return assigned
+
+    cost = -value
+    u = np.zeros(rows + 1)
+    v = np.zeros(columns + 1)
+    owner = np.zeros(columns + 1, dtype=np.int64)  # Fila (1..n) de cada columna, 0 = libre
+    way = np.zeros(columns + 1, dtype=np.int64)
+    for row in range(1, rows + 1):
+        owner[0] = row
+        column = 0
+        distance = np.full(columns + 1, np.inf)
+        used = np.zeros(columns + 1, dtype=bool)
+        while True:
+            used[column] = True
+            current = cost[owner[column] - 1] - u[owner[column]] - v[1:]
+            free = ~used[1:]
+            better = free & (current < distance[1:])
+            distance[1:][better] = current[better]
+            way[1:][better] = column
+            pending = np.where(free, distance[1:], np.inf)
+            following = int(np.argmin(pending)) + 1
+            delta = pending[following - 1]
+            visited = np.flatnonzero(used)
+            u[owner[visited]] += delta
+            v[visited] -= delta
+            distance[1:][free] -= delta
+            column = following
+            if owner[column] == 0:
+                break
+        while column:
+            previous = way[column]
+            owner[column] = owner[previous]
+            column = previous
+
+    assigned = np.full(rows, -1, dtype=np.int64)
+    taken = np.flatnonzero(owner[1:])
+    assigned[owner[1:][taken] - 1] = taken
+    return assigned
+
+def pair_components(out_index: np.ndarray, in_index: np.ndarray) -> np.ndarray:
+    """Componente conexo (raíz) de cada par en el grafo retiradas-depósitos"""
+    parent: dict = {}
+
+    def find(node):
+        root = node
+        while parent.get(root, root) != root:
+            root = parent[root]
+        while node != root:
+            parent[node], node = root, parent.get(node, node)
+        return root
+
+    for out_row, in_row in zip(out_index.tolist(), in_index.tolist()):
+        out_root, in_root = find(('out', out_row)), find(('in', in_row))
+        if out_root != in_root:
+            parent[in_root] = out_root
+    return np.array([find(('out', out_row))[1] for out_row in out_index.tolist()], dtype=np.int64)
+
+def assign_max_confidence(out_index: np.ndarray, in_index: np.ndarray, confidence: np.ndarray) -> np.ndarray:
+    """
+    Asignación 1 a 1 que maximiza la confianza total.
+
+    Los pares sin conflicto (retirada y depósito que sólo aparecen en ese
+    par) se aceptan directamente; el resto se agrupa en componentes
+    conexos (p. ej. una retirada por lotes con varios depósitos en su
+    ventana) y cada uno se resuelve como problema de asignación.
+
+    Returns:
+        Posiciones de los pares aceptados
+    """
+    _, out_inverse, out_counts = np.unique(out_index, return_inverse=True, return_counts=True)
+    _, in_inverse, in_counts = np.unique(in_index, return_inverse=True, return_counts=True)
+    unique = (out_counts[out_inverse] == 1) & (in_counts[in_inverse] == 1)
+    accepted = [np.flatnonzero(unique)]
+
+    conflicted = np.flatnonzero(~unique)
+    if len(conflicted):
+        roots = pair_components(out_index[conflicted], in_index[conflicted])
+        order = np.argsort(roots, kind='stable')
+        boundaries = np.flatnonzero(np.diff(roots[order])) + 1
+        for component in np.split(conflicted[order], boundaries):
+            outs, out_positions = np.unique(out_index[component], return_inverse=True)
+            ins, in_positions = np.unique(in_index[component], return_inverse=True)
+            if max(len(outs), len(ins)) > MAX_ASSIGNMENT_SIZE:
+                logger.warning(
+                    f"Componente de {len(outs)} retiradas y {len(ins)} depósitos: asignación por confianza descendente"
+                )
+                accepted.append(component[assign_greedy(out_index[component], in_index[component],
+                                                         confidence[component])])
+                continue
+            value = np.zeros((len(outs), len(ins)))
+            value[out_positions, in_positions] = confidence[component]
+            pair_at = np.full((len(outs), len(ins)), -1, dtype=np.int64)
+            pair_at[out_positions, in_positions] = component
+            assigned = solve_assignment(value)
+            rows = np.flatnonzero(assigned >= 0)
+            chosen = pair_at[rows, assigned[rows]]
+            accepted.append(chosen[chosen >= 0])
+
+    return np.sort(np.concatenate(accepted))
+
+def assign_greedy(out_index: np.ndarray, in_index: np.ndarray, confidence: np.ndarray) -> np.ndarray:
+    """
+    Asignación 1 a 1 por confianza descendente.
+
+    Cada retirada y cada depósito se usa una sola vez: los pares se
+    recorren de mayor a menor confianza y se acepta el primero libre.
+
+    Returns:
+        Posiciones de los pares aceptados
+    """
+    order = np.argsort(-confidence, kind='stable')
+    used_out = set()
+    used_in = set()
+    accepted = []
+    for position, out_row, in_row in zip(order.tolist(), out_index[order].tolist(), in_index[order].tolist()):
+        if out_row in used_out or in_row in used_in:
+            continue
+        used_out.add(out_row)
+        used_in.add(in_row)
+        accepted.append(position)
+    return np.array(accepted, dtype=np.int64)
+
+class InternalTransferMatcher:
+    """
+    Emparejador de transferencias internas.
+
+    Una retirada y un depósito son la misma transferencia cuando tienen el
+    mismo asset, el depósito llega dentro de la ventana de tiempo y lo
+    recibido es igual a lo enviado menos, como mucho, la tolerancia de
+    comisión. Todos los pares candidatos se puntúan a la vez (importe,
+    retraso y direcciones) y los conflictos (varios depósitos en la
+    ventana de una retirada o al revés) se resuelven con la asignación
+    1 a 1 de mayor confianza total de cada componente.
+
+    Attributes:
+        time_window_seconds: Ventana de tiempo (MATCHING_ENGINE_TIME_WINDOW_SECONDS)
+        confidence_threshold: Confianza mínima (MATCHING_ENGINE_CONFIDENCE_THRESHOLD)
+        fee_tolerance: Tolerancia de comisión (0.001 = 0.1%)
+    """
+
+    def __init__(
+        self,
+        time_window_seconds: Optional[int] = None,
+        confidence_threshold: Optional[float] = None,
+        fee_tolerance: float = FEE_TOLERANCE
+    ):
+        settings = get_settings()
+        self.time_window_seconds = (
+            time_window_seconds if time_window_seconds is not None else settings.matching_engine_time_window_seconds
+        )
+        self.confidence_threshold = (
+            confidence_threshold if confidence_threshold is not None else settings.matching_engine_confidence_threshold
+        )
+        self.fee_tolerance = fee_tolerance
+
+    @property
+    def window_us(self) -> int:
+        return self.time_window_seconds * _MICROSECONDS
+
+    def candidate_masks(self, frame: TransactionFrame) -> Tuple[np.ndarray, np.ndarray]:
+        """Máscaras de retiradas y depósitos por emparejar"""
+        transfers = frame.type_mask('TRANSFER')
+        outflows = transfers & frame.kontorl_type_mask(OUTFLOW_TYPE) & (frame.asset_out >= 0)
+        inflows = transfers & frame.kontorl_type_mask(INFLOW_TYPE) & (frame.asset_in >= 0)
+        return outflows, inflows
+
+    def score(self, sent: np.ndarray, received: np.ndarray, delay_us: np.ndarray,
+              addresses: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Confianza de cada par; NaN si el importe queda fuera de la tolerancia.
+
+        Args:
+            sent: Importe de la retirada (float)
+            received: Importe del depósito (float)
+            delay_us: Tiempo del depósito menos el de la retirada
+            addresses: Coincidencia de direcciones (address_evidence, opcional)
+        """
+        window_us = self.window_us
+        with np.errstate(divide='ignore', invalid='ignore'):
+            fee_share = (sent - received) / sent
+        valid = (sent > 0) & (fee_share >= 0) & (fee_share <= self.fee_tolerance)
+
+        confidence = 1.0 - EARLY_ARRIVAL_PENALTY * (delay_us < 0)
+        if window_us:
+            confidence -= TIME_PENALTY * np.abs(delay_us) / window_us
+        if self.fee_tolerance:
+            confidence -= AMOUNT_PENALTY * np.where(valid, fee_share, 0.0) / self.fee_tolerance
+        if addresses is not None:
+            confidence = np.minimum(confidence + ADDRESS_MATCH_BONUS * (addresses > 0), 1.0)
+            confidence -= ADDRESS_MISMATCH_PENALTY * (addresses < 0)
+        return np.where(valid, confidence, np.nan)
+
+    def match(self, frame: TransactionFrame) -> TransferMatches:
+        """
+        Emparejar las transferencias internas de un frame.
+
+        Args:
+            frame: Transacciones del usuario (al menos las retiradas y
+                depósitos sin clasificar; el orden es indiferente)
+
+        Returns:
+            TransferMatches con los pares aceptados
+        """
+        outflows, inflows = self.candidate_masks(frame)
+        out_rows = np.flatnonzero(outflows)
+        in_rows = np.flatnonzero(inflows)
+        if not len(out_rows) or not len(in_rows):
+            return TransferMatches(frame)
+
+        out_positions, in_positions = sweep_candidates(
+            frame.asset_out[out_rows], frame.timestamps[out_rows],
+            frame.asset_in[in_rows], frame.timestamps[in_rows],
+            self.window_us
+        )
+        out_index = out_rows[out_positions]
+        in_index = in_rows[in_positions]
+
+        delay_us = frame.timestamps[in_index] - frame.timestamps[out_index]
+        confidence = self.score(
+            frame.amount_out[out_index].to_float(), frame.amount_in[in_index].to_float(), delay_us,
+            address_evidence(frame, out_index, in_index)
+        )
+        eligible = confidence >= self.confidence_threshold
+        out_index, in_index = out_index[eligible], in_index[eligible]
+        confidence, delay_us = confidence[eligible], delay_us[eligible]
+
+        accepted = assign_max_confidence(out_index, in_index, confidence)
+        logger.debug(
+            f"Transferencias internas: {len(out_rows)} retiradas, {len(in_rows)} depósitos, "
+            f"{int(eligible.sum())} pares elegibles de {len(eligible)} en ventana, {len(accepted)} emparejados"
+        )
+        return TransferMatches(
+            frame=frame,
+            out_rows=out_index[accepted],
+            in_rows=in_index[accepted],
+            confidence=confidence[accepted],
+            delay_us=delay_us[accepted]
+        )
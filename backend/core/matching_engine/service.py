@@ -0,0 +1,147 @@
+"""
+KONTROL Matching Engine Service
+Reconciliación de transacciones de un usuario (transferencias internas)
+"""
+
+import logging
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Iterable, Optional
+
+import numpy as np
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from core.matching_engine.incremental import IncrementalTransferMatcher
+from core.matching_engine.internal_transfers import (
+    INFLOW_TYPE, OUTFLOW_TYPE, InternalTransferMatcher, transfer_labels
+)
+from core.transaction_frame import TransactionFrame, from_epoch_us, load_transaction_frame
+from utils.database import AsyncSessionLocal, TransactionRepository
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class ReconciliationResult:
+    """
+    Resultado de una reconciliación.
+
+    Attributes:
+        candidates: Retiradas y depósitos sin clasificar examinados
+        matches: Pares reclasificados como transferencia interna (los dos lados)
+        updated: Filas reclasificadas
+    """
+    candidates: int = 0
+    matches: int = 0
+    updated: int = 0
+
+class MatchingEngineService:
+    """
+    Servicio del matching engine.
+
+    Sólo se cargan (en formato columnar) las retiradas y depósitos aún sin
+    clasificar; los pares se reclasifican con un único UPDATE masivo.
+
+    Tras cada sincronización, match_new_transactions empareja sólo lo
+    recién ingerido contra el índice de ventana (MATCHING_ENGINE_INDEX_BACKEND),
+    sin recorrer el historial; la reconciliación completa queda para
+    reprocesos y reinicia el índice del usuario.
+    """
+
+    def __init__(self, session: Optional[AsyncSession] = None, matcher: Optional[InternalTransferMatcher] = None,
+                 index=None):
+        self.session = session
+        self.matcher = matcher or InternalTransferMatcher()
+        self.incremental = IncrementalTransferMatcher(index, self.matcher)
+
+    async def reconcile_internal_transfers(
+        self,
+        user_id: str,
+        start_date: Optional[datetime] = None,
+        end_date: Optional[datetime] = None
+    ) -> ReconciliationResult:
+        """
+        Detectar y clasificar las transferencias internas de un usuario.
+
+        Args:
+            user_id: ID del usuario
+            start_date: Fecha inicial (inclusive, opcional)
+            end_date: Fecha final (inclusive, opcional)
+
+        Returns:
+            ReconciliationResult con candidatos, pares y filas actualizadas
+        """
+        if self.session is not None:
+            return await self._reconcile(self.session, user_id, start_date, end_date)
+        async with AsyncSessionLocal() as session:
+            return await self._reconcile(session, user_id, start_date, end_date)
+
+    async def match_new_transactions(self, user_id: str, transactions: Iterable[Any]) -> ReconciliationResult:
+        """
+        Emparejar las transacciones recién ingeridas de un usuario.
+
+        Cada retirada o depósito nuevo se compara sólo con los pendientes
+        de su asset dentro de la ventana; los pares se reclasifican al
+        momento y el resto queda en el índice esperando contrapartida.
+
+        Args:
+            user_id: ID del usuario
+            transactions: Filas ya guardadas (modelos, diccionarios con tx_id_kontrol...)
+
+        Returns:
+            ReconciliationResult de la pasada incremental
+        """
+        frame = TransactionFrame.from_rows(transactions)
+        if not len(frame):
+            return ReconciliationResult()
+        if self.session is not None:
+            return await self._match_incremental(self.session, user_id, frame)
+        async with AsyncSessionLocal() as session:
+            return await self._match_incremental(session, user_id, frame)
+
+    async def _match_incremental(self, session, user_id: str, frame: TransactionFrame) -> ReconciliationResult:
+        repository = TransactionRepository(session)
+        index = self.incremental.index
+        window_us = self.matcher.window_us
+        earliest = int(frame.timestamps.min()) - window_us
+        latest = int(frame.timestamps.max())
+
+        # Cargar desde la base de datos el tramo que el índice aún no cubre
+        coverage = await index.get_coverage(user_id)
+        if coverage is None or earliest < coverage:
+            stored = await load_transaction_frame(
+                repository, user_id,
+                start_date=from_epoch_us(earliest),
+                end_date=from_epoch_us(coverage - 1) if coverage is not None else None,
+                kontorl_types=(OUTFLOW_TYPE, INFLOW_TYPE)
+            )
+            stored = stored.take(~np.isin(stored.tx_ids, frame.tx_ids))
+            seeded = await self.incremental.seed(user_id, stored)
+            coverage = earliest
+            logger.debug(f"Índice de matching de {user_id}: {seeded} movimientos pendientes cargados")
+
+        matches = await self.incremental.process(user_id, frame)
+        # Lo anterior a la ventana del último movimiento ya ha caducado
+        await index.set_coverage(user_id, max(coverage, latest - window_us))
+
+        updated = await repository.apply_transfer_matches(
+            user_id, *transfer_labels(matches.out_ids, matches.in_ids, matches.confidence)
+        )
+        if updated < 2 * len(matches):
+            # Otro proceso (con otro índice) emparejó alguno de los lados: el
+            # índice de este proceso está desfasado y se recarga en la siguiente pasada
+            await index.clear(user_id)
+        if len(matches):
+            logger.info(f"Transferencias internas de {user_id} (incremental): {updated // 2} pares")
+        return ReconciliationResult(candidates=len(frame), matches=updated // 2, updated=updated)
+
+    async def _reconcile(self, session, user_id, start_date, end_date) -> ReconciliationResult:
+        repository = TransactionRepository(session)
+        frame = await load_transaction_frame(
+            repository, user_id, start_date, end_date, kontorl_types=(OUTFLOW_TYPE, INFLOW_TYPE)
+        )
+        matches = self.matcher.match(frame)
+        updated = await repository.apply_transfer_matches(user_id, *matches.labels())
+        # Los pendientes del índice pueden haber quedado emparejados
+        await self.incremental.index.clear(user_id)
+        logger.info(f"Transferencias internas de {user_id}: {updated // 2} pares sobre {len(frame)} movimientos")
+        return ReconciliationResult(candidates=len(frame), matches=updated // 2, updated=updated)
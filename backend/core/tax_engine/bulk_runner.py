@@ -0,0 +1,258 @@
+"""
+KONTROL Tax Bulk Runner
+Regeneración masiva de reportes fiscales (temporada de declaración) en un pool de procesos
+
+Uso (desde backend/):
+    python -m core.tax_engine.bulk_runner --year 2025
+"""
+
+import argparse
+import asyncio
+import logging
+import math
+import multiprocessing
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from config.settings import get_settings
+from core.tax_engine.tax_calculator import REPORT_METHODS, TaxCalculator
+from utils.database import AsyncSessionLocal, TaxReportRepository, UserRepository
+
+logger = logging.getLogger(__name__)
+
+# Shards en vuelo por proceso: mantiene los workers ocupados sin encolar
+# (ni serializar) toda la lista de usuarios de golpe
+SHARDS_PER_WORKER = 2
+
+@dataclass
+class BulkRunStats:
+    """
+    Métricas de una ejecución masiva (o de un shard).
+
+    Attributes:
+        users: Usuarios calculados con éxito
+        transactions: Eventos fiscales recorridos
+        reports: Filas tax_reports escritas
+        latencies: Segundos de cálculo por usuario
+        failures: Pares (user_id, error) de los usuarios fallidos
+        elapsed: Duración total en segundos (sólo en el agregado)
+    """
+    users: int = 0
+    transactions: int = 0
+    reports: int = 0
+    latencies: List[float] = field(default_factory=list)
+    failures: List[Tuple[str, str]] = field(default_factory=list)
+    elapsed: float = 0.0
+
+    def merge(self, other: 'BulkRunStats') -> None:
+        """Acumular las métricas de un shard"""
+        self.users += other.users
+        self.transactions += other.transactions
+        self.reports += other.reports
+        self.latencies.extend(other.latencies)
+        self.failures.extend(other.failures)
+
+    @property
+    def users_per_second(self) -> float:
+        return self.users / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def transactions_per_second(self) -> float:
+        return self.transactions / self.elapsed if self.elapsed else 0.0
+
+    def percentile(self, q: float) -> float:
+        """Latencia por usuario en el percentil q (0-100, nearest-rank)"""
+        if not self.latencies:
+            return 0.0
+        ordered = sorted(self.latencies)
+        rank = min(max(math.ceil(q * len(ordered) / 100), 1), len(ordered))
+        return ordered[rank - 1]
+
+    def summary(self) -> str:
+        """Resumen legible de la ejecución"""
+        return (
+            f"{self.users} usuarios, {self.transactions} transacciones, {self.reports} reportes "
+            f"en {self.elapsed:.1f}s ({self.users_per_second:.2f} usuarios/s, "
+            f"{self.transactions_per_second:.0f} tx/s); latencia p50={self.percentile(50):.3f}s "
+            f"p95={self.percentile(95):.3f}s p99={self.percentile(99):.3f}s; "
+            f"{len(self.failures)} fallos"
+        )
+
+# Bucle de eventos propio de cada proceso del pool: el motor asíncrono de
+# utils.database mantiene conexiones ligadas al bucle que las abrió
+_worker_loop: Optional[asyncio.AbstractEventLoop] = None
+
+def _init_worker() -> None:
+    global _worker_loop
+    _worker_loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(_worker_loop)
+
+def _run_shard(users: List[Tuple[str, str]], year: int, methods: Sequence[str], write_batch_size: int) -> BulkRunStats:
+    """Punto de entrada en el proceso worker"""
+    return _worker_loop.run_until_complete(_process_shard(users, year, methods, write_batch_size))
+
+async def _process_shard(
+    users: List[Tuple[str, str]],
+    year: int,
+    methods: Sequence[str],
+    write_batch_size: int
+) -> BulkRunStats:
+    """
+    Calcular los reportes de un shard de usuarios con una única sesión.
+
+    Cada usuario recorre su historial en bloques (memoria acotada); las
+    filas tax_reports se acumulan y se escriben en upserts de
+    write_batch_size filas. Un fallo de un usuario (o de la escritura de
+    sus reportes) no detiene el shard.
+    """
+    stats = BulkRunStats()
+    cache_enabled = get_settings().tax_report_cache_enabled
+    pending_rows: List[Dict] = []
+    pending_users: List[str] = []
+
+    async with AsyncSessionLocal() as session:
+        repository = TaxReportRepository(session)
+
+        async def flush() -> None:
+            try:
+                await repository.upsert_reports(pending_rows)
+                stats.reports += len(pending_rows)
+            except Exception as e:
+                await session.rollback()
+                logger.error(f"Error guardando reportes {year} de {len(pending_users)} usuarios: {e}")
+                stats.users -= len(pending_users)
+                stats.failures.extend((user_id, str(e)) for user_id in pending_users)
+            pending_rows.clear()
+            pending_users.clear()
+
+        for user_id, jurisdiction in users:
+            started = time.perf_counter()
+            try:
+                calculator = TaxCalculator(user_id, jurisdiction, session=session)
+                cache_keys = await calculator.current_cache_keys(year, methods) if cache_enabled else {}
+                reports = await calculator.calculate_all_methods(year, methods)
+            except Exception as e:
+                await session.rollback()
+                logger.error(f"Error calculando reportes {year} de {user_id}: {e}")
+                stats.failures.append((user_id, str(e)))
+                continue
+
+            stats.latencies.append(time.perf_counter() - started)
+            stats.users += 1
+            stats.transactions += calculator.processed_transactions
+            pending_rows.extend(
+                report.to_row(user_id, cache_keys.get(method)) for method, report in reports.items()
+            )
+            pending_users.append(user_id)
+
+            if len(pending_rows) >= write_batch_size:
+                await flush()
+
+        if pending_rows:
+            await flush()
+
+    return stats
+
+async def _load_users(tiers: Sequence[str], year: int) -> List[Tuple[str, str, int]]:
+    async with AsyncSessionLocal() as session:
+        return await UserRepository(session).get_tax_season_users(list(tiers), year)
+
+def make_shards(users: Sequence[Tuple[str, str, int]], shard_size: int) -> List[List[Tuple[str, str]]]:
+    """
+    Repartir usuarios (ordenados de mayor a menor historial) en shards.
+
+    Los usuarios con más transacciones salen primero, de modo que el
+    trabajo más largo empieza antes y los shards pequeños del final
+    rellenan los huecos (longest-processing-time first).
+    """
+    return [
+        [(str(user_id), jurisdiction) for user_id, jurisdiction, _ in users[start:start + shard_size]]
+        for start in range(0, len(users), shard_size)
+    ]
+
+def run_bulk(
+    year: int,
+    methods: Sequence[str] = REPORT_METHODS,
+    tiers: Optional[Sequence[str]] = None,
+    workers: Optional[int] = None,
+    shard_size: Optional[int] = None,
+    write_batch_size: Optional[int] = None
+) -> BulkRunStats:
+    """
+    Regenerar los reportes fiscales de un año para todos los usuarios de los planes indicados.
+
+    Args:
+        year: Año fiscal
+        methods: Métodos a calcular por usuario
+        tiers: Planes de suscripción incluidos (por defecto TAX_BULK_TIERS)
+        workers: Procesos del pool (por defecto TAX_BULK_WORKERS, 0 = uno por CPU)
+        shard_size: Usuarios por tarea del pool
+        write_batch_size: Filas tax_reports por upsert
+
+    Returns:
+        BulkRunStats con throughput y latencias por usuario
+    """
+    settings = get_settings()
+    tiers = tiers or settings.tax_bulk_tiers
+    workers = workers or settings.tax_bulk_workers or os.cpu_count() or 1
+    shard_size = shard_size or settings.tax_bulk_shard_size
+    write_batch_size = write_batch_size or settings.tax_bulk_write_batch_size
+
+    users = asyncio.run(_load_users(tiers, year))
+    shards = iter(make_shards(users, shard_size))
+    logger.info(f"Regenerando reportes {year} de {len(users)} usuarios ({', '.join(tiers)}) con {workers} procesos")
+
+    stats = BulkRunStats()
+    started = time.perf_counter()
+
+    # spawn: los procesos no heredan el pool de conexiones del padre
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_worker) as pool:
+        pending = {}
+
+        def submit_next() -> None:
+            shard = next(shards, None)
+            if shard is not None:
+                pending[pool.submit(_run_shard, shard, year, list(methods), write_batch_size)] = shard
+
+        for _ in range(workers * SHARDS_PER_WORKER):
+            submit_next()
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                shard = pending.pop(future)
+                try:
+                    stats.merge(future.result())
+                except Exception as e:
+                    # Fallo fuera del bucle por usuario (conexión, proceso caído...)
+                    logger.error(f"Error en un shard de {len(shard)} usuarios: {e}")
+                    stats.failures.extend((user_id, str(e)) for user_id, _ in shard)
+                submit_next()
+            logger.info(f"Progreso: {stats.users + len(stats.failures)}/{len(users)} usuarios")
+
+    stats.elapsed = time.perf_counter() - started
+    logger.info(f"Reportes {year} regenerados: {stats.summary()}")
+    return stats
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[2])
+    parser.add_argument('--year', type=int, default=datetime.now(timezone.utc).year - 1, help='Año fiscal')
+    parser.add_argument('--methods', nargs='+', default=list(REPORT_METHODS), help='Métodos a calcular')
+    parser.add_argument('--tiers', nargs='+', default=None, help='Planes de suscripción incluidos')
+    parser.add_argument('--workers', type=int, default=None, help='Procesos del pool')
+    parser.add_argument('--shard-size', type=int, default=None, help='Usuarios por tarea')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    stats = run_bulk(args.year, args.methods, args.tiers, args.workers, args.shard_size)
+    print(stats.summary())
+    for user_id, error in stats.failures:
+        print(f"  {user_id}: {error}")
+
+if __name__ == '__main__':
+    main()
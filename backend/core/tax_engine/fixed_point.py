@@ -0,0 +1,159 @@
+"""
+KONTROL Fixed Point
+Aritmética exacta en punto fijo (enteros escalados 10^18) para los bucles del motor fiscal
+"""
+
+from decimal import (
+    Context, Decimal, ROUND_CEILING, ROUND_DOWN, ROUND_FLOOR, ROUND_HALF_DOWN,
+    ROUND_HALF_EVEN, ROUND_HALF_UP, ROUND_UP
+)
+from typing import Any, Optional, Tuple
+
+# Un valor v se representa como el entero v * 10^18 (unidades de 1e-18)
+SCALE = 10 ** 18
+FRACTION_DIGITS = 18
+
+# Contexto sin pérdida para las conversiones (DECIMAL(38, 18) cabe de sobra)
+_CONTEXT = Context(prec=80, rounding=ROUND_HALF_EVEN)
+
+# Cota de (|q * p| + fee * 10^18) * amount por debajo de la cual el reparto
+# de la comisión coincide bit a bit con el camino Decimal de precisión 80
+# (ver gain_components); por encima se usa ese camino
+MAX_EXACT_FEE_BOUND = 10 ** 78
+
+ROUNDING_MODES = (
+    ROUND_HALF_EVEN, ROUND_HALF_UP, ROUND_HALF_DOWN,
+    ROUND_DOWN, ROUND_UP, ROUND_FLOOR, ROUND_CEILING
+)
+
+def to_scaled(value: Any, rounding: str = ROUND_HALF_EVEN) -> int:
+    """
+    Convertir un valor numérico a entero escalado.
+
+    Los valores con más de 18 decimales se redondean con `rounding`,
+    igual que al guardarlos en una columna DECIMAL(38, 18).
+    """
+    if value is None:
+        return 0
+    if isinstance(value, int):
+        return value * SCALE
+    if not isinstance(value, Decimal):
+        value = Decimal(str(value))
+    # La razón entera de un Decimal es exacta; el denominador divide a 10^18
+    # salvo que haya más de 18 decimales
+    numerator, denominator = value.as_integer_ratio()
+    quotient, remainder = divmod(numerator * SCALE, denominator)
+    if not remainder:
+        return quotient
+    return round_div(numerator * SCALE, denominator, rounding)
+
+def from_scaled(value: int) -> Decimal:
+    """Convertir un entero escalado a Decimal con exponente -18 (igual que quantize)"""
+    return Decimal(value).scaleb(-FRACTION_DIGITS, _CONTEXT)
+
+def format_scaled(value: int) -> str:
+    """Representación textual exacta de un entero escalado (siempre con 18 decimales)"""
+    digits = str(-value if value < 0 else value).rjust(FRACTION_DIGITS + 1, '0')
+    return ('-' if value < 0 else '') + digits[:-FRACTION_DIGITS] + '.' + digits[-FRACTION_DIGITS:]
+
+def round_div(numerator: int, denominator: int, rounding: str = ROUND_HALF_EVEN) -> int:
+    """
+    División entera con redondeo explícito (misma semántica que decimal).
+
+    Args:
+        numerator: Dividendo
+        denominator: Divisor (distinto de cero)
+        rounding: Modo de redondeo de decimal (ROUND_HALF_EVEN, ROUND_HALF_UP, ...)
+
+    Returns:
+        Cociente redondeado
+    """
+    if denominator < 0:
+        numerator, denominator = -numerator, -denominator
+
+    quotient, remainder = divmod(numerator, denominator)
+    if not remainder:
+        return quotient
+
+    # divmod redondea hacia -infinito: quotient es el suelo del cociente
+    if rounding == ROUND_HALF_EVEN:
+        twice = remainder * 2
+        if twice > denominator or (twice == denominator and quotient & 1):
+            quotient += 1
+    elif rounding == ROUND_HALF_UP:
+        # Empates alejándose de cero
+        twice = remainder * 2
+        if twice > denominator or (twice == denominator and quotient >= 0):
+            quotient += 1
+    elif rounding == ROUND_HALF_DOWN:
+        # Empates hacia cero
+        twice = remainder * 2
+        if twice > denominator or (twice == denominator and quotient < 0):
+            quotient += 1
+    elif rounding == ROUND_DOWN:
+        if quotient < 0:
+            quotient += 1
+    elif rounding == ROUND_UP:
+        if quotient >= 0:
+            quotient += 1
+    elif rounding == ROUND_CEILING:
+        quotient += 1
+    elif rounding != ROUND_FLOOR:
+        raise ValueError(f"Modo de redondeo no soportado: {rounding}")
+    return quotient
+
+def gain_components(
+    quantity: int,
+    unit_cost: int,
+    unit_price: int,
+    fee: int,
+    amount: int,
+    rounding: str = ROUND_HALF_EVEN
+) -> Optional[Tuple[int, int]]:
+    """
+    Coste de adquisición e importe de venta de una cantidad consumida.
+
+    Replica el cálculo Decimal del TaxCalculator con un único redondeo
+    exacto: coste = q * c y venta = q * p - fee * q / amount, ambos
+    redondeados a 18 decimales.
+
+    El coste y la venta sin comisión son productos exactos en ambos caminos.
+    Con comisión, el camino Decimal (precisión 80) redondea la división y la
+    resta con un error menor que (|q * p| + fee) * 1e-79, mientras que el
+    valor exacto, de denominador amount * 10^18, está a más de
+    1 / (2 * amount * 10^18) de cualquier empate. Bajo MAX_EXACT_FEE_BOUND el
+    error no alcanza esa distancia y ambos caminos coinciden bit a bit.
+
+    Args:
+        quantity: Cantidad consumida (escalada)
+        unit_cost: Coste unitario del lote (escalado)
+        unit_price: Precio unitario de la venta (escalado)
+        fee: Comisión total de la venta (escalada)
+        amount: Cantidad total de la venta (escalada)
+        rounding: Modo de redondeo de la jurisdicción
+
+    Returns:
+        Tupla (coste, venta) escalados, o None si la venta excede el rango
+        con identidad garantizada
+    """
+    gross = quantity * unit_price
+    if fee and amount:
+        if (abs(gross) + abs(fee) * SCALE) * abs(amount) >= MAX_EXACT_FEE_BOUND:
+            return None
+        numerator, denominator = gross * amount - fee * quantity * SCALE, amount * SCALE
+    else:
+        numerator, denominator = gross, SCALE
+
+    if rounding != ROUND_HALF_EVEN or denominator < 0:
+        return round_div(quantity * unit_cost, SCALE, rounding), round_div(numerator, denominator, rounding)
+
+    # Camino rápido: redondeo bancario en línea (el caso de todas las jurisdicciones)
+    cost_basis, remainder = divmod(quantity * unit_cost, SCALE)
+    twice = remainder * 2
+    if twice > SCALE or (twice == SCALE and cost_basis & 1):
+        cost_basis += 1
+    proceeds, remainder = divmod(numerator, denominator)
+    twice = remainder * 2
+    if twice > denominator or (twice == denominator and proceeds & 1):
+        proceeds += 1
+    return cost_basis, proceeds
@@ -0,0 +1,385 @@
+"""
+KONTROL Lot Inventory
+Inventarios de lotes abiertos para los métodos FIFO, LIFO, HIFO, coste medio y por exchange
+"""
+
+import dataclasses
+import heapq
+import itertools
+from collections import deque
+from decimal import Decimal
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from core.tax_engine.fixed_point import format_scaled, from_scaled, to_scaled
+from core.tax_engine.models import DECIMAL_CONTEXT, Lot, Transaction
+
+class LotInventory:
+    """
+    Inventario de lotes abiertos por asset.
+
+    Las cantidades son enteros escalados (unidades de 1e-18), de modo que
+    el bucle de consumo no crea objetos Decimal. Cada venta consume lotes
+    completos y, como mucho, divide un único lote (el último que toca).
+    Cada lote se extrae una sola vez del contenedor, por lo que el coste
+    amortizado por venta es O(1) respecto al número de lotes abiertos.
+    """
+
+    method: str = ''
+
+    def __init__(self):
+        self._lots: Dict[str, object] = {}
+
+    def _new_container(self):
+        raise NotImplementedError
+
+    def _peek(self, container) -> Lot:
+        raise NotImplementedError
+
+    def _pop(self, container) -> Lot:
+        raise NotImplementedError
+
+    def _push(self, container, lot: Lot) -> None:
+        container.append(lot)
+
+    def add_lot(self, lot: Lot) -> None:
+        """Añadir un lote al inventario de su asset"""
+        container = self._lots.get(lot.asset)
+        if container is None:
+            container = self._lots[lot.asset] = self._new_container()
+        self._push(container, lot)
+
+    def consume(self, asset: str, quantity: int) -> Tuple[List[Tuple[Lot, int]], int]:
+        """
+        Consumir una cantidad de un asset según el orden del método.
+
+        Args:
+            asset: Asset vendido
+            quantity: Cantidad a consumir (escalada)
+
+        Returns:
+            Tupla (lotes consumidos como pares (lote, cantidad), cantidad sin cubrir)
+        """
+        consumed: List[Tuple[Lot, int]] = []
+        container = self._lots.get(asset)
+        remaining = quantity
+
+        while remaining > 0 and container:
+            lot = self._peek(container)
+            if lot is None:
+                break
+            if lot.quantity <= remaining:
+                # Lote completo
+                self._pop(container)
+                consumed.append((lot, lot.quantity))
+                remaining -= lot.quantity
+                lot.quantity = 0
+            else:
+                # Lote parcial: se divide y el resto queda en el inventario
+                lot.quantity -= remaining
+                consumed.append((lot, remaining))
+                remaining = 0
+
+        return consumed, remaining
+
+    def consume_transaction(self, tx: Transaction) -> Tuple[List[Tuple[Lot, int]], int]:
+        """Consumir los lotes que corresponden a una venta"""
+        return self.consume(tx.asset, tx.amount)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Estado compacto de los lotes abiertos, en el orden en que se añadieron"""
+        return {'lots': [lot.to_row() for lot in self._lots_in_order()]}
+
+    def restore(self, state: Dict[str, Any]) -> None:
+        """Reconstruir el inventario a partir de un snapshot"""
+        for row in state.get('lots', []):
+            self.add_lot(Lot.from_row(row))
+
+    def _lots_in_order(self) -> Iterator[Lot]:
+        return self.open_lots()
+
+    def balance(self, asset: str) -> Decimal:
+        """Cantidad abierta total de un asset"""
+        return from_scaled(sum(lot.quantity for lot in self.open_lots(asset)))
+
+    def open_lots(self, asset: Optional[str] = None) -> Iterator[Lot]:
+        """Iterar los lotes abiertos (de un asset o de todos)"""
+        assets = [asset] if asset is not None else list(self._lots)
+        for name in assets:
+            for lot in self._lots.get(name, ()):
+                if lot.quantity > 0:
+                    yield lot
+
+class FifoInventory(LotInventory):
+    """Inventario First-In-First-Out respaldado por deque (popleft O(1))"""
+
+    method = 'FIFO'
+
+    def _new_container(self):
+        return deque()
+
+    def _peek(self, container) -> Lot:
+        return container[0]
+
+    def _pop(self, container) -> Lot:
+        return container.popleft()
+
+class LifoInventory(LotInventory):
+    """Inventario Last-In-First-Out respaldado por una pila (list.pop O(1))"""
+
+    method = 'LIFO'
+
+    def _new_container(self):
+        return []
+
+    def _peek(self, container) -> Lot:
+        return container[-1]
+
+    def _pop(self, container) -> Lot:
+        return container.pop()
+
+class AverageCostInventory(FifoInventory):
+    """
+    Inventario de coste medio ponderado (AVERAGE_COST).
+
+    Las cantidades se consumen en orden FIFO para conservar las fechas de
+    adquisición (plazo de tenencia), pero el coste de cada parte consumida
+    es el coste medio del pool del asset en el momento de la venta.
+    """
+
+    method = 'AVERAGE_COST'
+
+    def __init__(self):
+        super().__init__()
+        # asset -> (cantidad escalada, coste total Decimal)
+        self._pool: Dict[str, Tuple[int, Decimal]] = {}
+
+    def add_lot(self, lot: Lot) -> None:
+        quantity, cost = self._pool.get(lot.asset, (0, Decimal('0')))
+        self._pool[lot.asset] = (
+            quantity + lot.quantity,
+            cost + DECIMAL_CONTEXT.multiply(from_scaled(lot.quantity), from_scaled(lot.unit_cost))
+        )
+        super().add_lot(lot)
+
+    def consume(self, asset: str, quantity: int) -> Tuple[List[Tuple[Lot, int]], int]:
+        pool_quantity, pool_cost = self._pool.get(asset, (0, Decimal('0')))
+        consumed, remaining = super().consume(asset, quantity)
+        if not consumed:
+            return consumed, remaining
+
+        # El coste medio se mantiene en Decimal de precisión 80 sin cuantizar
+        average_cost = DECIMAL_CONTEXT.divide(pool_cost, from_scaled(pool_quantity))
+        taken = quantity - remaining
+        if pool_quantity - taken <= 0:
+            self._pool[asset] = (0, Decimal('0'))
+        else:
+            self._pool[asset] = (
+                pool_quantity - taken,
+                pool_cost - DECIMAL_CONTEXT.multiply(from_scaled(taken), average_cost)
+            )
+        return [
+            (dataclasses.replace(lot, quantity=part, unit_cost=average_cost), part)
+            for lot, part in consumed
+        ], remaining
+
+    def snapshot(self) -> Dict[str, Any]:
+        state = super().snapshot()
+        state['pool'] = {
+            asset: [format_scaled(quantity), str(cost)]
+            for asset, (quantity, cost) in self._pool.items()
+            if quantity > 0
+        }
+        return state
+
+    def restore(self, state: Dict[str, Any]) -> None:
+        super().restore(state)
+        # El coste del pool no se deduce de los lotes tras consumos parciales
+        for asset, (quantity, cost) in state.get('pool', {}).items():
+            self._pool[asset] = (to_scaled(Decimal(quantity)), Decimal(cost))
+
+class HifoInventory(LotInventory):
+    """
+    Inventario Highest-In-First-Out con índice de prioridad por asset.
+
+    Cada asset tiene un heap ordenado por coste unitario descendente (y orden
+    de llegada como desempate), por lo que elegir el lote más caro es
+    O(log n). Los lotes agotados fuera del heap (identificación específica o
+    índices compartidos) no se borran en el momento: se descartan de forma
+    perezosa al llegar a la cima, y el heap se compacta cuando las entradas
+    obsoletas superan a las vivas.
+    """
+
+    method = 'HIFO'
+
+    def __init__(self):
+        super().__init__()
+        self._sequence = itertools.count()
+        self._by_id: Dict[str, Lot] = {}
+        self._stale: Dict[int, int] = {}
+
+    def _new_container(self):
+        return []
+
+    def _entry(self, lot: Lot) -> tuple:
+        return (-lot.unit_cost, next(self._sequence), lot)
+
+    def _push(self, container, lot: Lot) -> None:
+        heapq.heappush(container, self._entry(lot))
+
+    def _discard_stale(self, container) -> None:
+        """Eliminar de la cima las entradas de lotes ya agotados"""
+        while container and container[0][2].quantity <= 0:
+            heapq.heappop(container)
+            if self._stale.get(id(container)):
+                self._stale[id(container)] -= 1
+
+    def _peek(self, container) -> Optional[Lot]:
+        self._discard_stale(container)
+        return container[0][2] if container else None
+
+    def _pop(self, container) -> Lot:
+        self._discard_stale(container)
+        return heapq.heappop(container)[2]
+
+    def add_lot(self, lot: Lot) -> None:
+        self._by_id[lot.lot_id] = lot
+        super().add_lot(lot)
+
+    def consume(self, asset: str, quantity: int) -> Tuple[List[Tuple[Lot, int]], int]:
+        container = self._lots.get(asset)
+        if container is not None:
+            self._discard_stale(container)
+        return super().consume(asset, quantity)
+
+    def consume_specific(self, lot_id: str, quantity: int) -> Tuple[List[Tuple[Lot, int]], int]:
+        """
+        Consumir un lote concreto (identificación específica).
+
+        El lote se actualiza en sitio; su entrada en el heap queda obsoleta
+        si se agota y se elimina de forma perezosa.
+
+        Args:
+            lot_id: ID del lote (tx_id de la adquisición)
+            quantity: Cantidad a consumir (escalada)
+
+        Returns:
+            Tupla (lotes consumidos, cantidad sin cubrir)
+        """
+        lot = self._by_id.get(lot_id)
+        if lot is None or lot.quantity <= 0:
+            return [], quantity
+
+        taken = min(lot.quantity, quantity)
+        lot.quantity -= taken
+        if lot.quantity <= 0:
+            self._mark_stale(self._lots[lot.asset])
+        return [(lot, taken)], quantity - taken
+
+    def _mark_stale(self, container) -> None:
+        """Contabilizar una entrada obsoleta y compactar si dominan"""
+        key = id(container)
+        self._stale[key] = self._stale.get(key, 0) + 1
+        if self._stale[key] * 2 > len(container):
+            container[:] = [entry for entry in container if entry[2].quantity > 0]
+            heapq.heapify(container)
+            self._stale[key] = 0
+
+    def open_lots(self, asset: Optional[str] = None) -> Iterator[Lot]:
+        assets = [asset] if asset is not None else list(self._lots)
+        for name in assets:
+            for entry in self._lots.get(name, ()):
+                if entry[2].quantity > 0:
+                    yield entry[2]
+
+    def _lots_in_order(self) -> Iterator[Lot]:
+        # El orden de llegada es el desempate entre lotes del mismo coste
+        for container in self._lots.values():
+            for entry in sorted(container, key=lambda item: item[1]):
+                if entry[2].quantity > 0:
+                    yield entry[2]
+
+class ExchangeSpecificInventory(HifoInventory):
+    """
+    Inventario por exchange (EXCHANGE_SPECIFIC).
+
+    Además del heap por asset mantiene un heap por (asset, exchange) con los
+    mismos objetos Lot. Una venta consume primero los lotes más caros del
+    exchange donde se ejecuta y, si no bastan, los más caros del resto.
+    Como ambos índices comparten los lotes, un consumo parcial en uno se ve
+    inmediatamente en el otro y las entradas agotadas se descartan de forma
+    perezosa.
+    """
+
+    method = 'EXCHANGE_SPECIFIC'
+
+    def __init__(self):
+        super().__init__()
+        self._by_exchange: Dict[Tuple[str, Optional[str]], list] = {}
+
+    def add_lot(self, lot: Lot) -> None:
+        super().add_lot(lot)
+        key = (lot.asset, lot.exchange_id)
+        container = self._by_exchange.get(key)
+        if container is None:
+            container = self._by_exchange[key] = []
+        heapq.heappush(container, self._entry(lot))
+
+    def consume_transaction(self, tx: Transaction) -> Tuple[List[Tuple[Lot, int]], int]:
+        return self.consume_on_exchange(tx.asset, tx.exchange_id, tx.amount)
+
+    def consume_on_exchange(self, asset: str, exchange_id: Optional[str], quantity: int) -> Tuple[List[Tuple[Lot, int]], int]:
+        """
+        Consumir lotes priorizando los del exchange de la venta.
+
+        Args:
+            asset: Asset vendido
+            exchange_id: Exchange donde se ejecuta la venta
+            quantity: Cantidad a consumir (escalada)
+
+        Returns:
+            Tupla (lotes consumidos, cantidad sin cubrir)
+        """
+        consumed: List[Tuple[Lot, int]] = []
+        remaining = quantity
+        container = self._by_exchange.get((asset, exchange_id))
+
+        while remaining > 0 and container:
+            self._discard_stale(container)
+            if not container:
+                break
+            lot = container[0][2]
+            if lot.quantity <= remaining:
+                heapq.heappop(container)
+                consumed.append((lot, lot.quantity))
+                remaining -= lot.quantity
+                lot.quantity = 0
+                self._mark_stale(self._lots[asset])
+            else:
+                lot.quantity -= remaining
+                consumed.append((lot, remaining))
+                remaining = 0
+
+        if remaining > 0:
+            # Fallback: lotes de otros exchanges por coste descendente
+            extra, remaining = self.consume(asset, remaining)
+            for lot, _ in extra:
+                if lot.quantity <= 0:
+                    self._mark_stale(self._by_exchange[(asset, lot.exchange_id)])
+            consumed.extend(extra)
+
+        return consumed, remaining
+
+INVENTORY_CLASSES = {
+    'FIFO': FifoInventory,
+    'LIFO': LifoInventory,
+    'HIFO': HifoInventory,
+    'AVERAGE_COST': AverageCostInventory,
+    'EXCHANGE_SPECIFIC': ExchangeSpecificInventory,
+}
+
+def create_inventory(method: str) -> LotInventory:
+    """Crear el inventario de lotes para un método fiscal"""
+    try:
+        return INVENTORY_CLASSES[method]()
+    except KeyError:
+        raise ValueError(f"Método no soportado: {method}")
@@ -0,0 +1,296 @@
+"""
+KONTROL Tax Engine Models
+Estructuras en memoria para el cálculo fiscal por lotes
+"""
+
+from dataclasses import dataclass, field
+from datetime import datetime
+from decimal import Decimal, Context, ROUND_HALF_EVEN
+from typing import Any, Dict, List, Optional, Union
+
+from core.tax_engine.fixed_point import SCALE, format_scaled, from_scaled, round_div, to_scaled
+
+# Precisión de las columnas DECIMAL(38, 18)
+QUANTUM = Decimal('1e-18')
+DECIMAL_CONTEXT = Context(prec=80, rounding=ROUND_HALF_EVEN)
+
+# Tipos de CanonicalTransaction que abren un lote (adquisiciones)
+ACQUISITION_TYPES = ('BUY', 'REWARD', 'STAKING', 'MINING')
+# Tipos de CanonicalTransaction que consumen lotes (disposiciones); si
+# además reciben un asset no fiat (permutas cripto-cripto) abren su lote
+DISPOSAL_TYPES = ('SELL',)
+
+# Divisas fiat: no abren lotes y sus comisiones ya están en fiat
+FIAT_CURRENCIES = frozenset({
+    'EUR', 'USD', 'GBP', 'CHF', 'JPY', 'CAD', 'AUD', 'NZD', 'SEK', 'NOK',
+    'DKK', 'PLN', 'CZK', 'HUF', 'RON', 'BGN', 'TRY', 'BRL', 'MXN', 'ARS',
+    'KRW', 'CNY', 'HKD', 'SGD', 'INR', 'ZAR', 'RUB', 'UAH'
+})
+
+def quantize(value: Decimal, rounding: str = ROUND_HALF_EVEN) -> Decimal:
+    """Redondear a 18 decimales, igual que las columnas DECIMAL(38, 18)"""
+    return value.quantize(QUANTUM, rounding=rounding, context=DECIMAL_CONTEXT)
+
+@dataclass
+class Transaction:
+    """
+    Evento fiscal normalizado a partir de una CanonicalTransaction.
+
+    amount, unit_price y fee son enteros escalados (unidades de 1e-18).
+    """
+    tx_id: str
+    timestamp: datetime
+    tx_type: str
+    asset: str
+    amount: int
+    unit_price: int
+    fee: int = 0
+    exchange_id: Optional[str] = None
+
+    @classmethod
+    def from_canonical(cls, tx) -> List['Transaction']:
+        """
+        Construir los eventos fiscales de una CanonicalTransaction.
+
+        Args:
+            tx: Fila de canonical_transactions (modelo ORM o mapping)
+
+        Returns:
+            Eventos BUY/SELL (ver tax_events); vacío si no es fiscalmente relevante
+        """
+        get = tx.get if isinstance(tx, dict) else lambda key: getattr(tx, key, None)
+        metadata = get('metadata')
+        return tax_events(
+            tx_id=str(get('tx_id_kontrol') or get('id')),
+            timestamp=get('timestamp_utc'),
+            tx_type=get('tx_type'),
+            asset_in=get('asset_in'),
+            amount_in=to_scaled(get('amount_in')) if get('amount_in') is not None else None,
+            unit_cost=to_scaled(get('fiat_cost_basis_unit')),
+            asset_out=get('asset_out'),
+            amount_out=to_scaled(get('amount_out')) if get('amount_out') is not None else None,
+            exchange_rate=to_scaled(get('exchange_rate')),
+            fee=to_scaled(get('fees')),
+            fee_asset=metadata.get('fee_asset') if isinstance(metadata, dict) else None,
+            exchange_id=get('exchange_id')
+        )
+
+def fee_in_fiat(fee: int, fee_asset: Optional[str], prices: Dict[str, int]) -> int:
+    """
+    Comisión (escalada) convertida a fiat.
+
+    Sin fee_asset, o con una divisa fiat, la comisión ya está en fiat. Si
+    se pagó en uno de los assets de la operación se valora a su precio
+    (`prices`: asset -> precio unitario escalado); en cualquier otro asset
+    (p. ej. BNB) no hay precio y se ignora.
+    """
+    if not fee or fee_asset is None or fee_asset in FIAT_CURRENCIES:
+        return fee
+    price = prices.get(fee_asset)
+    if not price:
+        return 0
+    return round_div(fee * price, SCALE)
+
+def tax_events(
+    tx_id: str,
+    timestamp: datetime,
+    tx_type: Optional[str],
+    asset_in: Optional[str],
+    amount_in: Optional[int],
+    unit_cost: int,
+    asset_out: Optional[str],
+    amount_out: Optional[int],
+    exchange_rate: int,
+    fee: int = 0,
+    fee_asset: Optional[str] = None,
+    exchange_id: Optional[str] = None
+) -> List[Transaction]:
+    """
+    Eventos fiscales de una transacción canónica (importes escalados).
+
+    Las adquisiciones abren un lote de asset_in a fiat_cost_basis_unit. Las
+    disposiciones consumen asset_out a exchange_rate y, si reciben un asset
+    no fiat (SELL/EXCHANGE cripto-cripto), abren también su lote valorado
+    al precio de la operación: fiat_cost_basis_unit o, si falta, el valor
+    fiat de lo entregado (amount_out * exchange_rate) entre lo recibido.
+    La comisión, convertida a fiat, va en la disposición.
+    """
+    if tx_type in ACQUISITION_TYPES:
+        if not asset_in or amount_in is None:
+            return []
+        prices = {asset_in: unit_cost}
+        return [Transaction(
+            tx_id=tx_id, timestamp=timestamp, tx_type='BUY', asset=asset_in, amount=amount_in,
+            unit_price=unit_cost, fee=fee_in_fiat(fee, fee_asset, prices), exchange_id=exchange_id
+        )]
+
+    if tx_type not in DISPOSAL_TYPES or not asset_out or amount_out is None:
+        return []
+
+    acquired = bool(asset_in) and asset_in not in FIAT_CURRENCIES and bool(amount_in)
+    if acquired and not unit_cost:
+        unit_cost = round_div(amount_out * exchange_rate, amount_in)
+    prices = {asset_out: exchange_rate}
+    if acquired:
+        prices.setdefault(asset_in, unit_cost)
+
+    events = [Transaction(
+        tx_id=tx_id, timestamp=timestamp, tx_type='SELL', asset=asset_out, amount=amount_out,
+        unit_price=exchange_rate, fee=fee_in_fiat(fee, fee_asset, prices), exchange_id=exchange_id
+    )]
+    if acquired:
+        events.append(Transaction(
+            tx_id=tx_id, timestamp=timestamp, tx_type='BUY', asset=asset_in, amount=amount_in,
+            unit_price=unit_cost, exchange_id=exchange_id
+        ))
+    return events
+
+@dataclass
+class Lot:
+    """
+    Lote abierto de un asset (cantidad pendiente de una adquisición).
+
+    quantity y unit_cost son enteros escalados (unidades de 1e-18). El
+    inventario de coste medio asigna a las partes consumidas el coste medio
+    del pool como Decimal sin cuantizar.
+    """
+    lot_id: str
+    asset: str
+    acquired_at: datetime
+    quantity: int
+    unit_cost: Union[int, Decimal]
+    exchange_id: Optional[str] = None
+
+    @classmethod
+    def from_transaction(cls, tx: Transaction) -> 'Lot':
+        """Abrir un lote a partir de una adquisición"""
+        return cls(
+            lot_id=tx.tx_id,
+            asset=tx.asset,
+            acquired_at=tx.timestamp,
+            quantity=tx.amount,
+            unit_cost=tx.unit_price,
+            exchange_id=tx.exchange_id
+        )
+
+    def to_row(self) -> List[Any]:
+        """Forma compacta para los checkpoints de lotes"""
+        unit_cost = format_scaled(self.unit_cost) if isinstance(self.unit_cost, int) else str(self.unit_cost)
+        return [
+            self.lot_id, self.asset, self.acquired_at.isoformat(),
+            format_scaled(self.quantity), unit_cost, self.exchange_id
+        ]
+
+    @classmethod
+    def from_row(cls, row: List[Any]) -> 'Lot':
+        """Reconstruir un lote desde su forma compacta"""
+        lot_id, asset, acquired_at, quantity, unit_cost, exchange_id = row
+        return cls(
+            lot_id=lot_id,
+            asset=asset,
+            acquired_at=datetime.fromisoformat(acquired_at),
+            quantity=to_scaled(Decimal(quantity)),
+            unit_cost=to_scaled(Decimal(unit_cost)),
+            exchange_id=exchange_id
+        )
+
+@dataclass
+class RealizedGain:
+    """
+    Ganancia/pérdida realizada al consumir (parte de) un lote.
+
+    quantity, cost_basis, proceeds y gain son enteros escalados; se
+    convierten a texto decimal exacto al serializar.
+    """
+    asset: str
+    lot_id: Optional[str]
+    sell_tx_id: str
+    acquired_at: Optional[datetime]
+    disposed_at: datetime
+    quantity: int
+    cost_basis: int
+    proceeds: int
+    gain: int
+
+    @property
+    def holding_days(self) -> Optional[int]:
+        """Días de tenencia del lote consumido"""
+        if self.acquired_at is None:
+            return None
+        return (self.disposed_at - self.acquired_at).days
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Serializar para tax_reports.report_data"""
+        return {
+            'asset': self.asset,
+            'lot_id': self.lot_id,
+            'sell_tx_id': self.sell_tx_id,
+            'acquired_at': self.acquired_at.isoformat() if self.acquired_at else None,
+            'disposed_at': self.disposed_at.isoformat(),
+            'quantity': format_scaled(self.quantity),
+            'cost_basis': format_scaled(self.cost_basis),
+            'proceeds': format_scaled(self.proceeds),
+            'gain': format_scaled(self.gain),
+            'holding_days': self.holding_days
+        }
+
+@dataclass
+class TaxReport:
+    """
+    Resultado de un cálculo fiscal para un año y método.
+
+    Los importes son enteros escalados (unidades de 1e-18); to_row y
+    to_report_data los convierten a Decimal / texto en la frontera con
+    la base de datos.
+    """
+    method: str
+    year: Optional[int] = None
+    realized_gains: List[RealizedGain] = field(default_factory=list)
+    total_realized_gain: int = 0
+    total_proceeds: int = 0
+    total_cost_basis: int = 0
+    short_term_gains: int = 0
+    long_term_gains: int = 0
+    taxable_gain: int = 0
+    total_tax_amount: int = 0
+    transaction_count: int = 0
+    warnings: List[str] = field(default_factory=list)
+
+    def add_realized_gain(self, gain: RealizedGain) -> None:
+        """Añadir una línea de ganancia realizada y actualizar totales"""
+        self.realized_gains.append(gain)
+        self.total_realized_gain += gain.gain
+        self.total_proceeds += gain.proceeds
+        self.total_cost_basis += gain.cost_basis
+
+    def to_row(self, user_id: str, cache_key: Optional[str] = None) -> Dict[str, Any]:
+        """Valores para una fila de la tabla tax_reports"""
+        return {
+            'user_id': user_id,
+            'year': self.year,
+            'method': self.method,
+            'total_realized_gain': from_scaled(self.total_realized_gain),
+            'total_tax_amount': from_scaled(self.total_tax_amount),
+            'short_term_gains': from_scaled(self.short_term_gains),
+            'long_term_gains': from_scaled(self.long_term_gains),
+            'transaction_count': self.transaction_count,
+            'report_data': self.to_report_data(),
+            'cache_key': cache_key
+        }
+
+    def to_report_data(self) -> Dict[str, Any]:
+        """Serializar para la columna JSON tax_reports.report_data"""
+        return {
+            'method': self.method,
+            'year': self.year,
+            'total_realized_gain': format_scaled(self.total_realized_gain),
+            'total_proceeds': format_scaled(self.total_proceeds),
+            'total_cost_basis': format_scaled(self.total_cost_basis),
+            'short_term_gains': format_scaled(self.short_term_gains),
+            'long_term_gains': format_scaled(self.long_term_gains),
+            'taxable_gain': format_scaled(self.taxable_gain),
+            'total_tax_amount': format_scaled(self.total_tax_amount),
+            'transaction_count': self.transaction_count,
+            'realized_gains': [gain.to_dict() for gain in self.realized_gains],
+            'warnings': self.warnings
+        }
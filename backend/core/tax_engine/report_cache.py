@@ -0,0 +1,75 @@
+"""
+KONTROL Tax Report Cache
+Claves de caché de reportes fiscales a partir de los digests de transacciones
+"""
+
+import hashlib
+from typing import Dict, Iterable, List, Sequence
+
+from core.tax_engine.tax_rules import TAX_RULES_VERSION
+
+# Versión del formato de la clave (cambiarla invalida todas las entradas)
+CACHE_KEY_VERSION = 1
+
+def compute_cache_key(
+    digests: Iterable,
+    method: str,
+    jurisdiction: str,
+    rules_version: str = TAX_RULES_VERSION
+) -> str:
+    """
+    Calcular la clave de caché de un reporte fiscal.
+
+    El reporte de un año depende de todo el historial hasta su cierre, así
+    que la clave combina los digests de todos los años <= al del reporte
+    (ver TransactionDigestRepository.get_until). Los años sin filas vivas
+    se ignoran para que borrar y reinsertar lo mismo dé la misma clave.
+
+    Args:
+        digests: Filas de transaction_digests (year, digest, row_count)
+        method: Método fiscal
+        jurisdiction: Jurisdicción fiscal
+        rules_version: Versión del conjunto de reglas fiscales
+
+    Returns:
+        Hash SHA-256 en hexadecimal (64 caracteres)
+    """
+    parts = [f"v{CACHE_KEY_VERSION}", method, jurisdiction, rules_version]
+    parts.extend(_digest_parts(digests))
+    return hashlib.sha256('|'.join(parts).encode()).hexdigest()
+
+def compute_history_digest(digests: Iterable, year: int) -> str:
+    """
+    Calcular el digest del historial hasta el cierre de un año.
+
+    Identifica las transacciones de las que sale un checkpoint de lotes de
+    `year` (ver TaxCheckpointRepository.get_latest_before): sólo intervienen
+    los años <= year y no depende del método ni de la jurisdicción.
+
+    Args:
+        digests: Filas de transaction_digests (year, digest, row_count)
+        year: Año del checkpoint
+
+    Returns:
+        Hash SHA-256 en hexadecimal (64 caracteres)
+    """
+    parts = [f"h{CACHE_KEY_VERSION}", str(year)]
+    parts.extend(_digest_parts(row for row in digests if row.year <= year))
+    return hashlib.sha256('|'.join(parts).encode()).hexdigest()
+
+def _digest_parts(digests: Iterable) -> List[str]:
+    """Años con filas vivas, en orden, como 'año:digest:filas'"""
+    return [
+        f"{row.year}:{row.digest}:{row.row_count}"
+        for row in sorted(digests, key=lambda item: item.year)
+        if row.row_count
+    ]
+
+def compute_cache_keys(
+    digests: Sequence,
+    methods: Sequence[str],
+    jurisdiction: str,
+    rules_version: str = TAX_RULES_VERSION
+) -> Dict[str, str]:
+    """Claves de caché de varios métodos sobre los mismos digests"""
+    return {method: compute_cache_key(digests, method, jurisdiction, rules_version) for method in methods}
@@ -0,0 +1,490 @@
+"""
+KONTROL Tax Calculator
+Cálculo fiscal multi-método sobre inventarios de lotes
+"""
+
+import logging
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config.settings import get_settings
+from core.tax_engine.fixed_point import SCALE, format_scaled, from_scaled, gain_components, round_div, to_scaled
+from core.tax_engine.lots import INVENTORY_CLASSES, LotInventory, create_inventory
+from core.tax_engine.models import (
+    DECIMAL_CONTEXT, Lot, RealizedGain, TaxReport, Transaction, quantize
+)
+from core.tax_engine.report_cache import compute_cache_keys, compute_history_digest
+from core.tax_engine.tax_rules import TaxRuleSet, compile_tax_rules
+from core.transaction_frame import iter_transaction_frames, load_transaction_frame
+from utils.database import (
+    AsyncSessionLocal, TaxCheckpointRepository, TaxReportRepository, TransactionDigestRepository,
+    TransactionRepository
+)
+
+logger = logging.getLogger(__name__)
+
+# Métodos que admite la tabla tax_reports (CHECK valid_method)
+REPORT_METHODS = ('FIFO', 'LIFO', 'HIFO', 'AVERAGE_COST')
+
+def year_end(year: int) -> datetime:
+    """Último instante (UTC) de un año"""
+    return datetime(year, 12, 31, 23, 59, 59, 999999, tzinfo=timezone.utc)
+
+class TaxCalculator:
+    """
+    Calculador de impuestos multi-método.
+
+    Attributes:
+        user_id: ID del usuario
+        jurisdiction: Jurisdicción fiscal del usuario
+        tax_rules: Reglas fiscales compiladas de la jurisdicción (compartidas)
+        rounding: Modo de redondeo de los importes en la jurisdicción
+        processed_transactions: Eventos fiscales recorridos en el último cálculo
+    """
+
+    def __init__(self, user_id: str, jurisdiction: str, session: Optional[AsyncSession] = None):
+        self.user_id = user_id
+        self.jurisdiction = jurisdiction
+        self.session = session
+        self.tax_rules = self.load_tax_rules(jurisdiction)
+        self.rounding = self.tax_rules.rounding
+        self.processed_transactions = 0
+
+    def load_tax_rules(self, jurisdiction: str) -> TaxRuleSet:
+        """Obtener las reglas compiladas de la jurisdicción (memoizadas por proceso)"""
+        return compile_tax_rules(jurisdiction)
+
+    @asynccontextmanager
+    async def _session_scope(self):
+        """Usar la sesión inyectada o abrir una propia"""
+        if self.session is not None:
+            yield self.session
+        else:
+            async with AsyncSessionLocal() as session:
+                yield session
+
+    async def get_transactions_for_year(self, year: int, after_year: Optional[int] = None) -> List[Transaction]:
+        """
+        Obtener los eventos fiscales necesarios para calcular un año.
+
+        El inventario de lotes depende de todas las adquisiciones anteriores,
+        por lo que se carga el historial completo hasta el 31 de diciembre.
+        Si se parte de un checkpoint (after_year), sólo se cargan las
+        transacciones posteriores al cierre de ese año.
+        """
+        # El historial se carga en formato columnar (sin modelos ORM) y sólo
+        # las adquisiciones y ventas pasan a eventos fiscales, con importes
+        # enteros escalados a 18 decimales (fixed_point), sin pasar por Decimal
+        start = year_end(after_year) + timedelta(microseconds=1) if after_year is not None else None
+        async with self._session_scope() as session:
+            frame = await load_transaction_frame(
+                TransactionRepository(session), self.user_id, start_date=start, end_date=year_end(year)
+            )
+        return frame.to_tax_transactions()
+
+    async def stream_transactions_for_year(
+        self,
+        year: int,
+        after_year: Optional[int] = None,
+        batch_size: int = 50000
+    ) -> AsyncIterator[List[Transaction]]:
+        """
+        Igual que get_transactions_for_year, pero en bloques cronológicos.
+
+        Sólo un bloque de eventos fiscales existe a la vez, así que la
+        memoria queda acotada por batch_size (más los lotes abiertos) y no
+        por la longitud del historial.
+        """
+        start = year_end(after_year) + timedelta(microseconds=1) if after_year is not None else None
+        async with self._session_scope() as session:
+            async for frame in iter_transaction_frames(
+                TransactionRepository(session), self.user_id, start_date=start, end_date=year_end(year),
+                batch_size=batch_size
+            ):
+                yield frame.to_tax_transactions()
+
+    async def calculate_tax_report(self, year: int, method: str) -> TaxReport:
+        """Calcular reporte fiscal para un año y método específico"""
+        if method not in INVENTORY_CLASSES:
+            raise ValueError(f"Método no soportado: {method}")
+
+        reports = await self.calculate_all_methods(year, [method])
+        return reports[method]
+
+    async def calculate_fifo(self, transactions: List[Transaction], year: Optional[int] = None) -> TaxReport:
+        """Calcular usando método First-In-First-Out"""
+        return self.run_lot_engine(transactions, create_inventory('FIFO'), TaxReport(method='FIFO', year=year))
+
+    async def calculate_lifo(self, transactions: List[Transaction], year: Optional[int] = None) -> TaxReport:
+        """Calcular usando método Last-In-First-Out"""
+        return self.run_lot_engine(transactions, create_inventory('LIFO'), TaxReport(method='LIFO', year=year))
+
+    async def calculate_hifo(self, transactions: List[Transaction], year: Optional[int] = None) -> TaxReport:
+        """Calcular usando método Highest-In-First-Out"""
+        return self.run_lot_engine(transactions, create_inventory('HIFO'), TaxReport(method='HIFO', year=year))
+
+    async def calculate_average_cost(self, transactions: List[Transaction], year: Optional[int] = None) -> TaxReport:
+        """Calcular usando coste medio ponderado"""
+        return self.run_lot_engine(
+            transactions,
+            create_inventory('AVERAGE_COST'),
+            TaxReport(method='AVERAGE_COST', year=year)
+        )
+
+    async def calculate_exchange_specific(self, transactions: List[Transaction], year: Optional[int] = None) -> TaxReport:
+        """Calcular con lotes identificados por el exchange donde se vende"""
+        return self.run_lot_engine(
+            transactions,
+            create_inventory('EXCHANGE_SPECIFIC'),
+            TaxReport(method='EXCHANGE_SPECIFIC', year=year)
+        )
+
+    async def calculate_all_methods(self, year: int, methods: Sequence[str] = REPORT_METHODS) -> Dict[str, TaxReport]:
+        """
+        Calcular varios métodos en una sola pasada.
+
+        Las transacciones se cargan y ordenan una vez, y el mismo flujo de
+        eventos alimenta todos los inventarios a la vez. Si existe un
+        checkpoint de lotes anterior al año, el cálculo parte de él en lugar
+        de reproducir todo el historial, y se guardan checkpoints de los
+        años cerrados que se recorren.
+
+        Los digests de transacciones se leen antes que el historial y cada
+        checkpoint guarda el de su año: si las transacciones cambian durante
+        el cálculo, el checkpoint no coincidirá con el historial y no se usará.
+
+        Args:
+            year: Año fiscal
+            methods: Métodos a calcular
+
+        Returns:
+            Diccionario método -> TaxReport con las reglas fiscales aplicadas
+        """
+        async with self._session_scope() as session:
+            digests = await TransactionDigestRepository(session).get_until(self.user_id, year)
+        start_year, engines = await self._prepare_engines(year, methods, digests)
+
+        # El historial llega en bloques ya ordenados (timestamp_utc, id)
+        checkpoints: List[Dict[str, Any]] = []
+        current_year = None
+        self.processed_transactions = 0
+        async for transactions in self.stream_transactions_for_year(year, after_year=start_year):
+            self.processed_transactions += len(transactions)
+            current_year = self.run_lot_engines(
+                transactions,
+                engines,
+                on_year_end=lambda completed: checkpoints.extend(self._checkpoint_rows(completed, engines, digests)),
+                presorted=True,
+                current_year=current_year
+            )
+        if year < datetime.now(timezone.utc).year:
+            checkpoints.extend(self._checkpoint_rows(year, engines, digests))
+        await self._save_checkpoints(checkpoints)
+
+        reports = {}
+        for method, (_, report) in engines.items():
+            reports[method] = await self.apply_tax_rules(report)
+        return reports
+
+    async def _prepare_engines(
+        self,
+        year: int,
+        methods: Sequence[str],
+        digests: Sequence
+    ) -> Tuple[Optional[int], Dict[str, Tuple[LotInventory, TaxReport]]]:
+        """
+        Crear los inventarios, restaurados desde checkpoint cuando es posible.
+
+        Sólo se parte de un checkpoint si todos los métodos tienen uno vigente
+        (calculado sobre los digests actuales) del mismo año; en caso
+        contrario se reproduce el historial completo.
+
+        Returns:
+            Tupla (año del checkpoint usado o None, diccionario método -> (inventario, reporte))
+        """
+        # Antes del primer año con transacciones no hay lotes que restaurar
+        first_year = min((row.year for row in digests if row.row_count), default=year)
+        history_digests = {
+            checkpoint_year: compute_history_digest(digests, checkpoint_year)
+            for checkpoint_year in range(first_year, year)
+        }
+        async with self._session_scope() as session:
+            repository = TaxCheckpointRepository(session)
+            checkpoints = {
+                method: await repository.get_latest_before(self.user_id, method, year, history_digests)
+                for method in methods
+            }
+
+        checkpoint_years = {checkpoint.year if checkpoint else None for checkpoint in checkpoints.values()}
+        start_year = checkpoint_years.pop() if len(checkpoint_years) == 1 else None
+
+        engines = {}
+        for method in methods:
+            inventory = create_inventory(method)
+            if start_year is not None:
+                inventory.restore(checkpoints[method].open_lots)
+            engines[method] = (inventory, TaxReport(method=method, year=year))
+
+        if start_year is not None:
+            logger.info(f"Cálculo fiscal {year} de {self.user_id} desde checkpoint {start_year}")
+        return start_year, engines
+
+    def _checkpoint_rows(
+        self,
+        year: int,
+        engines: Dict[str, Tuple[LotInventory, TaxReport]],
+        digests: Sequence
+    ) -> List[Dict[str, Any]]:
+        """Snapshots de fin de año de cada inventario"""
+        history_digest = compute_history_digest(digests, year)
+        rows = []
+        for method, (inventory, _) in engines.items():
+            state = inventory.snapshot()
+            rows.append({
+                'user_id': self.user_id,
+                'year': year,
+                'method': method,
+                'open_lots': state,
+                'lot_count': len(state['lots']),
+                'history_digest': history_digest
+            })
+        return rows
+
+    async def _save_checkpoints(self, rows: List[Dict[str, Any]]) -> None:
+        """Persistir checkpoints de lotes"""
+        if not rows:
+            return
+        async with self._session_scope() as session:
+            await TaxCheckpointRepository(session).upsert_checkpoints(rows)
+
+    async def generate_all_reports(
+        self,
+        year: int,
+        methods: Sequence[str] = REPORT_METHODS,
+        cache_keys: Optional[Dict[str, str]] = None
+    ) -> Dict[str, TaxReport]:
+        """
+        Calcular todos los métodos y guardar sus filas tax_reports en una transacción.
+
+        Args:
+            year: Año fiscal
+            methods: Métodos a calcular
+            cache_keys: Claves de caché (método -> clave) calculadas antes de
+                leer las transacciones; sin ellas las filas quedan sin clave
+
+        Returns:
+            Diccionario método -> TaxReport
+        """
+        if cache_keys is None and get_settings().tax_report_cache_enabled:
+            cache_keys = await self.current_cache_keys(year, methods)
+        cache_keys = cache_keys or {}
+
+        reports = await self.calculate_all_methods(year, methods)
+        async with self._session_scope() as session:
+            await TaxReportRepository(session).upsert_reports(
+                [report.to_row(self.user_id, cache_keys.get(method)) for method, report in reports.items()]
+            )
+        logger.info(f"Reportes {list(reports)} de {year} guardados para usuario {self.user_id}")
+        return reports
+
+    async def get_reports(self, year: int, methods: Sequence[str] = REPORT_METHODS) -> Dict[str, Dict[str, Any]]:
+        """
+        Obtener los reportes de un año, recalculando sólo los que han caducado.
+
+        Un reporte guardado sigue vigente mientras su cache_key coincida con
+        la clave actual, derivada de los digests de transacciones de todos
+        los años hasta `year`, el método, la jurisdicción y la versión de
+        las reglas. Los métodos sin entrada vigente se recalculan juntos en
+        una sola pasada.
+
+        Args:
+            year: Año fiscal
+            methods: Métodos solicitados
+
+        Returns:
+            Diccionario método -> report_data
+        """
+        if not get_settings().tax_report_cache_enabled:
+            reports = await self.generate_all_reports(year, methods)
+            return {method: report.to_report_data() for method, report in reports.items()}
+
+        # Los digests se leen antes que las transacciones: si cambian durante
+        # el cálculo, la clave guardada ya no coincidirá y se recalculará
+        cache_keys = await self.current_cache_keys(year, methods)
+        async with self._session_scope() as session:
+            cached = await TaxReportRepository(session).get_by_cache_keys(self.user_id, year, cache_keys)
+
+        results = {method: cached[method].report_data for method in methods if method in cached}
+        missing = [method for method in methods if method not in cached]
+        if missing:
+            logger.info(f"Caché de reportes {year} de {self.user_id}: {len(results)} aciertos, recalculando {missing}")
+            reports = await self.generate_all_reports(year, missing, cache_keys=cache_keys)
+            results.update((method, report.to_report_data()) for method, report in reports.items())
+        return {method: results[method] for method in methods}
+
+    async def current_cache_keys(self, year: int, methods: Sequence[str]) -> Dict[str, str]:
+        """Claves de caché actuales de los métodos para el año"""
+        async with self._session_scope() as session:
+            digests = await TransactionDigestRepository(session).get_until(self.user_id, year)
+        return compute_cache_keys(digests, methods, self.jurisdiction, self.tax_rules.version)
+
+    def run_lot_engine(self, transactions: List[Transaction], inventory: LotInventory, report: TaxReport) -> TaxReport:
+        """Recorrer las transacciones contra un único inventario"""
+        self.run_lot_engines(transactions, {report.method: (inventory, report)})
+        return report
+
+    def run_lot_engines(
+        self,
+        transactions: Iterable[Transaction],
+        engines: Dict[str, Tuple[LotInventory, TaxReport]],
+        on_year_end: Optional[Callable[[int], None]] = None,
+        presorted: bool = False,
+        current_year: Optional[int] = None
+    ) -> Optional[int]:
+        """
+        Recorrer las transacciones en orden cronológico contra varios inventarios.
+
+        Las adquisiciones abren lotes; las ventas consumen lotes (completos o
+        parciales) y generan una línea de ganancia por cada lote tocado. Las
+        ventas de años anteriores a report.year sólo actualizan el inventario.
+        Cada inventario recibe sus propios objetos Lot, ya que el consumo
+        parcial los modifica en sitio.
+
+        Args:
+            transactions: Eventos fiscales BUY/SELL
+            engines: Diccionario método -> (inventario, reporte)
+            on_year_end: Callback invocado con cada año cerrado, antes de
+                procesar la primera transacción del año siguiente
+            presorted: Las transacciones ya llegan en orden cronológico
+            current_year: Año de la última transacción del bloque anterior
+                (para encadenar bloques de un mismo historial)
+
+        Returns:
+            Año de la última transacción recorrida
+        """
+        targets = list(engines.values())
+        if not presorted:
+            transactions = sorted(transactions, key=lambda x: x.timestamp)
+
+        for tx in transactions:
+            if current_year is not None and tx.timestamp.year != current_year and on_year_end is not None:
+                on_year_end(current_year)
+            current_year = tx.timestamp.year
+
+            if tx.tx_type == 'BUY':
+                for inventory, _ in targets:
+                    inventory.add_lot(Lot.from_transaction(tx))
+
+            elif tx.tx_type == 'SELL':
+                for inventory, report in targets:
+                    consumed, uncovered = inventory.consume_transaction(tx)
+
+                    if report.year is not None and tx.timestamp.year != report.year:
+                        continue
+
+                    report.transaction_count += 1
+                    for lot, quantity in consumed:
+                        report.add_realized_gain(self.calculate_gain(lot, tx, quantity))
+
+                    if uncovered > 0:
+                        # Sin lotes suficientes: coste cero (criterio conservador)
+                        report.add_realized_gain(self.calculate_gain(None, tx, uncovered))
+                        report.warnings.append(
+                            f"Venta {tx.tx_id} de {tx.asset} sin lotes suficientes: "
+                            f"{format_scaled(uncovered)} sin coste de adquisición"
+                        )
+
+        return current_year
+
+    def calculate_gain(self, lot: Optional[Lot], sell_tx: Transaction, quantity: int) -> RealizedGain:
+        """
+        Calcular la ganancia de consumir una cantidad (escalada) de un lote.
+
+        Las comisiones de la venta se reparten proporcionalmente a la cantidad.
+        El cálculo se hace con enteros escalados (fixed_point), idéntico bit a
+        bit al camino Decimal, que sólo se usa para el coste medio sin
+        cuantizar y para importes fuera del rango garantizado.
+        """
+        unit_cost = lot.unit_cost if lot is not None else 0
+        components = None
+        if isinstance(unit_cost, int):
+            components = gain_components(
+                quantity, unit_cost, sell_tx.unit_price,
+                sell_tx.fee, sell_tx.amount, self.rounding
+            )
+
+        if components is None:
+            if isinstance(unit_cost, int):
+                unit_cost = from_scaled(unit_cost)
+            cost_basis, proceeds = self._decimal_gain_components(from_scaled(quantity), unit_cost, sell_tx)
+            components = (to_scaled(cost_basis), to_scaled(proceeds))
+
+        cost_basis, proceeds = components
+        return RealizedGain(
+            asset=sell_tx.asset,
+            lot_id=lot.lot_id if lot is not None else None,
+            sell_tx_id=sell_tx.tx_id,
+            acquired_at=lot.acquired_at if lot is not None else None,
+            disposed_at=sell_tx.timestamp,
+            quantity=quantity,
+            cost_basis=cost_basis,
+            proceeds=proceeds,
+            gain=proceeds - cost_basis
+        )
+
+    def _decimal_gain_components(self, quantity: Decimal, unit_cost: Decimal, sell_tx: Transaction) -> Tuple[Decimal, Decimal]:
+        """Coste y venta con aritmética Decimal de precisión 80"""
+        cost_basis = quantize(DECIMAL_CONTEXT.multiply(quantity, unit_cost), self.rounding)
+
+        gross = DECIMAL_CONTEXT.multiply(quantity, from_scaled(sell_tx.unit_price))
+        if sell_tx.fee and sell_tx.amount:
+            fee_share = DECIMAL_CONTEXT.divide(
+                DECIMAL_CONTEXT.multiply(from_scaled(sell_tx.fee), quantity), from_scaled(sell_tx.amount)
+            )
+            gross = DECIMAL_CONTEXT.subtract(gross, fee_share)
+        return cost_basis, quantize(gross, self.rounding)
+
+    async def apply_tax_rules(self, report: TaxReport) -> TaxReport:
+        """Clasificar ganancias por plazo y calcular la cuota según la jurisdicción"""
+        rules = self.tax_rules
+        long_term_days = rules.long_term_days
+
+        short_term = 0
+        long_term = 0
+        for gain in report.realized_gains:
+            holding_days = gain.holding_days
+            if long_term_days is not None and holding_days is not None and holding_days > long_term_days:
+                long_term += gain.gain
+            else:
+                short_term += gain.gain
+
+        report.short_term_gains = short_term
+        report.long_term_gains = long_term
+
+        taxable_long = 0 if rules.long_term_exempt else max(long_term, 0)
+        taxable_short = max(short_term, 0)
+
+        # Exención anual
+        exemption = rules.annual_exemption
+        if exemption > 0:
+            if rules.exemption_is_threshold:
+                base = report.total_proceeds if rules.exemption_on_proceeds else taxable_short + taxable_long
+                if base <= exemption:
+                    taxable_short = taxable_long = 0
+            else:
+                applied = min(exemption, taxable_short)
+                taxable_short -= applied
+                taxable_long = max(taxable_long - (exemption - applied), 0)
+
+        report.taxable_gain = taxable_short + taxable_long
+        report.total_tax_amount = round_div(
+            rules.short_term_brackets.tax(taxable_short) + rules.long_term_brackets.tax(taxable_long),
+            SCALE,
+            self.rounding
+        )
+
+        return report
@@ -0,0 +1,245 @@
+"""
+KONTROL Tax Rules
+Reglas fiscales por jurisdicción para ganancias patrimoniales cripto
+"""
+
+import copy
+from bisect import bisect_left
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Any, Dict, Optional, Tuple
+
+from core.tax_engine.fixed_point import ROUNDING_MODES, to_scaled
+
+# Versión del conjunto de reglas (forma parte de la clave de los reportes generados)
+TAX_RULES_VERSION = "2025.1"
+
+# Tramos: lista de (límite superior del tramo o None, tipo aplicable)
+# long_term_days: días de tenencia a partir de los cuales la ganancia es a largo plazo
+# exemption_type: 'allowance' (mínimo exento que se resta) o 'threshold' (exento si no se supera)
+# exemption_base: magnitud comparada con el umbral ('gain' por defecto o 'proceeds')
+# rounding: modo de redondeo (módulo decimal) de los importes a 18 decimales
+TAX_RULES: Dict[str, Dict[str, Any]] = {
+    'ES': {
+        'currency': 'EUR',
+        'rounding': 'ROUND_HALF_EVEN',
+        'long_term_days': None,
+        'short_term_brackets': [(6000, '0.19'), (50000, '0.21'), (200000, '0.23'), (300000, '0.27'), (None, '0.30')],
+        'long_term_brackets': [(6000, '0.19'), (50000, '0.21'), (200000, '0.23'), (300000, '0.27'), (None, '0.30')],
+        'long_term_exempt': False,
+        'annual_exemption': '0',
+        'exemption_type': 'allowance',
+    },
+    'US': {
+        'currency': 'USD',
+        'rounding': 'ROUND_HALF_EVEN',
+        'long_term_days': 365,
+        'short_term_brackets': [
+            (11925, '0.10'), (48475, '0.12'), (103350, '0.22'), (197300, '0.24'),
+            (250525, '0.32'), (626350, '0.35'), (None, '0.37')
+        ],
+        'long_term_brackets': [(48350, '0'), (533400, '0.15'), (None, '0.20')],
+        'long_term_exempt': False,
+        'annual_exemption': '0',
+        'exemption_type': 'allowance',
+    },
+    'DE': {
+        'currency': 'EUR',
+        'rounding': 'ROUND_HALF_EVEN',
+        'long_term_days': 365,
+        # Tipo marginal de referencia del IRPF alemán
+        'short_term_brackets': [(None, '0.42')],
+        'long_term_brackets': [(None, '0')],
+        'long_term_exempt': True,
+        'annual_exemption': '1000',
+        'exemption_type': 'threshold',
+    },
+    'FR': {
+        'currency': 'EUR',
+        'rounding': 'ROUND_HALF_EVEN',
+        'long_term_days': None,
+        'short_term_brackets': [(None, '0.30')],
+        'long_term_brackets': [(None, '0.30')],
+        'long_term_exempt': False,
+        'annual_exemption': '305',
+        'exemption_type': 'threshold',
+        'exemption_base': 'proceeds',
+    },
+    'IT': {
+        'currency': 'EUR',
+        'rounding': 'ROUND_HALF_EVEN',
+        'long_term_days': None,
+        'short_term_brackets': [(None, '0.26')],
+        'long_term_brackets': [(None, '0.26')],
+        'long_term_exempt': False,
+        'annual_exemption': '0',
+        'exemption_type': 'allowance',
+    },
+    'GB': {
+        'currency': 'GBP',
+        'rounding': 'ROUND_HALF_EVEN',
+        'long_term_days': None,
+        'short_term_brackets': [(37700, '0.18'), (None, '0.24')],
+        'long_term_brackets': [(37700, '0.18'), (None, '0.24')],
+        'long_term_exempt': False,
+        'annual_exemption': '3000',
+        'exemption_type': 'allowance',
+    },
+    'NL': {
+        'currency': 'EUR',
+        'rounding': 'ROUND_HALF_EVEN',
+        # Box 3: las ganancias realizadas no tributan como tales
+        'long_term_days': None,
+        'short_term_brackets': [(None, '0')],
+        'long_term_brackets': [(None, '0')],
+        'long_term_exempt': False,
+        'annual_exemption': '0',
+        'exemption_type': 'allowance',
+    },
+    'BE': {
+        'currency': 'EUR',
+        'rounding': 'ROUND_HALF_EVEN',
+        'long_term_days': None,
+        'short_term_brackets': [(None, '0')],
+        'long_term_brackets': [(None, '0')],
+        'long_term_exempt': False,
+        'annual_exemption': '0',
+        'exemption_type': 'allowance',
+    },
+    'AT': {
+        'currency': 'EUR',
+        'rounding': 'ROUND_HALF_EVEN',
+        'long_term_days': None,
+        'short_term_brackets': [(None, '0.275')],
+        'long_term_brackets': [(None, '0.275')],
+        'long_term_exempt': False,
+        'annual_exemption': '0',
+        'exemption_type': 'allowance',
+    },
+    'CH': {
+        'currency': 'CHF',
+        'rounding': 'ROUND_HALF_EVEN',
+        # Ganancias de patrimonio privado exentas
+        'long_term_days': None,
+        'short_term_brackets': [(None, '0')],
+        'long_term_brackets': [(None, '0')],
+        'long_term_exempt': False,
+        'annual_exemption': '0',
+        'exemption_type': 'allowance',
+    },
+}
+
+def load_tax_rules(jurisdiction: str) -> Dict[str, Any]:
+    """
+    Cargar las reglas fiscales de una jurisdicción.
+
+    Args:
+        jurisdiction: Código de jurisdicción (ES, US, DE...)
+
+    Returns:
+        Copia del diccionario de reglas con su versión
+
+    Raises:
+        ValueError: Si la jurisdicción no está soportada
+    """
+    if jurisdiction not in TAX_RULES:
+        raise ValueError(f"Jurisdicción no soportada: {jurisdiction}")
+
+    rules = copy.deepcopy(TAX_RULES[jurisdiction])
+    rules['jurisdiction'] = jurisdiction
+    rules['version'] = TAX_RULES_VERSION
+    return rules
+
+@dataclass(frozen=True)
+class BracketTable:
+    """
+    Escala progresiva compilada en tablas de búsqueda.
+
+    Attributes:
+        lowers: Límite inferior de cada tramo (escalado, el primero es 0)
+        rates: Tipo de cada tramo (escalado)
+        base_taxes: Cuota acumulada al inicio de cada tramo (escala 10^36)
+    """
+    lowers: Tuple[int, ...]
+    rates: Tuple[int, ...]
+    base_taxes: Tuple[int, ...]
+
+    @classmethod
+    def compile(cls, brackets) -> 'BracketTable':
+        """Compilar una lista de tramos (límite superior o None, tipo)"""
+        lowers, rates, base_taxes = [], [], []
+        lower = tax = 0
+        for upper, rate in brackets:
+            lowers.append(lower)
+            rates.append(to_scaled(rate))
+            base_taxes.append(tax)
+            if upper is None:
+                break
+            upper = to_scaled(upper)
+            tax += (upper - lower) * rates[-1]
+            lower = upper
+        else:
+            raise ValueError("La escala debe terminar en un tramo sin límite superior")
+        return cls(tuple(lowers), tuple(rates), tuple(base_taxes))
+
+    def tax(self, amount: int) -> int:
+        """Cuota de un importe escalado; resultado exacto en escala 10^36"""
+        if amount <= 0:
+            return 0
+        # Último tramo cuyo límite inferior queda por debajo del importe
+        index = bisect_left(self.lowers, amount) - 1
+        return self.base_taxes[index] + (amount - self.lowers[index]) * self.rates[index]
+
+@dataclass(frozen=True)
+class TaxRuleSet:
+    """
+    Reglas fiscales de una jurisdicción compiladas a enteros escalados.
+
+    Es inmutable y se comparte entre todos los calculadores del proceso
+    (ver compile_tax_rules).
+    """
+    jurisdiction: str
+    version: str
+    currency: str
+    rounding: str
+    long_term_days: Optional[int]
+    short_term_brackets: BracketTable
+    long_term_brackets: BracketTable
+    long_term_exempt: bool
+    annual_exemption: int
+    exemption_is_threshold: bool
+    exemption_on_proceeds: bool
+
+@lru_cache(maxsize=None)
+def compile_tax_rules(jurisdiction: str) -> TaxRuleSet:
+    """
+    Compilar (una vez por proceso) las reglas fiscales de una jurisdicción.
+
+    Args:
+        jurisdiction: Código de jurisdicción (ES, US, DE...)
+
+    Returns:
+        TaxRuleSet compartido
+
+    Raises:
+        ValueError: Si la jurisdicción no está soportada o sus reglas no son válidas
+    """
+    rules = load_tax_rules(jurisdiction)
+    if rules['rounding'] not in ROUNDING_MODES:
+        raise ValueError(f"Modo de redondeo no soportado en {jurisdiction}: {rules['rounding']}")
+    if rules['exemption_type'] not in ('allowance', 'threshold'):
+        raise ValueError(f"Tipo de exención no soportado en {jurisdiction}: {rules['exemption_type']}")
+
+    return TaxRuleSet(
+        jurisdiction=jurisdiction,
+        version=rules['version'],
+        currency=rules['currency'],
+        rounding=rules['rounding'],
+        long_term_days=rules['long_term_days'],
+        short_term_brackets=BracketTable.compile(rules['short_term_brackets']),
+        long_term_brackets=BracketTable.compile(rules['long_term_brackets']),
+        long_term_exempt=rules['long_term_exempt'],
+        annual_exemption=to_scaled(rules['annual_exemption']),
+        exemption_is_threshold=rules['exemption_type'] == 'threshold',
+        exemption_on_proceeds=rules.get('exemption_base', 'gain') == 'proceeds'
+    )
@@ -0,0 +1,428 @@
+"""
+KONTROL Transaction Frame
+Representación columnar (NumPy) de canonical_transactions para los motores fiscal, de matching y de portfolio
+"""
+
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from core.tax_engine.fixed_point import from_scaled, to_scaled
+
+# Escala de las columnas DECIMAL(38, 18)
+ATTO = 10 ** 18
+_HALF_ATTO = 10 ** 9
+_INT64_MIN = -2 ** 63
+_INT64_MAX = 2 ** 63 - 1
+
+# Categorías fijas (CHECK constraints de canonical_transactions)
+TX_TYPES = ('BUY', 'SELL', 'TRANSFER', 'FEE', 'REWARD', 'STAKING', 'MINING')
+KONTORL_TYPES = (
+    'INTERNAL_TRANSFER_IN', 'INTERNAL_TRANSFER_OUT', 'CAPITAL_GAIN_SELL', 'FEE_DEDUCTION',
+    'TRADE', 'SALE', 'EXCHANGE', 'DEPOSIT', 'WITHDRAWAL'
+)
+_TX_TYPE_CODES = {name: code for code, name in enumerate(TX_TYPES)}
+_KONTORL_TYPE_CODES = {name: code for code, name in enumerate(KONTORL_TYPES)}
+
+# Columnas que carga el frame
+FRAME_COLUMNS = (
+    'id', 'tx_id_kontrol', 'timestamp_utc', 'tx_type', 'kontorl_type',
+    'asset_in', 'asset_out', 'amount_in', 'amount_out',
+    'fiat_cost_basis_unit', 'exchange_rate', 'fees', 'exchange_id',
+    'source_address', 'destination_address', 'fee_asset'
+)
+
+class FixedPointArray:
+    """
+    Columna decimal exacta en punto fijo escalado.
+
+    Cada valor v se guarda como dos int64: units = floor(v) y
+    atto = (v - units) * 10^18, con 0 <= atto < 10^18. Cubre sin pérdida
+    cualquier DECIMAL(38, 18) cuya parte entera quepa en int64, ocupando
+    16 bytes por valor frente a los ~100 de un Decimal.
+    """
+
+    __slots__ = ('units', 'atto')
+
+    def __init__(self, units: np.ndarray, atto: np.ndarray):
+        self.units = units
+        self.atto = atto
+
+    @classmethod
+    def from_values(cls, values: Iterable[Any]) -> 'FixedPointArray':
+        """
+        Construir desde Decimal/str/int (None se interpreta como 0).
+
+        La conversión es exacta (to_scaled del tax engine, sin pasar por el
+        contexto Decimal de 28 dígitos).
+
+        Raises:
+            OverflowError: Si la parte entera de un valor no cabe en int64
+        """
+        units: List[int] = []
+        atto: List[int] = []
+        for value in values:
+            whole, fraction = divmod(to_scaled(value), ATTO)
+            if not _INT64_MIN <= whole <= _INT64_MAX:
+                raise OverflowError(f"Valor fuera del rango de FixedPointArray (parte entera en int64): {value}")
+            units.append(whole)
+            atto.append(fraction)
+        return cls(np.array(units, dtype=np.int64), np.array(atto, dtype=np.int64))
+
+    @classmethod
+    def zeros(cls, size: int) -> 'FixedPointArray':
+        return cls(np.zeros(size, dtype=np.int64), np.zeros(size, dtype=np.int64))
+
+    def __len__(self) -> int:
+        return len(self.units)
+
+    def __getitem__(self, index) -> 'FixedPointArray':
+        return FixedPointArray(self.units[index], self.atto[index])
+
+    def _normalized(self, units: np.ndarray, atto: np.ndarray) -> 'FixedPointArray':
+        carry = np.floor_divide(atto, ATTO)
+        return FixedPointArray(units + carry, atto - carry * ATTO)
+
+    def __add__(self, other: 'FixedPointArray') -> 'FixedPointArray':
+        return self._normalized(self.units + other.units, self.atto + other.atto)
+
+    def __sub__(self, other: 'FixedPointArray') -> 'FixedPointArray':
+        return self._normalized(self.units - other.units, self.atto - other.atto)
+
+    def __neg__(self) -> 'FixedPointArray':
+        return FixedPointArray.zeros(len(self)) - self
+
+    def total(self) -> Decimal:
+        """Suma exacta de la columna"""
+        # atto se parte en dos mitades de 10^9 para que la suma no desborde
+        # int64; units puede acercarse al límite, así que se suma con enteros Python
+        atto_high = int(np.sum(self.atto // _HALF_ATTO, dtype=np.int64))
+        atto_low = int(np.sum(self.atto % _HALF_ATTO, dtype=np.int64))
+        scaled = sum(self.units.tolist()) * ATTO + atto_high * _HALF_ATTO + atto_low
+        return from_scaled(scaled)
+
+    def to_float(self) -> np.ndarray:
+        """Aproximación float64 (para scoring y tolerancias, no para contabilidad)"""
+        return self.units.astype(np.float64) + self.atto.astype(np.float64) / ATTO
+
+    def to_scaled(self) -> List[int]:
+        """Convertir a enteros Python escalados por 10^18 (formato del tax engine)"""
+        return [units * ATTO + atto for units, atto in zip(self.units.tolist(), self.atto.tolist())]
+
+    def to_decimals(self) -> List[Decimal]:
+        """Convertir a Decimal en la frontera de los reportes"""
+        return [from_scaled(scaled) for scaled in self.to_scaled()]
+
+    @property
+    def nbytes(self) -> int:
+        return self.units.nbytes + self.atto.nbytes
+
+class CategoryIndex:
+    """Diccionario valor -> código int32 compartido por varias columnas (-1 = nulo)"""
+
+    def __init__(self, values: Sequence[str] = ()):
+        self.values: List[str] = list(values)
+        self._codes: Dict[str, int] = {value: code for code, value in enumerate(self.values)}
+
+    def code(self, value: Optional[str]) -> int:
+        if value is None:
+            return -1
+        code = self._codes.get(value)
+        if code is None:
+            code = self._codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+    def lookup(self, value: Optional[str]) -> int:
+        """Código de un valor existente (-2 si no aparece, nunca coincide)"""
+        if value is None:
+            return -1
+        return self._codes.get(value, -2)
+
+    def decode(self, code: int) -> Optional[str]:
+        return self.values[code] if code >= 0 else None
+
+@dataclass
+class TransactionFrame:
+    """
+    Transacciones de un usuario en formato columnar.
+
+    Attributes:
+        tx_ids: tx_id_kontrol (array object, referencias a los strings originales)
+        timestamps: Epoch UTC en microsegundos (int64)
+        tx_type / kontorl_type: Códigos int8 sobre TX_TYPES / KONTORL_TYPES
+        asset_in / asset_out: Códigos int32 sobre `assets`
+        exchange: Códigos int32 sobre `exchanges`
+        source_address / destination_address: Códigos int32 sobre `addresses` (en minúsculas)
+        fee_asset: Código int32 sobre `assets` del asset de la comisión (metadata.fee_asset)
+        amount_in / amount_out / unit_cost / exchange_rate / fees: Punto fijo exacto
+    """
+    tx_ids: np.ndarray
+    timestamps: np.ndarray
+    tx_type: np.ndarray
+    kontorl_type: np.ndarray
+    asset_in: np.ndarray
+    asset_out: np.ndarray
+    exchange: np.ndarray
+    source_address: np.ndarray
+    destination_address: np.ndarray
+    fee_asset: np.ndarray
+    amount_in: FixedPointArray
+    amount_out: FixedPointArray
+    unit_cost: FixedPointArray
+    exchange_rate: FixedPointArray
+    fees: FixedPointArray
+    assets: CategoryIndex = field(default_factory=CategoryIndex)
+    exchanges: CategoryIndex = field(default_factory=CategoryIndex)
+    addresses: CategoryIndex = field(default_factory=CategoryIndex)
+
+    def __len__(self) -> int:
+        return len(self.timestamps)
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[Any], assets: Optional[CategoryIndex] = None,
+                  exchanges: Optional[CategoryIndex] = None,
+                  addresses: Optional[CategoryIndex] = None) -> 'TransactionFrame':
+        """
+        Construir el frame desde filas de canonical_transactions.
+
+        Args:
+            rows: Modelos ORM, mappings o tuplas en el orden de FRAME_COLUMNS
+            assets: Índice de assets compartido (opcional)
+            exchanges: Índice de exchanges compartido (opcional)
+            addresses: Índice de direcciones compartido (opcional)
+        """
+        assets = assets if assets is not None else CategoryIndex()
+        exchanges = exchanges if exchanges is not None else CategoryIndex()
+        addresses = addresses if addresses is not None else CategoryIndex()
+        columns: Dict[str, List[Any]] = {name: [] for name in FRAME_COLUMNS}
+
+        for row in rows:
+            if isinstance(row, dict):
+                values = [row.get(name) for name in FRAME_COLUMNS]
+                metadata = row.get('metadata')
+                if values[-1] is None and isinstance(metadata, dict):
+                    values[-1] = metadata.get('fee_asset')
+            elif isinstance(row, tuple):
+                values = list(row)
+            else:
+                values = [getattr(row, name, None) for name in FRAME_COLUMNS]
+            for name, value in zip(FRAME_COLUMNS, values):
+                columns[name].append(value)
+
+        return cls(
+            tx_ids=np.array(
+                [str(tx_id or row_id) for tx_id, row_id in zip(columns['tx_id_kontrol'], columns['id'])],
+                dtype=object
+            ),
+            timestamps=np.array([to_epoch_us(ts) for ts in columns['timestamp_utc']], dtype=np.int64),
+            tx_type=np.array([_TX_TYPE_CODES.get(v, -1) for v in columns['tx_type']], dtype=np.int8),
+            kontorl_type=np.array([_KONTORL_TYPE_CODES.get(v, -1) for v in columns['kontorl_type']], dtype=np.int8),
+            asset_in=np.array([assets.code(v) for v in columns['asset_in']], dtype=np.int32),
+            asset_out=np.array([assets.code(v) for v in columns['asset_out']], dtype=np.int32),
+            exchange=np.array([exchanges.code(v) for v in columns['exchange_id']], dtype=np.int32),
+            source_address=np.array(
+                [addresses.code(v.strip().lower() if v else None) for v in columns['source_address']], dtype=np.int32
+            ),
+            destination_address=np.array(
+                [addresses.code(v.strip().lower() if v else None) for v in columns['destination_address']],
+                dtype=np.int32
+            ),
+            fee_asset=np.array([assets.code(v) for v in columns['fee_asset']], dtype=np.int32),
+            amount_in=FixedPointArray.from_values(columns['amount_in']),
+            amount_out=FixedPointArray.from_values(columns['amount_out']),
+            unit_cost=FixedPointArray.from_values(columns['fiat_cost_basis_unit']),
+            exchange_rate=FixedPointArray.from_values(columns['exchange_rate']),
+            fees=FixedPointArray.from_values(columns['fees']),
+            assets=assets,
+            exchanges=exchanges,
+            addresses=addresses
+        )
+
+    def take(self, index) -> 'TransactionFrame':
+        """Seleccionar filas por máscara booleana o índices"""
+        return TransactionFrame(
+            tx_ids=self.tx_ids[index],
+            timestamps=self.timestamps[index],
+            tx_type=self.tx_type[index],
+            kontorl_type=self.kontorl_type[index],
+            asset_in=self.asset_in[index],
+            asset_out=self.asset_out[index],
+            exchange=self.exchange[index],
+            source_address=self.source_address[index],
+            destination_address=self.destination_address[index],
+            fee_asset=self.fee_asset[index],
+            amount_in=self.amount_in[index],
+            amount_out=self.amount_out[index],
+            unit_cost=self.unit_cost[index],
+            exchange_rate=self.exchange_rate[index],
+            fees=self.fees[index],
+            assets=self.assets,
+            exchanges=self.exchanges,
+            addresses=self.addresses
+        )
+
+    @classmethod
+    def concat(cls, frames: Sequence['TransactionFrame']) -> 'TransactionFrame':
+        """Concatenar frames que comparten índices de categorías"""
+        first = frames[0]
+        if any(f.assets is not first.assets or f.exchanges is not first.exchanges or f.addresses is not first.addresses
+               for f in frames):
+            raise ValueError("Los frames deben compartir los índices de assets, exchanges y direcciones")
+
+        def join(name: str) -> np.ndarray:
+            return np.concatenate([getattr(f, name) for f in frames])
+
+        def join_fixed(name: str) -> FixedPointArray:
+            return FixedPointArray(
+                np.concatenate([getattr(f, name).units for f in frames]),
+                np.concatenate([getattr(f, name).atto for f in frames])
+            )
+
+        return cls(
+            tx_ids=join('tx_ids'),
+            timestamps=join('timestamps'),
+            tx_type=join('tx_type'),
+            kontorl_type=join('kontorl_type'),
+            asset_in=join('asset_in'),
+            asset_out=join('asset_out'),
+            exchange=join('exchange'),
+            source_address=join('source_address'),
+            destination_address=join('destination_address'),
+            fee_asset=join('fee_asset'),
+            amount_in=join_fixed('amount_in'),
+            amount_out=join_fixed('amount_out'),
+            unit_cost=join_fixed('unit_cost'),
+            exchange_rate=join_fixed('exchange_rate'),
+            fees=join_fixed('fees'),
+            assets=first.assets,
+            exchanges=first.exchanges,
+            addresses=first.addresses
+        )
+
+    def sorted_by_time(self) -> 'TransactionFrame':
+        """Orden cronológico estable"""
+        return self.take(np.argsort(self.timestamps, kind='stable'))
+
+    def type_mask(self, *tx_types: str) -> np.ndarray:
+        """Máscara de filas con alguno de los tx_type indicados"""
+        return np.isin(self.tx_type, [_TX_TYPE_CODES[name] for name in tx_types])
+
+    def kontorl_type_mask(self, *kontorl_types: str) -> np.ndarray:
+        """Máscara de filas con alguno de los kontorl_type indicados"""
+        return np.isin(self.kontorl_type, [_KONTORL_TYPE_CODES[name] for name in kontorl_types])
+
+    def asset_mask(self, asset: str, column: str = 'asset_in') -> np.ndarray:
+        """Máscara de filas de un asset en asset_in o asset_out"""
+        return getattr(self, column) == self.assets.lookup(asset)
+
+    @property
+    def nbytes(self) -> int:
+        """Memoria ocupada por las columnas numéricas"""
+        return (
+            self.timestamps.nbytes + self.tx_type.nbytes + self.kontorl_type.nbytes
+            + self.asset_in.nbytes + self.asset_out.nbytes + self.exchange.nbytes
+            + self.source_address.nbytes + self.destination_address.nbytes + self.fee_asset.nbytes
+            + self.tx_ids.nbytes + self.amount_in.nbytes + self.amount_out.nbytes
+            + self.unit_cost.nbytes + self.exchange_rate.nbytes + self.fees.nbytes
+        )
+
+    def to_tax_transactions(self) -> List[Any]:
+        """Convertir a eventos fiscales del tax engine (importes escalados, sin pasar por Decimal)"""
+        from core.tax_engine.models import ACQUISITION_TYPES, DISPOSAL_TYPES, tax_events
+
+        relevant = np.flatnonzero(self.type_mask(*ACQUISITION_TYPES, *DISPOSAL_TYPES))
+        amount_in = self.amount_in.to_scaled()
+        amount_out = self.amount_out.to_scaled()
+        unit_cost = self.unit_cost.to_scaled()
+        exchange_rate = self.exchange_rate.to_scaled()
+        fees = self.fees.to_scaled()
+
+        transactions = []
+        for row in relevant.tolist():
+            asset_in = self.assets.decode(int(self.asset_in[row]))
+            asset_out = self.assets.decode(int(self.asset_out[row]))
+            transactions.extend(tax_events(
+                tx_id=self.tx_ids[row],
+                timestamp=from_epoch_us(int(self.timestamps[row])),
+                tx_type=TX_TYPES[self.tx_type[row]],
+                asset_in=asset_in,
+                amount_in=amount_in[row] if asset_in is not None else None,
+                unit_cost=unit_cost[row],
+                asset_out=asset_out,
+                amount_out=amount_out[row] if asset_out is not None else None,
+                exchange_rate=exchange_rate[row],
+                fee=fees[row],
+                fee_asset=self.assets.decode(int(self.fee_asset[row])),
+                exchange_id=self.exchanges.decode(int(self.exchange[row]))
+            ))
+        return transactions
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+def to_epoch_us(value: datetime) -> int:
+    """datetime -> epoch UTC en microsegundos (naive se asume UTC)"""
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    delta = value - _EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1_000_000 + delta.microseconds
+
+def from_epoch_us(value: int) -> datetime:
+    """Epoch UTC en microsegundos -> datetime con zona UTC"""
+    return _EPOCH + timedelta(microseconds=value)
+
+async def load_transaction_frame(repository, user_id: str, start_date: Optional[datetime] = None,
+                                 end_date: Optional[datetime] = None, batch_size: int = 50000,
+                                 kontorl_types: Optional[Sequence[str]] = None) -> TransactionFrame:
+    """
+    Cargar el historial de un usuario directamente en formato columnar.
+
+    Las filas llegan del TransactionRepository en lotes de tuplas (sin
+    instanciar modelos ORM) y se convierten lote a lote, de modo que nunca
+    coexisten todas las filas como objetos Python.
+
+    Args:
+        repository: TransactionRepository con sesión abierta
+        user_id: ID del usuario
+        start_date: Fecha inicial (inclusive, opcional)
+        end_date: Fecha final (inclusive, opcional)
+        batch_size: Filas por lote
+        kontorl_types: Cargar sólo estos tipos KONTROL (opcional)
+
+    Returns:
+        TransactionFrame en orden cronológico
+    """
+    assets = CategoryIndex()
+    exchanges = CategoryIndex()
+    addresses = CategoryIndex()
+    chunks = [TransactionFrame.from_rows([], assets, exchanges, addresses)]
+
+    async for chunk in iter_transaction_frames(repository, user_id, start_date, end_date, batch_size, assets, exchanges,
+                                               kontorl_types, addresses):
+        chunks.append(chunk)
+
+    return TransactionFrame.concat(chunks)
+
+async def iter_transaction_frames(repository, user_id: str, start_date: Optional[datetime] = None,
+                                  end_date: Optional[datetime] = None, batch_size: int = 50000,
+                                  assets: Optional[CategoryIndex] = None,
+                                  exchanges: Optional[CategoryIndex] = None,
+                                  kontorl_types: Optional[Sequence[str]] = None,
+                                  addresses: Optional[CategoryIndex] = None) -> AsyncIterator[TransactionFrame]:
+    """
+    Recorrer el historial de un usuario como frames de como máximo batch_size filas.
+
+    Los frames comparten índices de categorías y llegan en orden cronológico,
+    de modo que un consumidor puede procesar historiales arbitrariamente
+    largos con memoria acotada.
+    """
+    assets = assets if assets is not None else CategoryIndex()
+    exchanges = exchanges if exchanges is not None else CategoryIndex()
+    addresses = addresses if addresses is not None else CategoryIndex()
+
+    async for rows in repository.stream_columns(user_id, FRAME_COLUMNS, start_date, end_date, batch_size,
+                                                kontorl_types=kontorl_types):
+        yield TransactionFrame.from_rows([tuple(row) for row in rows], assets, exchanges, addresses)
@@ -6,7 +6,7 @@ Modelos SQLAlchemy para Supabase PostgreSQL
 from sqlalchemy import (
     Column, String, Integer, Boolean, DateTime, Text, 
     ForeignKey, UniqueConstraint, CheckConstraint, Index,
-    DECIMAL, JSON, Date, BigInteger
+    DECIMAL, JSON, Date, BigInteger, LargeBinary
 )
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.ext.declarative import declarative_base
@@ -38,6 +38,7 @@ class User(Base):
     transactions = relationship("CanonicalTransaction", back_populates="user", cascade="all, delete-orphan")
     portfolio_snapshots = relationship("PortfolioSnapshot", back_populates="user", cascade="all, delete-orphan")
     tax_reports = relationship("TaxReport", back_populates="user", cascade="all, delete-orphan")
+    tax_lot_checkpoints = relationship("TaxLotCheckpoint", back_populates="user", cascade="all, delete-orphan")
     sync_jobs = relationship("SyncJob", back_populates="user", cascade="all, delete-orphan")
     
     # Constraints
@@ -195,6 +196,7 @@ class TaxReport(Base):
     long_term_gains = Column(DECIMAL(38, 18), default=Decimal('0'))
     transaction_count = Column(Integer, default=0)
     report_data = Column(JSON, nullable=False)
+    cache_key = Column(String(64))  # Clave de caché con la que se generó (report_cache)
     generated_at = Column(DateTime(timezone=True), server_default=func.now())
     
     # Relaciones
@@ -208,6 +210,37 @@ class TaxReport(Base):
         CheckConstraint("method IN ('FIFO', 'LIFO', 'HIFO', 'AVERAGE_COST')", name='valid_method'),
     )
 
+class TaxLotCheckpoint(Base):
+    __tablename__ = 'tax_lot_checkpoints'
+    
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    user_id = Column(UUID(as_uuid=True), ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
+    year = Column(Integer, nullable=False)
+    method = Column(String(20), nullable=False)
+    open_lots = Column(JSON, nullable=False)  # Snapshot compacto del inventario a 31/12
+    lot_count = Column(Integer, default=0)
+    history_digest = Column(String(64))  # Digest del historial hasta el 31/12 (report_cache)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    
+    # Relaciones
+    user = relationship("User", back_populates="tax_lot_checkpoints")
+    
+    # Constraints
+    __table_args__ = (
+        Index('idx_checkpoint_user_method_year', 'user_id', 'method', 'year'),
+        UniqueConstraint('user_id', 'method', 'year', name='unique_user_method_checkpoint'),
+    )
+
+class TransactionDigest(Base):
+    __tablename__ = 'transaction_digests'
+    
+    # Mantenida por el trigger apply_transaction_digests (ver supabase_schema.sql)
+    user_id = Column(UUID(as_uuid=True), ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    year = Column(Integer, primary_key=True)
+    digest = Column(BigInteger, nullable=False, default=0)  # XOR de md5(id, updated_at) de las filas del año
+    row_count = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now())
+
 class SyncJob(Base):
     __tablename__ = 'sync_jobs'
     
@@ -219,10 +252,14 @@ class SyncJob(Base):
     progress = Column(Integer, default=0)
     total_items = Column(Integer, default=0)
     processed_items = Column(Integer, default=0)
+    checkpoint_offset = Column(BigInteger, default=0)  # Byte del archivo confirmado (importaciones)
+    checkpoint_row = Column(Integer, default=0)  # Filas del archivo confirmadas
+    total_bytes = Column(BigInteger)
     error_message = Column(Text)
     started_at = Column(DateTime(timezone=True))
     completed_at = Column(DateTime(timezone=True))
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
     
     # Relaciones
     user = relationship("User", back_populates="sync_jobs")
@@ -235,6 +272,14 @@ class SyncJob(Base):
         CheckConstraint("status IN ('pending', 'running', 'completed', 'failed', 'cancelled')", name='valid_status'),
     )
 
+class SyncJobIdentity(Base):
+    __tablename__ = 'sync_job_identities'
+    
+    # Un registro por checkpoint de importación; se borran al completarse el trabajo
+    job_id = Column(UUID(as_uuid=True), ForeignKey('sync_jobs.id', ondelete='CASCADE'), primary_key=True)
+    checkpoint_offset = Column(BigInteger, primary_key=True)  # Byte del archivo del checkpoint
+    changes = Column(LargeBinary, nullable=False)  # IdentityCounter.take_changes()
+
 # Modelos adicionales para funcionalidades específicas
 
 class PriceData(Base):
@@ -141,6 +141,7 @@ CREATE TABLE tax_reports (
     long_term_gains DECIMAL(38, 18) DEFAULT 0,
     transaction_count INTEGER DEFAULT 0,
     report_data JSONB NOT NULL,
+    cache_key VARCHAR(64),
     generated_at TIMESTAMPTZ DEFAULT NOW(),
     
     -- Índice único por usuario, año y método
@@ -148,6 +149,33 @@ CREATE TABLE tax_reports (
     CONSTRAINT valid_method CHECK (method IN ('FIFO', 'LIFO', 'HIFO', 'AVERAGE_COST'))
 );
 
+-- Tabla de checkpoints de lotes abiertos a fin de año (recálculo fiscal incremental)
+CREATE TABLE tax_lot_checkpoints (
+    id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
+    user_id UUID REFERENCES users(id) ON DELETE CASCADE,
+    year INTEGER NOT NULL,
+    method VARCHAR(20) NOT NULL,
+    open_lots JSONB NOT NULL,
+    lot_count INTEGER DEFAULT 0,
+    history_digest VARCHAR(64), -- Digest de transaction_digests (años <= year) con el que se calculó
+    created_at TIMESTAMPTZ DEFAULT NOW(),
+    
+    -- Un checkpoint por usuario, método y año
+    UNIQUE (user_id, method, year)
+);
+
+-- Tabla de digests de transacciones por usuario y año (clave de la caché de reportes fiscales)
+-- digest es el XOR de md5(id, updated_at) de cada fila: se actualiza en O(1) por cambio
+CREATE TABLE transaction_digests (
+    user_id UUID REFERENCES users(id) ON DELETE CASCADE,
+    year INTEGER NOT NULL,
+    digest BIGINT NOT NULL DEFAULT 0,
+    row_count INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMPTZ DEFAULT NOW(),
+    
+    PRIMARY KEY (user_id, year)
+);
+
 -- Tabla de jobs de sincronización
 CREATE TABLE sync_jobs (
     id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
@@ -158,22 +186,36 @@ CREATE TABLE sync_jobs (
     progress INTEGER DEFAULT 0,
     total_items INTEGER DEFAULT 0,
     processed_items INTEGER DEFAULT 0,
+    checkpoint_offset BIGINT DEFAULT 0, -- Byte del archivo confirmado (importaciones)
+    checkpoint_row INTEGER DEFAULT 0, -- Filas del archivo confirmadas
+    total_bytes BIGINT,
     error_message TEXT,
     started_at TIMESTAMPTZ,
     completed_at TIMESTAMPTZ,
     created_at TIMESTAMPTZ DEFAULT NOW(),
+    updated_at TIMESTAMPTZ DEFAULT NOW(),
     
     CONSTRAINT valid_job_type CHECK (job_type IN ('exchange_sync', 'wallet_sync', 'csv_import', 'tax_calculation')),
     CONSTRAINT valid_status CHECK (status IN ('pending', 'running', 'completed', 'failed', 'cancelled'))
 );
 
+-- Estado del contador de identidades de una importación en curso, un registro por checkpoint
+-- (identidades nuevas y repeticiones del lote): al reanudar se aplican en orden sin releer el archivo
+CREATE TABLE sync_job_identities (
+    job_id UUID REFERENCES sync_jobs(id) ON DELETE CASCADE,
+    checkpoint_offset BIGINT NOT NULL, -- Byte del archivo del checkpoint
+    changes BYTEA NOT NULL, -- IdentityCounter.take_changes()
+    
+    PRIMARY KEY (job_id, checkpoint_offset)
+);
+
 -- ============================================================================
 -- ÍNDICES PARA RENDIMIENTO
 -- ============================================================================
 
 -- Índices para usuarios
 CREATE INDEX idx_users_email ON users(email);
-CREATE INDEX idx_users_jurisdiction ON users(jurisdiction);
+CREATE INDEX idx_users_jurisdiction ON users(jurisdiction, id);
 CREATE INDEX idx_users_subscription ON users(subscription_tier);
 
 -- Índices para exchanges
@@ -208,6 +250,9 @@ CREATE INDEX idx_portfolio_user_asset ON portfolio_snapshots(user_id, asset);
 CREATE INDEX idx_tax_user_year ON tax_reports(user_id, year);
 CREATE INDEX idx_tax_user_method ON tax_reports(user_id, method);
 
+-- Índices para checkpoints de lotes
+CREATE INDEX idx_checkpoint_user_method_year ON tax_lot_checkpoints(user_id, method, year);
+
 -- Índices para jobs
 CREATE INDEX idx_jobs_user_status ON sync_jobs(user_id, status);
 CREATE INDEX idx_jobs_type_status ON sync_jobs(job_type, status);
@@ -223,7 +268,10 @@ ALTER TABLE wallet_addresses ENABLE ROW LEVEL SECURITY;
 ALTER TABLE canonical_transactions ENABLE ROW LEVEL SECURITY;
 ALTER TABLE portfolio_snapshots ENABLE ROW LEVEL SECURITY;
 ALTER TABLE tax_reports ENABLE ROW LEVEL SECURITY;
+ALTER TABLE tax_lot_checkpoints ENABLE ROW LEVEL SECURITY;
+ALTER TABLE transaction_digests ENABLE ROW LEVEL SECURITY;
 ALTER TABLE sync_jobs ENABLE ROW LEVEL SECURITY;
+ALTER TABLE sync_job_identities ENABLE ROW LEVEL SECURITY;
 
 -- Políticas de seguridad
 CREATE POLICY "Users can only access own data" ON users
@@ -244,9 +292,18 @@ CREATE POLICY "Users can only access own portfolios" ON portfolio_snapshots
 CREATE POLICY "Users can only access own tax reports" ON tax_reports
     FOR ALL USING (user_id = auth.uid());
 
+CREATE POLICY "Users can only access own lot checkpoints" ON tax_lot_checkpoints
+    FOR ALL USING (user_id = auth.uid());
+
+CREATE POLICY "Users can only access own transaction digests" ON transaction_digests
+    FOR ALL USING (user_id = auth.uid());
+
 CREATE POLICY "Users can only access own sync jobs" ON sync_jobs
     FOR ALL USING (user_id = auth.uid());
 
+CREATE POLICY "Users can only access own sync job identities" ON sync_job_identities
+    FOR ALL USING (job_id IN (SELECT id FROM sync_jobs WHERE user_id = auth.uid()));
+
 -- ============================================================================
 -- FUNCIONES Y TRIGGERS
 -- ============================================================================
@@ -273,11 +330,133 @@ CREATE TRIGGER update_wallets_updated_at BEFORE UPDATE ON wallet_addresses
 CREATE TRIGGER update_transactions_updated_at BEFORE UPDATE ON canonical_transactions
     FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
 
--- Función para generar tx_id_kontrol único
+CREATE TRIGGER update_sync_jobs_updated_at BEFORE UPDATE ON sync_jobs
+    FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
+
+-- Función para invalidar checkpoints de lotes afectados por un cambio de transacciones
+-- Sólo se borran los checkpoints de años >= al de la transacción modificada más antigua de cada usuario
+CREATE OR REPLACE FUNCTION invalidate_tax_lot_checkpoints()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        DELETE FROM tax_lot_checkpoints c
+        USING (
+            SELECT user_id, min(timestamp_utc) AS first_change
+            FROM old_rows
+            WHERE user_id IS NOT NULL
+            GROUP BY user_id
+        ) changed
+        WHERE c.user_id = changed.user_id
+          AND c.year >= extract(year from changed.first_change AT TIME ZONE 'UTC');
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        DELETE FROM tax_lot_checkpoints c
+        USING (
+            SELECT user_id, min(timestamp_utc) AS first_change
+            FROM new_rows
+            WHERE user_id IS NOT NULL
+            GROUP BY user_id
+        ) changed
+        WHERE c.user_id = changed.user_id
+          AND c.year >= extract(year from changed.first_change AT TIME ZONE 'UTC');
+    END IF;
+    RETURN NULL;
+END;
+$$ language 'plpgsql';
+
+-- A nivel de sentencia, como los de transaction_digests: un COPY/merge de N filas
+-- hace un DELETE por usuario, no N
+CREATE TRIGGER invalidate_tax_lot_checkpoints_insert_trigger AFTER INSERT ON canonical_transactions
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION invalidate_tax_lot_checkpoints();
+
+CREATE TRIGGER invalidate_tax_lot_checkpoints_update_trigger AFTER UPDATE ON canonical_transactions
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION invalidate_tax_lot_checkpoints();
+
+CREATE TRIGGER invalidate_tax_lot_checkpoints_delete_trigger AFTER DELETE ON canonical_transactions
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION invalidate_tax_lot_checkpoints();
+
+-- Hash de 64 bits de una fila de canonical_transactions (id + updated_at)
+CREATE OR REPLACE FUNCTION transaction_row_digest(row_id UUID, row_updated_at TIMESTAMPTZ)
+RETURNS BIGINT AS $$
+    SELECT ('x' || substr(md5(row_id::text || '|' || extract(epoch from row_updated_at)::text), 1, 16))::bit(64)::bigint;
+$$ LANGUAGE sql IMMUTABLE;
+
+-- Función para mantener transaction_digests: las filas antiguas salen del XOR y las nuevas entran.
+-- updated_at ya viene actualizado por update_transactions_updated_at (BEFORE UPDATE)
+CREATE OR REPLACE FUNCTION apply_transaction_digests()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        INSERT INTO transaction_digests AS d (user_id, year, digest, row_count)
+        SELECT user_id,
+               extract(year from timestamp_utc AT TIME ZONE 'UTC')::integer,
+               bit_xor(transaction_row_digest(id, updated_at)),
+               -count(*)::integer
+        FROM old_rows
+        WHERE user_id IS NOT NULL
+        GROUP BY 1, 2
+        ON CONFLICT (user_id, year) DO UPDATE
+        SET digest = d.digest # EXCLUDED.digest,
+            row_count = d.row_count + EXCLUDED.row_count,
+            updated_at = NOW();
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO transaction_digests AS d (user_id, year, digest, row_count)
+        SELECT user_id,
+               extract(year from timestamp_utc AT TIME ZONE 'UTC')::integer,
+               bit_xor(transaction_row_digest(id, updated_at)),
+               count(*)::integer
+        FROM new_rows
+        WHERE user_id IS NOT NULL
+        GROUP BY 1, 2
+        ON CONFLICT (user_id, year) DO UPDATE
+        SET digest = d.digest # EXCLUDED.digest,
+            row_count = d.row_count + EXCLUDED.row_count,
+            updated_at = NOW();
+    END IF;
+    RETURN NULL;
+END;
+$$ language 'plpgsql';
+
+-- Triggers a nivel de sentencia (tablas de transición): un único upsert por usuario y año
+-- aunque la sentencia toque miles de filas
+CREATE TRIGGER transaction_digests_insert_trigger AFTER INSERT ON canonical_transactions
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION apply_transaction_digests();
+
+CREATE TRIGGER transaction_digests_update_trigger AFTER UPDATE ON canonical_transactions
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION apply_transaction_digests();
+
+CREATE TRIGGER transaction_digests_delete_trigger AFTER DELETE ON canonical_transactions
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION apply_transaction_digests();
+
+-- Función para generar tx_id_kontrol determinista en las filas que llegan sin él.
+-- Misma cadena canónica que core/ingestion_service/tx_identity.py (v1): los
+-- importadores calculan el id en cliente y este trigger sólo cubre inserciones
+-- directas. Reinsertar el mismo contenido produce el mismo id (ON CONFLICT).
 CREATE OR REPLACE FUNCTION generate_tx_id_kontrol()
-RETURNS TEXT AS $$
+RETURNS TRIGGER AS $$
 BEGIN
-    RETURN 'kontrol_' || extract(epoch from now())::bigint || '_' || substr(md5(random()::text), 1, 8);
+    IF NEW.tx_id_kontrol IS NULL THEN
+        NEW.tx_id_kontrol := 'kontrol_' || encode(sha256(convert_to(concat_ws('|',
+            'v1',
+            lower(NEW.user_id::text),
+            coalesce(lower(trim(NEW.metadata->>'source')), ''),
+            coalesce(lower(trim(NEW.exchange_id)), ''),
+            coalesce(trim(NEW.tx_hash), ''),
+            to_char(NEW.timestamp_utc AT TIME ZONE 'UTC', 'YYYY-MM-DD"T"HH24:MI:SS.US'),
+            coalesce(upper(trim(NEW.asset_in)), ''),
+            coalesce(trim_scale(NEW.amount_in)::text, ''),
+            coalesce(upper(trim(NEW.asset_out)), ''),
+            coalesce(trim_scale(NEW.amount_out)::text, '')
+        ), 'UTF8')), 'hex');
+    END IF;
+    RETURN NEW;
 END;
 $$ language 'plpgsql';
 
@@ -323,11 +502,15 @@ COMMENT ON TABLE wallet_addresses IS 'Direcciones de wallets blockchain';
 COMMENT ON TABLE canonical_transactions IS 'Transacciones normalizadas (esquema canónico KONTROL)';
 COMMENT ON TABLE portfolio_snapshots IS 'Snapshots diarios del portfolio';
 COMMENT ON TABLE tax_reports IS 'Reportes fiscales generados';
+COMMENT ON TABLE tax_lot_checkpoints IS 'Lotes abiertos a 31/12 por usuario y método (punto de partida del recálculo fiscal)';
+COMMENT ON TABLE transaction_digests IS 'Hash incremental de las transacciones por usuario y año (invalidación de la caché de reportes)';
 COMMENT ON TABLE sync_jobs IS 'Jobs de sincronización y procesamiento';
+COMMENT ON TABLE sync_job_identities IS 'Contador de transacciones repetidas de las importaciones en curso (reanudación)';
 
 COMMENT ON COLUMN canonical_transactions.kontorl_type IS 'Tipo de transacción según clasificación KONTROL';
 COMMENT ON COLUMN canonical_transactions.fiat_cost_basis_unit IS 'Coste en fiat por unidad de activo (clave para fiscalidad)';
 COMMENT ON COLUMN canonical_transactions.data_confidence IS 'Confianza en los datos (0.0 a 1.0)';
 COMMENT ON COLUMN canonical_transactions.tags IS 'Tags personalizados para categorización';
 COMMENT ON COLUMN canonical_transactions.metadata IS 'Metadatos adicionales de la transacción';
+COMMENT ON COLUMN tax_reports.cache_key IS 'Hash de digests, método, jurisdicción y versión de reglas con que se generó el reporte';
 
@@ -0,0 +1,83 @@
+"""
+KONTROL Tests
+Configuración común de pytest (los módulos se importan desde backend/)
+"""
+
+import asyncio
+import os
+import re
+import sys
+from pathlib import Path
+
+import pytest
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+if str(BACKEND_DIR) not in sys.path:
+    sys.path.append(str(BACKEND_DIR))
+
+# Base de datos PostgreSQL desechable para los tests de integración: el
+# esquema public se borra y se recrea en cada test. Sin ella se omiten
+TEST_DATABASE_URL = os.environ.get('KONTROL_TEST_DATABASE_URL')
+
+SCHEMA_PATH = BACKEND_DIR / 'models' / 'supabase_schema.sql'
+
+TEST_USER_ID = '00000000-0000-4000-8000-000000000001'
+
+# Lo que Supabase aporta y un PostgreSQL sin extensiones no trae
+_SUPABASE_SHIMS = """
+DROP SCHEMA IF EXISTS public CASCADE;
+CREATE SCHEMA public;
+CREATE SCHEMA IF NOT EXISTS auth;
+CREATE OR REPLACE FUNCTION auth.uid() RETURNS uuid LANGUAGE sql AS 'SELECT NULL::uuid';
+CREATE FUNCTION public.uuid_generate_v4() RETURNS uuid LANGUAGE sql AS 'SELECT gen_random_uuid()';
+"""
+
+_CREATE_EXTENSION = re.compile(r'^CREATE EXTENSION .*$', re.MULTILINE)
+
+class IntegrationDatabase:
+    """Acceso a la base de datos de pruebas desde tests síncronos"""
+
+    def __init__(self, url: str):
+        self.url = url.replace('postgresql://', 'postgresql+asyncpg://')
+        self.user_id = TEST_USER_ID
+
+    def run(self, scenario):
+        """Ejecutar `scenario(sessions)` (corrutina) con una fábrica de AsyncSession"""
+        from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+        from sqlalchemy.pool import NullPool
+
+        async def main():
+            engine = create_async_engine(self.url, poolclass=NullPool)
+            try:
+                return await scenario(async_sessionmaker(engine, expire_on_commit=False))
+            finally:
+                await engine.dispose()
+
+        return asyncio.run(main())
+
+@pytest.fixture
+def database():
+    """Base de datos con el esquema de models/supabase_schema.sql recién creado y un usuario"""
+    if not TEST_DATABASE_URL:
+        pytest.skip("KONTROL_TEST_DATABASE_URL no configurada")
+    pytest.importorskip('asyncpg')
+    from sqlalchemy import text
+
+    database = IntegrationDatabase(TEST_DATABASE_URL)
+    schema = _CREATE_EXTENSION.sub('', SCHEMA_PATH.read_text(encoding='utf-8'))
+
+    async def create(sessions):
+        async with sessions() as session:
+            raw = await (await session.connection()).get_raw_connection()
+            await raw.driver_connection.execute(_SUPABASE_SHIMS + schema)
+            # valid_email escapa el punto con '\\.' en un literal estándar y
+            # exige una barra invertida: los tests no dependen de él
+            await session.execute(text("ALTER TABLE users DROP CONSTRAINT valid_email"))
+            await session.execute(
+                text("INSERT INTO users (id, email, hashed_password) VALUES (:id, 'tester@kontrol.test', 'x')"),
+                {'id': TEST_USER_ID}
+            )
+            await session.commit()
+
+    database.run(create)
+    return database
@@ -0,0 +1,75 @@
+"""
+Tests del cargador masivo: registros de COPY, contadores y reimportación sobre una base de datos real
+"""
+
+import io
+import json
+from decimal import Decimal
+
+from sqlalchemy import text
+
+from core.ingestion_service.bulk_loader import CanonicalTransactionLoader, LoadResult, _copy_records
+from core.ingestion_service.cointracking_parser import CointrackingBackupParser
+
+USER_ID = '00000000-0000-4000-8000-000000000001'
+
+# Retirada de Kraken y su depósito en Binance un minuto después
+BACKUP = (
+    '"Type","Buy","Cur.","Sell","Cur.","Fee","Cur.","Exchange","Group","Comment","Date"\n'
+    '"Withdrawal","","","1.5","BTC","","","Kraken","","","01.03.2023 10:00:00"\n'
+    '"Deposit","1.5","BTC","","","","","Binance","","","01.03.2023 10:01:00"\n'
+    '"Trade","2","ETH","0.1","BTC","","","Binance","","","02.03.2023 12:00:00"\n'
+).encode('utf-8')
+
+def _batches(user_id=USER_ID):
+    return list(CointrackingBackupParser(chunk_size=2, user_id=user_id).iter_csv_batches(io.BytesIO(BACKUP)))
+
+def test_copy_records_follow_load_columns():
+    batch = _batches()[0]
+    records = list(_copy_records(USER_ID, batch))
+    assert len(records) == len(batch)
+    for record, row in zip(records, batch.to_dicts()):
+        assert record[0] == USER_ID
+        assert record[1] == row['tx_id_kontrol']
+        # tags/metadata van serializados para la columna jsonb
+        *_, tags, metadata = record
+        assert json.loads(tags) == row['tags']
+        assert json.loads(metadata) == json.loads(json.dumps(row['metadata'], default=str))
+
+def test_load_result_counts_unchanged_rows():
+    assert LoadResult(rows=10, written=7, batches=2).unchanged == 3
+    assert LoadResult().unchanged == 0
+
+def _state(session):
+    return session.execute(text("""
+        SELECT tx_id_kontrol, kontorl_type, updated_at, metadata->>'transfer_match'
+        FROM canonical_transactions ORDER BY tx_id_kontrol
+    """))
+
+def test_reimport_keeps_matched_transfers(database):
+    async def scenario(sessions):
+        async with sessions() as session:
+            loader = CanonicalTransactionLoader(session)
+            first = await loader.load(database.user_id, _batches(database.user_id))
+            rows = {row['kontorl_type']: row['tx_id_kontrol'] for batch in _batches(database.user_id) for row in batch.to_dicts()}
+            out_id, in_id = rows['WITHDRAWAL'], rows['DEPOSIT']
+
+            from utils.database import TransactionRepository
+            await TransactionRepository(session).apply_transfer_matches(
+                database.user_id, [out_id, in_id], ['INTERNAL_TRANSFER_OUT', 'INTERNAL_TRANSFER_IN'],
+                [in_id, out_id], [Decimal("0.95"), Decimal("0.95")]
+            )
+            matched = (await _state(session)).all()
+            digests = (await session.execute(text("SELECT year, digest, row_count FROM transaction_digests"))).all()
+
+            again = await loader.load(database.user_id, _batches(database.user_id))
+            return first, again, matched, digests, (await _state(session)).all(), (
+                await session.execute(text("SELECT year, digest, row_count FROM transaction_digests"))
+            ).all()
+
+    first, again, matched, digests, reimported, digests_after = database.run(scenario)
+    assert (first.rows, first.written) == (3, 3)
+    assert (again.rows, again.written, again.unchanged) == (3, 0, 3)
+    assert {row[1] for row in matched} >= {'INTERNAL_TRANSFER_OUT', 'INTERNAL_TRANSFER_IN'}
+    assert reimported == matched
+    assert digests_after == digests
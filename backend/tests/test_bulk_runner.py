@@ -0,0 +1,31 @@
+"""
+Tests del runner masivo de reportes fiscales: reparto en shards y métricas
+"""
+
+import pytest
+
+from core.tax_engine.bulk_runner import BulkRunStats, make_shards
+
+def test_shards_keep_the_largest_histories_first():
+    users = [(f'user-{index}', 'ES', 100 - index) for index in range(7)]
+    shards = make_shards(users, 3)
+    assert [len(shard) for shard in shards] == [3, 3, 1]
+    assert shards[0] == [('user-0', 'ES'), ('user-1', 'ES'), ('user-2', 'ES')]
+    assert [user for shard in shards for user, _ in shard] == [user for user, _, _ in users]
+    assert make_shards([], 3) == []
+
+@pytest.mark.parametrize('q, expected', [(0, 1.0), (50, 5.0), (90, 9.0), (95, 10.0), (99, 10.0), (100, 10.0)])
+def test_percentile_is_nearest_rank(q, expected):
+    stats = BulkRunStats(latencies=[float(value) for value in (7, 3, 10, 1, 5, 2, 9, 4, 8, 6)])
+    assert stats.percentile(q) == expected
+
+def test_merged_shards_add_up():
+    total = BulkRunStats()
+    total.merge(BulkRunStats(users=2, transactions=40, reports=8, latencies=[0.5, 0.1]))
+    total.merge(BulkRunStats(users=1, transactions=10, reports=4, latencies=[0.3], failures=[('user-9', 'boom')]))
+    total.elapsed = 2.0
+    assert (total.users, total.transactions, total.reports) == (3, 50, 12)
+    assert total.percentile(50) == 0.3
+    assert (total.users_per_second, total.transactions_per_second) == (1.5, 25.0)
+    assert total.summary().endswith('1 fallos')
+    assert BulkRunStats().percentile(99) == 0.0
@@ -0,0 +1,109 @@
+"""
+Tests del parser de Cointracking: bloques con comillas, reanudación y motivos de rechazo
+"""
+
+import io
+
+import pytest
+
+from core.ingestion_service.cointracking_parser import CointrackingBackupParser, _iter_record_blocks
+from core.ingestion_service.models import ImportValidationError, ParseError
+
+HEADER = '"Type","Buy","Cur.","Sell","Cur.","Fee","Cur.","Exchange","Group","Comment","Date"\n'
+
+def _row(kind='Deposit', buy='1', buy_currency='BTC', sell='', sell_currency='', comment='', date='01.01.2021 10:00:00'):
+    return f'"{kind}","{buy}","{buy_currency}","{sell}","{sell_currency}","","","Kraken","","{comment}","{date}"\n'
+
+def _csv(*rows):
+    return (HEADER + ''.join(rows)).encode('utf-8')
+
+def _batches(data, chunk_size=2, **kwargs):
+    return list(CointrackingBackupParser(chunk_size=chunk_size).iter_csv_batches(io.BytesIO(data), **kwargs))
+
+def test_blocks_never_split_a_quoted_field():
+    data = b'a,"line one\nline two\nline three",b\nc,d,e\nf,"x\ny",g\n'
+    blocks = list(_iter_record_blocks(io.BytesIO(data), 1))
+    assert [block for block, _ in blocks] == [
+        b'a,"line one\nline two\nline three",b\n', b'c,d,e\n', b'f,"x\ny",g\n'
+    ]
+    assert sum(size for _, size in blocks) == len(data)
+
+def test_multiline_comments_survive_chunking():
+    data = _csv(_row(comment='first\nsecond'), _row(buy='2'), _row(buy='3', comment='a "quoted"\n\nnote'.replace('"', '""')))
+    for chunk_size in (1, 2, 10):
+        frame = [row for batch in _batches(data, chunk_size) for row in batch.to_dicts()]
+        assert [row['metadata'].get('comment') for row in frame] == ['first\nsecond', None, 'a "quoted"\n\nnote']
+        assert [row['metadata']['source_row'] for row in frame] == [1, 2, 3]
+
+def test_batches_report_resume_points():
+    data = _csv(*(_row(buy=str(index + 1)) for index in range(5)))
+    batches = _batches(data)
+    assert [batch.rows_read for batch in batches] == [2, 4, 5]
+    assert batches[-1].byte_offset == len(data)
+    assert [data[:batch.byte_offset].count(b'\n') - 1 for batch in batches] == [2, 4, 5]
+
+@pytest.mark.parametrize('resume_after', [0, 1])
+def test_resume_from_checkpoint_reads_the_rest(resume_after):
+    data = _csv(_row(buy='1'), _row(buy='2', comment='multi\nline'), _row(buy='3'), _row(buy='4'), _row(buy='5'))
+    batches = _batches(data)
+    checkpoint = batches[resume_after]
+    rest = _batches(data, start_offset=checkpoint.byte_offset, start_row=checkpoint.rows_read)
+    assert [row for batch in rest for row in batch.source_rows] == [
+        row for batch in batches[resume_after + 1:] for row in batch.source_rows
+    ]
+    assert rest[-1].rows_read == 5
+
+def test_resume_from_a_non_seekable_stream():
+    data = _csv(*(_row(buy=str(index + 1)) for index in range(4)))
+    checkpoint = _batches(data)[0]
+
+    class Unseekable(io.RawIOBase):
+        def __init__(self, content):
+            self.content = io.BytesIO(content)
+
+        def readable(self):
+            return True
+
+        def readinto(self, buffer):
+            chunk = self.content.read(len(buffer))
+            buffer[:len(chunk)] = chunk
+            return len(chunk)
+
+    parser = CointrackingBackupParser(chunk_size=2)
+    rest = list(parser.iter_csv_batches(
+        io.BufferedReader(Unseekable(data)), start_offset=checkpoint.byte_offset, start_row=checkpoint.rows_read
+    ))
+    assert [row for batch in rest for row in batch.source_rows] == [3, 4]
+
+INVALID = _csv(
+    _row(),
+    _row(kind='Foo'),
+    _row(date='nope'),
+    _row(buy='abc'),
+    _row(kind='Withdrawal', buy='', buy_currency=''),
+    _row(buy_currency='ABCDEFGHIJKLMNOPQRSTUVWXYZ'),
+    _row(buy='2'),
+)
+
+def test_rejected_rows_are_reported_with_their_reason():
+    data = CointrackingBackupParser(chunk_size=3).parse_csv_backup(io.BytesIO(INVALID))
+    validation = data.metadata['validation']
+    assert data.transaction_count == 2
+    assert validation['rows'] == {
+        'unknown_type': [2],
+        'invalid_date': [3],
+        'invalid_amount': [4],
+        'missing_amount': [5],
+        'field_too_long': [6],
+    }
+    assert data.metadata['skipped'] == 5
+
+def test_fail_fast_raises_with_the_first_report():
+    parser = CointrackingBackupParser(chunk_size=3, fail_fast=True)
+    with pytest.raises(ImportValidationError) as error:
+        list(parser.iter_csv_batches(io.BytesIO(INVALID)))
+    assert error.value.report.rows == {'unknown_type': [2], 'invalid_date': [3]}
+
+def test_missing_columns_are_a_parse_error():
+    with pytest.raises(ParseError):
+        _batches(b'"Type","Buy"\n"Deposit","1"\n')
@@ -0,0 +1,99 @@
+"""
+Tests del orquestador de importaciones: checkpoints en sync_jobs y reanudación
+"""
+
+import asyncio
+import io
+import threading
+from contextlib import aclosing
+
+import pytest
+from sqlalchemy import text
+
+from core.ingestion_service.cointracking_parser import CointrackingBackupParser
+from core.ingestion_service.import_handler import IMPORT_JOB_TYPE, ImportHandler, iterate_off_loop
+from core.ingestion_service.models import ImportValidationError
+from utils.database import SyncJobRepository
+
+HEADER = b'"Type","Buy","Cur.","Sell","Cur.","Fee","Cur.","Exchange","Group","Comment","Date"\n'
+REPEATED = b'"Trade","0.5","BTC","15000","EUR","5","EUR","Kraken","","","15.03.2023 10:20:30"\n'
+OTHER = b'"Trade","1000","EUR","0.03","BTC","","","Kraken","","","16.03.2023 11:00:00"\n'
+INVALID = b'"Trade","1000","EUR","0.03","BTC","","","Kraken","","","not a date"\n'
+
+# Repeticiones a los dos lados del checkpoint; la primera ejecución se corta en la fila 8
+IMPORT = HEADER + REPEATED * 4 + OTHER + REPEATED * 2 + INVALID + REPEATED * 3 + OTHER
+FIXED = IMPORT.replace(INVALID, OTHER)
+
+def _expected_ids(user_id):
+    parser = CointrackingBackupParser(user_id=user_id)
+    return sorted(tx_id for batch in parser.iter_csv_batches(io.BytesIO(FIXED)) for tx_id in batch.frame['tx_id_kontrol'])
+
+def test_interrupted_import_resumes_with_the_same_ids(database):
+    async def scenario(sessions):
+        async with sessions() as session:
+            handler = ImportHandler(session)
+            with pytest.raises(ImportValidationError):
+                await handler.handle_cointracking_import(
+                    database.user_id, io.BytesIO(IMPORT), chunk_size=3, fail_fast=True, target_id='backup.csv'
+                )
+            jobs = SyncJobRepository(session)
+            job = await jobs.get_resumable(database.user_id, IMPORT_JOB_TYPE, 'backup.csv')
+            await session.refresh(job)
+            failed = await jobs.get_progress(job.id)
+            saved = await jobs.get_identity_changes(job.id, job.checkpoint_offset)
+
+            # Se reanuda con el archivo corregido (mismo contenido hasta el checkpoint)
+            result = await handler.handle_cointracking_import(
+                database.user_id, io.BytesIO(FIXED), chunk_size=3, job_id=str(job.id)
+            )
+            stored = (await session.execute(text("SELECT tx_id_kontrol FROM canonical_transactions ORDER BY 1"))).scalars().all()
+            left = (await session.execute(text("SELECT count(*) FROM sync_job_identities"))).scalar_one()
+            return failed, saved, result, stored, left, await jobs.get_progress(job.id)
+
+    failed, saved, result, stored, left, completed = database.run(scenario)
+    assert (failed['status'], failed['checkpoint_row']) == ('failed', 6)
+    assert len(saved) == 2
+    assert (result.resumed_from_row, result.rows_read, result.load.rows) == (6, 12, 6)
+    assert stored == _expected_ids(database.user_id)
+    # El estado del contador sólo vive mientras el trabajo está sin completar
+    assert left == 0
+    assert (completed['status'], completed['progress'], completed['total_items']) == ('completed', 100, 12)
+
+def test_small_files_are_parsed_in_process():
+    handler = ImportHandler()
+    threshold = handler.settings.import_parallel_min_mb * 1024 * 1024
+    assert handler.parse_workers(len(IMPORT)) == 1
+    assert handler.parse_workers(threshold - 1) == 1
+    # Un stream sin tamaño conocido se trata como un archivo grande
+    assert handler.parse_workers(threshold) == handler.parse_workers(None) >= 1
+
+def test_cancelling_closes_the_iterator_after_the_pending_next():
+    started, release = threading.Event(), threading.Event()
+    closed = []
+
+    def batches():
+        try:
+            started.set()
+            release.wait(5)
+            yield 1
+            yield 2
+        finally:
+            closed.append(release.is_set())
+
+    async def consume(iterator):
+        async with aclosing(iterate_off_loop(iterator)) as stream:
+            async for _ in stream:
+                pass
+
+    async def main():
+        loop = asyncio.get_running_loop()
+        task = asyncio.create_task(consume(batches()))
+        await loop.run_in_executor(None, started.wait, 5)
+        # Se cancela con el next() aún en el hilo del pool
+        task.cancel()
+        loop.call_later(0.05, release.set)
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(main())
+    assert closed == [True]
@@ -0,0 +1,261 @@
+"""
+Tests del matching engine: emparejador completo e incremental de transferencias internas
+"""
+
+import asyncio
+import io
+import itertools
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from core.matching_engine.incremental import (
+    InMemoryWindowIndex, IncrementalTransferMatcher, Movement, RedisWindowIndex
+)
+from core.matching_engine.internal_transfers import (
+    InternalTransferMatcher, assign_max_confidence, solve_assignment, sweep_candidates
+)
+from core.transaction_frame import TransactionFrame
+
+T0 = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+def _transfer(tx_id, kind, amount, seconds, destination=None, source=None, asset='BTC'):
+    inflow = kind == 'DEPOSIT'
+    return {
+        'tx_id_kontrol': tx_id,
+        'timestamp_utc': T0 + timedelta(seconds=seconds),
+        'tx_type': 'TRANSFER',
+        'kontorl_type': kind,
+        'asset_in': asset if inflow else None,
+        'asset_out': None if inflow else asset,
+        'amount_in': Decimal(amount) if inflow else None,
+        'amount_out': None if inflow else Decimal(amount),
+        'source_address': source,
+        'destination_address': destination,
+    }
+
+def _incremental_pairs(matcher, batches):
+    incremental = IncrementalTransferMatcher(InMemoryWindowIndex(), matcher)
+    pairs = set()
+    for rows in batches:
+        matches = asyncio.run(incremental.process('user-1', TransactionFrame.from_rows(rows)))
+        pairs.update(zip(matches.out_ids, matches.in_ids))
+    return pairs
+
+@pytest.fixture
+def matcher():
+    return InternalTransferMatcher(90, 0.8)
+
+@pytest.mark.parametrize('seed', range(5))
+def test_sweep_candidates_match_brute_force(seed):
+    rng = np.random.default_rng(seed)
+    window_us = 90_000_000
+    out_assets, in_assets = rng.integers(0, 3, size=200), rng.integers(0, 3, size=150)
+    # Tiempos densos y con empates exactos en los bordes de la ventana
+    out_times = rng.integers(0, 40, size=200) * 15_000_000
+    in_times = rng.integers(0, 40, size=150) * 15_000_000
+    out_positions, in_positions = sweep_candidates(out_assets, out_times, in_assets, in_times, window_us)
+    expected = {
+        (out_row, in_row)
+        for out_row in range(len(out_assets)) for in_row in range(len(in_assets))
+        if out_assets[out_row] == in_assets[in_row] and abs(int(in_times[in_row]) - int(out_times[out_row])) <= window_us
+    }
+    pairs = list(zip(out_positions.tolist(), in_positions.tolist()))
+    assert len(pairs) == len(set(pairs))
+    assert set(pairs) == expected
+
+def test_sweep_candidates_without_counterparts():
+    empty = np.array([], dtype=np.int64)
+    out_positions, in_positions = sweep_candidates(np.array([1]), np.array([0]), empty, empty, 90_000_000)
+    assert len(out_positions) == len(in_positions) == 0
+    out_positions, _ = sweep_candidates(np.array([1]), np.array([0]), np.array([2]), np.array([0]), 90_000_000)
+    assert len(out_positions) == 0
+
+def _best_matching(out_index, in_index, confidence):
+    """Confianza total máxima entre todos los subconjuntos 1 a 1 de pares (fuerza bruta)"""
+    best = 0.0
+    for size in range(1, len(confidence) + 1):
+        for chosen in itertools.combinations(range(len(confidence)), size):
+            outs = [int(out_index[pair]) for pair in chosen]
+            ins = [int(in_index[pair]) for pair in chosen]
+            if len(set(outs)) == len(outs) and len(set(ins)) == len(ins):
+                best = max(best, float(sum(confidence[list(chosen)])))
+    return best
+
+@pytest.mark.parametrize('seed', range(5))
+def test_solve_assignment_matches_brute_force(seed):
+    rng = np.random.default_rng(seed)
+    for _ in range(50):
+        rows, columns = (int(size) for size in rng.integers(1, 5, size=2))
+        # Matrices pequeñas y dispersas (0 = sin arista) para que la fuerza bruta sea viable
+        value = np.where(rng.random((rows, columns)) < 0.4, rng.random((rows, columns)), 0.0)
+        assigned = solve_assignment(value)
+        taken = assigned[assigned >= 0]
+        assert len(np.unique(taken)) == len(taken)
+        total = sum(value[row, column] for row, column in enumerate(assigned.tolist()) if column >= 0)
+        out_index, in_index = np.nonzero(value)
+        best = _best_matching(out_index, in_index, value[out_index, in_index])
+        assert total == pytest.approx(best)
+
+@pytest.mark.parametrize('seed', range(10))
+def test_assign_max_confidence_matches_brute_force(seed):
+    rng = np.random.default_rng(seed)
+    for _ in range(30):
+        # Pares distintos sobre pocas filas para forzar componentes con conflictos
+        candidates = [(out_row, in_row) for out_row in range(5) for in_row in range(5)]
+        chosen = rng.choice(len(candidates), size=int(rng.integers(1, 11)), replace=False)
+        out_index = np.array([candidates[pair][0] for pair in chosen], dtype=np.int64)
+        in_index = np.array([candidates[pair][1] for pair in chosen], dtype=np.int64)
+        confidence = rng.uniform(0.8, 1.0, size=len(chosen))
+        accepted = assign_max_confidence(out_index, in_index, confidence)
+        assert len(np.unique(out_index[accepted])) == len(accepted)
+        assert len(np.unique(in_index[accepted])) == len(accepted)
+        assert confidence[accepted].sum() == pytest.approx(_best_matching(out_index, in_index, confidence))
+
+# Dos retiradas idénticas salvo el destino; los depósitos llegan después
+ADDRESSED = [
+    _transfer('w1', 'WITHDRAWAL', '1.0', 0, destination='bc1qa'),
+    _transfer('w2', 'WITHDRAWAL', '1.0', 0, destination='bc1qb'),
+    _transfer('d1', 'DEPOSIT', '1.0', 5, destination='BC1QB'),
+    _transfer('d2', 'DEPOSIT', '1.0', 5, destination='bc1qa'),
+]
+
+def test_full_matcher_uses_addresses(matcher):
+    pairs = {(out_id, in_id) for out_id, in_id, _ in matcher.match(TransactionFrame.from_rows(ADDRESSED)).pairs()}
+    assert pairs == {('w1', 'd2'), ('w2', 'd1')}
+
+def test_incremental_matcher_uses_addresses(matcher):
+    full = {(out_id, in_id) for out_id, in_id, _ in matcher.match(TransactionFrame.from_rows(ADDRESSED)).pairs()}
+    assert _incremental_pairs(matcher, [ADDRESSED[:2], ADDRESSED[2:3], ADDRESSED[3:]]) == full
+
+def test_incremental_matcher_rejects_mismatched_destination(matcher):
+    rows = [
+        _transfer('w1', 'WITHDRAWAL', '1.0', 0, destination='bc1qa'),
+        _transfer('d1', 'DEPOSIT', '1.0', 5, destination='bc1qz'),
+    ]
+    assert not list(matcher.match(TransactionFrame.from_rows(rows)).pairs())
+    assert _incremental_pairs(matcher, [rows[:1], rows[1:]]) == set()
+
+class _FakeRedis:
+    """Lo justo de redis.asyncio para RedisWindowIndex.candidates"""
+
+    def __init__(self, members):
+        self.members = members
+
+    async def zrangebyscore(self, key, low, high, withscores=False):
+        return [(member.encode(), score) for member, score in self.members if low <= score <= high]
+
+def test_redis_members_keep_addresses():
+    movement = Movement('kontrol_1', 10, 0.5, 'bc1qsource', None)
+    index = RedisWindowIndex(client=_FakeRedis([(RedisWindowIndex._member(movement), 10)]), ttl_seconds=60)
+    assert asyncio.run(index.candidates('user-1', 'BTC', 'out', 10, 5)) == [movement]
+
+def test_window_index_bounds_and_claims():
+    index = InMemoryWindowIndex()
+    movements = [Movement(f'w{second}', second * 1_000_000, 1.0) for second in (0, 90, 91)]
+    for movement in movements:
+        asyncio.run(index.add('user-1', 'BTC', 'out', movement))
+    # La ventana es cerrada en los dos extremos
+    assert asyncio.run(index.candidates('user-1', 'BTC', 'out', 0, 90_000_000)) == movements[:2]
+    assert asyncio.run(index.candidates('user-1', 'ETH', 'out', 0, 90_000_000)) == []
+    assert asyncio.run(index.claim('user-1', 'BTC', 'out', movements[1]))
+    assert not asyncio.run(index.claim('user-1', 'BTC', 'out', movements[1]))
+    assert asyncio.run(index.candidates('user-1', 'BTC', 'out', 0, 90_000_000)) == movements[:1]
+
+def test_incremental_matcher_claims_each_counterpart_once(matcher):
+    incremental = IncrementalTransferMatcher(InMemoryWindowIndex(), matcher)
+    asyncio.run(incremental.process('user-1', TransactionFrame.from_rows([_transfer('w1', 'WITHDRAWAL', '1.0', 0)])))
+    matches = asyncio.run(incremental.process('user-1', TransactionFrame.from_rows([
+        _transfer('d1', 'DEPOSIT', '1.0', 5), _transfer('d2', 'DEPOSIT', '1.0', 6)
+    ])))
+    assert list(zip(matches.out_ids, matches.in_ids)) == [('w1', 'd1')]
+    assert matches.indexed == 1
+
+def test_incremental_matcher_expires_movements_outside_the_window(matcher):
+    index = InMemoryWindowIndex()
+    incremental = IncrementalTransferMatcher(index, matcher)
+    asyncio.run(incremental.process('user-1', TransactionFrame.from_rows([_transfer('w1', 'WITHDRAWAL', '1.0', 0)])))
+    # Un movimiento posterior del mismo asset hace caducar la retirada...
+    asyncio.run(incremental.process('user-1', TransactionFrame.from_rows([_transfer('w2', 'WITHDRAWAL', '3.0', 500)])))
+    assert asyncio.run(index.candidates('user-1', 'BTC', 'out', 0, 90_000_000)) == []
+    # ...y un depósito que llega tarde ya no la encuentra
+    matches = asyncio.run(incremental.process('user-1', TransactionFrame.from_rows([_transfer('d1', 'DEPOSIT', '1.0', 5)])))
+    assert len(matches) == 0
+
+# Retirada y dos depósitos posibles, importados a la base de datos sin emparejar
+TRANSFERS_BACKUP = (
+    '"Type","Buy","Cur.","Sell","Cur.","Fee","Cur.","Exchange","Group","Comment","Date"\n'
+    '"Withdrawal","","","1.5","BTC","","","Kraken","","","01.03.2023 10:00:00"\n'
+    '"Deposit","1.5","BTC","","","","","Binance","","","01.03.2023 10:00:10"\n'
+    '"Deposit","1.5","BTC","","","","","Bitstamp","","","01.03.2023 10:00:20"\n'
+).encode('utf-8')
+
+def _stored_transfers(user_id):
+    from core.ingestion_service.cointracking_parser import CointrackingBackupParser
+    parser = CointrackingBackupParser(user_id=user_id)
+    return [row for batch in parser.iter_csv_batches(io.BytesIO(TRANSFERS_BACKUP)) for row in batch.to_dicts()]
+
+async def _load(session, user_id, rows):
+    from core.ingestion_service.bulk_loader import CanonicalTransactionLoader
+    from core.ingestion_service.models import CANONICAL_COLUMNS, CanonicalBatch
+    frame = pd.DataFrame(rows, columns=list(CANONICAL_COLUMNS))
+    await CanonicalTransactionLoader(session).load(user_id, [CanonicalBatch(frame=frame, source_rows=[], rows_read=0)])
+
+async def _kontorl_types(session):
+    from sqlalchemy import text
+    result = await session.execute(text(
+        "SELECT kontorl_type, metadata->>'transfer_match' FROM canonical_transactions ORDER BY timestamp_utc"
+    ))
+    return result.all()
+
+def test_incremental_service_seeds_the_index_from_the_database(database, matcher):
+    from core.matching_engine.service import MatchingEngineService
+
+    async def scenario(sessions):
+        withdrawal, deposit, _ = rows = _stored_transfers(database.user_id)
+        async with sessions() as session:
+            await _load(session, database.user_id, rows[:2])
+            index = InMemoryWindowIndex()
+            # El índice está vacío: la retirada sale de la base de datos
+            result = await MatchingEngineService(session, matcher, index).match_new_transactions(database.user_id, [deposit])
+            return result, await index.get_coverage(database.user_id), await _kontorl_types(session), withdrawal, deposit
+
+    result, coverage, stored, withdrawal, deposit = database.run(scenario)
+    assert (result.matches, result.updated) == (1, 2)
+    assert coverage is not None
+    assert stored == [
+        ('INTERNAL_TRANSFER_OUT', deposit['tx_id_kontrol']), ('INTERNAL_TRANSFER_IN', withdrawal['tx_id_kontrol'])
+    ]
+
+def test_stale_process_index_cannot_match_a_withdrawal_twice(database, matcher):
+    from core.matching_engine.service import MatchingEngineService
+
+    async def scenario(sessions):
+        withdrawal, first, second = _stored_transfers(database.user_id)
+        async with sessions() as session:
+            # Dos procesos con su propio índice en memoria
+            index_a, index_b = InMemoryWindowIndex(), InMemoryWindowIndex()
+            await _load(session, database.user_id, [withdrawal])
+            await MatchingEngineService(session, matcher, index_a).match_new_transactions(database.user_id, [withdrawal])
+
+            await _load(session, database.user_id, [first])
+            matched = await MatchingEngineService(session, matcher, index_b).match_new_transactions(database.user_id, [first])
+
+            # El proceso A aún tiene la retirada como pendiente
+            await _load(session, database.user_id, [second])
+            stale = await MatchingEngineService(session, matcher, index_a).match_new_transactions(database.user_id, [second])
+            return matched, stale, await index_a.get_coverage(database.user_id), await _kontorl_types(session), withdrawal, first
+
+    matched, stale, coverage, stored, withdrawal, first = database.run(scenario)
+    assert matched.matches == 1
+    assert (stale.matches, stale.updated) == (0, 0)
+    # El índice desfasado se descarta y se recargará de la base de datos
+    assert coverage is None
+    assert stored == [
+        ('INTERNAL_TRANSFER_OUT', first['tx_id_kontrol']),
+        ('INTERNAL_TRANSFER_IN', withdrawal['tx_id_kontrol']),
+        ('DEPOSIT', None),
+    ]
@@ -0,0 +1,78 @@
+"""
+Tests del traslado de metadatos históricos de Cointracking a la sincronización automática
+"""
+
+import io
+from datetime import datetime, timezone
+from decimal import Decimal
+
+from sqlalchemy import text
+
+from core.ingestion_service.cointracking_parser import CointrackingBackupParser
+from core.ingestion_service.metadata_sync import NOTE_KEY, MetadataSync, _merge_annotations
+from core.ingestion_service.models import TransactionAnnotation, WalletLabel
+
+WHEN = datetime(2023, 3, 15, 10, 20, 30, tzinfo=timezone.utc)
+
+def _annotation(categories=(), note=None, amount='0.5'):
+    return TransactionAnnotation(WHEN, 'BTC', Decimal(amount), 'EUR', Decimal('15000'), list(categories), note)
+
+def test_annotations_of_the_same_transaction_are_merged():
+    categories, notes = _merge_annotations([
+        _annotation(['Hodl'], 'primera'),
+        _annotation(['Largo plazo', 'Hodl']),
+        _annotation(note='segunda'),
+        _annotation(['Otra'], amount='1'),
+    ])
+    key = _annotation().key
+    # Categorías unidas en orden de aparición; gana la última nota
+    assert categories == {key: ['Hodl', 'Largo plazo'], _annotation(amount='1').key: ['Otra']}
+    assert notes == {key: 'segunda'}
+
+def test_annotations_without_content_are_skipped():
+    assert _merge_annotations([_annotation(), _annotation([], '')]) == ({}, {})
+
+# La misma compra anotada dos veces en el backup (grupo y comentario)
+BACKUP = (
+    '"Type","Buy","Cur.","Sell","Cur.","Fee","Cur.","Exchange","Group","Comment","Date"\n'
+    '"Trade","0.5","BTC","15000","EUR","","","Kraken","Hodl","regalo","15.03.2023 10:20:30"\n'
+    '"Trade","0.5","BTC","15000","EUR","","","Kraken","Largo plazo","","15.03.2023 10:20:30"\n'
+).encode('utf-8')
+
+_SYNCED = """
+INSERT INTO canonical_transactions
+    (user_id, tx_id_kontrol, timestamp_utc, tx_type, kontorl_type, asset_in, amount_in, asset_out, amount_out, tags, metadata)
+VALUES
+    (:user_id, 'kraken_api:1', :when, 'BUY', 'TRADE', 'BTC', 0.5, 'EUR', 15000, '["staking"]', '{"source": "kraken_api"}')
+"""
+
+_WALLETS = """
+INSERT INTO wallet_addresses (user_id, address, label, blockchain)
+VALUES (:user_id, '0xabc', NULL, 'ethereum'), (:user_id, '0xdef', 'Mía', 'ethereum')
+"""
+
+def test_historical_metadata_reaches_the_synced_transactions(database):
+    data = CointrackingBackupParser().parse_csv_backup(io.BytesIO(BACKUP))
+    metadata = CointrackingBackupParser().extract_critical_metadata(data)
+    metadata.wallet_labels.extend([WalletLabel('0xABC', 'Ledger'), WalletLabel('0xdef', 'Antigua', 'ethereum')])
+
+    async def scenario(sessions):
+        async with sessions() as session:
+            await session.execute(text(_SYNCED), {'user_id': database.user_id, 'when': WHEN})
+            await session.execute(text(_WALLETS), {'user_id': database.user_id})
+            await session.commit()
+
+            first = await MetadataSync(session).enrich_automated_sync(database.user_id, metadata)
+            again = await MetadataSync(session).enrich_automated_sync(database.user_id, metadata)
+            synced = (await session.execute(text("SELECT tags, metadata FROM canonical_transactions"))).one()
+            wallets = (await session.execute(text("SELECT address, label FROM wallet_addresses ORDER BY address"))).all()
+            return first, again, synced, wallets
+
+    first, again, (tags, synced_metadata), wallets = database.run(scenario)
+    assert (first.wallet_labels, first.categories, first.notes) == (1, 1, 1)
+    # Repetirlo no reescribe nada
+    assert (again.wallet_labels, again.categories, again.notes) == (0, 0, 0)
+    assert sorted(tags) == ['Hodl', 'Largo plazo', 'staking']
+    assert synced_metadata == {'source': 'kraken_api', NOTE_KEY: 'regalo'}
+    # Las etiquetas puestas en KONTROL mandan
+    assert wallets == [('0xabc', 'Ledger'), ('0xdef', 'Mía')]
@@ -0,0 +1,61 @@
+"""
+Tests de la normalización de exchanges y activos
+"""
+
+import pytest
+
+from core.ingestion_service.normalization import (
+    ASSET_ALIASES, EXCHANGE_ALIASES, RESOLVE_CACHE_SIZE, NormalizationIndex, _merge_aliases
+)
+
+@pytest.fixture
+def index():
+    return NormalizationIndex(EXCHANGE_ALIASES, ASSET_ALIASES)
+
+@pytest.mark.parametrize('label, expected', [
+    ('Binance', 'binance'),
+    ('  BINANCE.com ', 'binance'),
+    ('Binance (API)', 'binance'),
+    ('Binance Futures (API)', 'binance'),
+    ('Kraken Margin 2', 'kraken'),
+    ('Bybit 3', 'bybit'),
+    ('Coinbase Pro', 'coinbase'),
+    ('Coinbase Pro (CSV)', 'coinbase'),
+    ('GDAX', 'coinbase'),
+])
+def test_exchange_accounts_resolve_to_the_exchange(index, label, expected):
+    assert index.exchanges.resolve(label) == expected
+
+@pytest.mark.parametrize('label, expected', [
+    ('Binance.US', 'binance.us'),
+    ('FTX.US', 'ftx.us'),
+    ('Coinbase Wallet', 'coinbase wallet'),
+    ('OKX Wallet', 'okx wallet'),
+    ('Binance DEX', 'binance dex'),
+    ('Krakenfx', 'krakenfx'),
+])
+def test_other_platforms_are_not_folded_into_an_exchange(index, label, expected):
+    assert index.exchanges.resolve(label) == expected
+
+def test_listed_aliases_still_resolve():
+    index = NormalizationIndex({**EXCHANGE_ALIASES, 'binance': ('binance.us',)}, ASSET_ALIASES)
+    assert index.exchanges.resolve('Binance.US (API)') == 'binance'
+
+def test_asset_tickers(index):
+    assert index.assets.resolve('xbt') == 'BTC'
+    assert index.assets.resolve('XBT.M') == 'BTC'
+    assert index.assets.resolve('BTC 2') == 'BTC 2'
+    assert index.assets.resolve('') is None
+
+def test_staking_derivatives_are_separate_assets(index):
+    assert index.assets.resolve('ETH2') == 'ETH2'
+    assert index.assets.resolve('eth2.s') == 'ETH2.S'
+    # Se pueden unir con un alias explícito (NORMALIZATION_ALIASES_PATH)
+    merged = NormalizationIndex(EXCHANGE_ALIASES, _merge_aliases(ASSET_ALIASES, {'ETH': ['ETH2', 'ETH2.S']}))
+    assert merged.assets.resolve('ETH2.S') == 'ETH'
+
+def test_resolved_values_cache_is_bounded(index):
+    for number in range(RESOLVE_CACHE_SIZE + 100):
+        assert index.exchanges.resolve(f'Wallet {number}') == f'wallet {number}'
+    assert index.exchanges._resolve_cached.cache_info().currsize == RESOLVE_CACHE_SIZE
+    assert index.exchanges.resolve('Binance (API)') == 'binance'
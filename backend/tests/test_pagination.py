@@ -0,0 +1,92 @@
+"""
+Tests de la paginación keyset: cursores opacos y condición de seek
+"""
+
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, create_engine, select
+
+from utils.pagination import (
+    InvalidCursorError, build_page, decode_cursor, encode_cursor, keyset_condition, paginate_query,
+    postgrest_keyset_filter
+)
+
+def test_cursor_round_trip():
+    moment = datetime(2024, 3, 1, 12, 30)
+    row_id = uuid.UUID('00000000-0000-4000-8000-00000000002a')
+    cursor = encode_cursor([moment, row_id])
+    assert '=' not in cursor
+    assert decode_cursor(cursor, 2) == [moment.isoformat(sep=' '), str(row_id)]
+
+@pytest.mark.parametrize('cursor', ['%%%', encode_cursor(['a']), encode_cursor(['a', None]), 'eyJhIjoxfQ'])
+def test_invalid_cursors_are_rejected(cursor):
+    with pytest.raises(InvalidCursorError):
+        decode_cursor(cursor, 2)
+
+events = Table(
+    'events', MetaData(),
+    Column('id', Integer, primary_key=True),
+    Column('at', DateTime, nullable=False),
+    Column('label', String),
+)
+
+@pytest.fixture
+def connection():
+    engine = create_engine('sqlite://')
+    events.metadata.create_all(engine)
+    start = datetime(2024, 1, 1)
+    with engine.connect() as connection:
+        # Empates en la primera columna: sólo el id separa las filas
+        connection.execute(events.insert(), [
+            {'id': row_id, 'at': start + timedelta(minutes=row_id % 4), 'label': f'e{row_id}'}
+            for row_id in range(1, 24)
+        ])
+        yield connection
+
+def _walk(connection, descending, limit):
+    columns = [events.c.at, events.c.id]
+    seen, cursor = [], None
+    while True:
+        rows = connection.execute(paginate_query(select(events), columns, cursor, limit, descending)).mappings().all()
+        page = build_page([dict(row) for row in rows], ['at', 'id'], limit)
+        seen.extend(row['id'] for row in page.items)
+        if not page.has_more:
+            return seen
+        cursor = page.next_cursor
+
+@pytest.mark.parametrize('descending', [False, True])
+@pytest.mark.parametrize('limit', [1, 4, 7, 23, 50])
+def test_pages_cover_every_row_once_in_order(connection, descending, limit):
+    everything = connection.execute(select(events.c.at, events.c.id)).all()
+    expected = [row_id for _, row_id in sorted(everything, reverse=descending)]
+    assert _walk(connection, descending, limit) == expected
+
+def test_keyset_condition_bounds_the_first_column(connection):
+    condition = keyset_condition([events.c.at, events.c.id], [datetime(2024, 1, 1, 0, 2), 10])
+    sql = str(condition.compile(compile_kwargs={'literal_binds': True}))
+    assert sql.startswith('events.at >=')
+    ids = connection.execute(select(events.c.id).where(condition)).scalars().all()
+    assert sorted(ids) == sorted(
+        row_id for row_id in range(1, 24) if (row_id % 4, row_id) > (2, 10)
+    )
+
+def test_cursor_values_are_coerced_to_the_column_type():
+    with pytest.raises(InvalidCursorError):
+        paginate_query(select(events), [events.c.at, events.c.id], encode_cursor(['yesterday', 1]), 5)
+
+def test_last_page_has_no_cursor():
+    assert build_page([{'id': 1}], ['id'], 2).next_cursor is None
+    page = build_page([{'id': 1}, {'id': 2}, {'id': 3}], ['id'], 2)
+    assert [item['id'] for item in page.items] == [1, 2]
+    assert decode_cursor(page.next_cursor, 1) == ['2']
+
+def test_postgrest_filter_matches_the_keyset_condition():
+    assert postgrest_keyset_filter(['timestamp_utc', 'id'], ['2024-01-01T00:00:00+00:00', 'a"b']) == (
+        'timestamp_utc.gt."2024-01-01T00:00:00+00:00",'
+        'and(timestamp_utc.eq."2024-01-01T00:00:00+00:00",id.gt."a\\"b")'
+    )
+    assert postgrest_keyset_filter(['timestamp_utc', 'id'], ['t', 'i'], descending=True) == (
+        'timestamp_utc.lt."t",and(timestamp_utc.eq."t",id.lt."i")'
+    )
@@ -0,0 +1,84 @@
+"""
+Tests de la caché de reportes fiscales: claves por digest y reutilización de tax_reports
+"""
+
+import io
+from collections import namedtuple
+from decimal import Decimal
+
+from sqlalchemy import text
+
+from core.tax_engine.report_cache import compute_cache_key, compute_cache_keys
+from core.tax_engine.tax_calculator import TaxCalculator
+
+Digest = namedtuple('Digest', 'year digest row_count')
+
+DIGESTS = [Digest(2023, 11, 3), Digest(2024, -5, 2)]
+
+def test_cache_key_depends_on_every_input():
+    key = compute_cache_key(DIGESTS, 'FIFO', 'ES', 'r1')
+    assert len(key) == 64
+    assert compute_cache_key(list(reversed(DIGESTS)), 'FIFO', 'ES', 'r1') == key
+    assert compute_cache_key([Digest(2023, 12, 3), DIGESTS[1]], 'FIFO', 'ES', 'r1') != key
+    assert compute_cache_key(DIGESTS, 'LIFO', 'ES', 'r1') != key
+    assert compute_cache_key(DIGESTS, 'FIFO', 'DE', 'r1') != key
+    assert compute_cache_key(DIGESTS, 'FIFO', 'ES', 'r2') != key
+
+def test_cache_key_ignores_years_without_rows():
+    # Borrar y volver a insertar deja el año a 0 filas: la clave no cambia
+    emptied = DIGESTS + [Digest(2022, 0, 0)]
+    assert compute_cache_key(emptied, 'FIFO', 'ES', 'r1') == compute_cache_key(DIGESTS, 'FIFO', 'ES', 'r1')
+    assert compute_cache_keys(DIGESTS, ['FIFO', 'HIFO'], 'ES', 'r1') == {
+        'FIFO': compute_cache_key(DIGESTS, 'FIFO', 'ES', 'r1'),
+        'HIFO': compute_cache_key(DIGESTS, 'HIFO', 'ES', 'r1'),
+    }
+
+# Compra en 2023 y venta en 2024
+BACKUP = (
+    '"Type","Buy","Cur.","Sell","Cur.","Fee","Cur.","Exchange","Group","Comment","Date"\n'
+    '"Trade","1","BTC","20000","EUR","","","Kraken","","","01.03.2023 10:00:00"\n'
+    '"Trade","30000","EUR","1","BTC","","","Kraken","","","01.03.2024 10:00:00"\n'
+).encode('utf-8')
+
+class CountingCalculator(TaxCalculator):
+    """Registra los métodos que se recalculan"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.calculated = []
+
+    async def calculate_all_methods(self, year, methods):
+        self.calculated.append(list(methods))
+        return await super().calculate_all_methods(year, methods)
+
+def test_reports_are_served_from_the_cache_until_the_history_changes(database):
+    async def scenario(sessions):
+        from core.ingestion_service.bulk_loader import CanonicalTransactionLoader
+        from core.ingestion_service.cointracking_parser import CointrackingBackupParser
+
+        async with sessions() as session:
+            batches = CointrackingBackupParser(user_id=database.user_id).iter_csv_batches(io.BytesIO(BACKUP))
+            await CanonicalTransactionLoader(session).load(database.user_id, list(batches))
+            calculator = CountingCalculator(database.user_id, 'ES', session=session)
+
+            generated = await calculator.get_reports(2024, ['FIFO', 'LIFO'])
+            keys = await calculator.current_cache_keys(2024, ['FIFO', 'LIFO'])
+            stored = dict((await session.execute(text("SELECT method, cache_key FROM tax_reports"))).all())
+            cached = await calculator.get_reports(2024, ['FIFO', 'LIFO'])
+
+            await session.execute(text(
+                "UPDATE canonical_transactions SET fiat_cost_basis_unit = 25000 WHERE tx_type = 'BUY'"
+            ))
+            await session.commit()
+            edited_keys = await calculator.current_cache_keys(2024, ['FIFO', 'LIFO'])
+            recalculated = await calculator.get_reports(2024, ['FIFO'])
+            return generated, keys, stored, cached, edited_keys, recalculated, calculator.calculated
+
+    generated, keys, stored, cached, edited_keys, recalculated, calculated = database.run(scenario)
+    assert stored == keys
+    assert cached == generated
+    # La edición cambia el digest de 2023 y, con él, las claves de 2024
+    assert edited_keys['FIFO'] != keys['FIFO'] and edited_keys['LIFO'] != keys['LIFO']
+    assert calculated == [['FIFO', 'LIFO'], ['FIFO']]
+    assert Decimal(generated['FIFO']['total_realized_gain']) == 10000
+    assert Decimal(recalculated['FIFO']['total_realized_gain']) == 5000
@@ -0,0 +1,163 @@
+"""
+Tests de las lecturas en streaming: cursores de servidor (SQLAlchemy) y páginas keyset (Supabase)
+"""
+
+import asyncio
+import io
+import re
+from datetime import date, datetime, timezone
+
+import pytest
+from sqlalchemy import text
+
+# Depósitos y retiradas con instantes repetidos: el id desempata el orden
+BACKUP = (
+    '"Type","Buy","Cur.","Sell","Cur.","Fee","Cur.","Exchange","Group","Comment","Date"\n'
+    + ''.join(
+        f'"Deposit","{amount}","BTC","","","","","Kraken","","","01.03.2023 10:00:0{amount % 3}"\n'
+        for amount in range(1, 8)
+    )
+    + '"Withdrawal","","","1","BTC","","","Kraken","","","01.03.2023 10:00:00"\n'
+    + '"Withdrawal","","","2","BTC","","","Kraken","","","02.03.2023 10:00:00"\n'
+).encode('utf-8')
+
+START = datetime(2023, 1, 1, tzinfo=timezone.utc)
+END = datetime(2023, 12, 31, tzinfo=timezone.utc)
+
+async def _collect(batches):
+    return [batch async for batch in batches]
+
+def _order(rows):
+    return [(row.timestamp_utc, row.id) for row in rows]
+
+def test_repository_streams_come_in_bounded_chronological_batches(database):
+    async def scenario(sessions):
+        from core.ingestion_service.bulk_loader import CanonicalTransactionLoader
+        from core.ingestion_service.cointracking_parser import CointrackingBackupParser
+        from utils.database import TransactionRepository
+
+        async with sessions() as session:
+            batches = CointrackingBackupParser(user_id=database.user_id).iter_csv_batches(io.BytesIO(BACKUP))
+            await CanonicalTransactionLoader(session).load(database.user_id, list(batches))
+            repository = TransactionRepository(session)
+            by_range = await _collect(repository.stream_by_date_range(database.user_id, START, END, batch_size=3))
+            deposits = await _collect(repository.stream_by_kontorl_type(database.user_id, 'DEPOSIT', batch_size=2))
+            return by_range, deposits, await repository.get_by_date_range(database.user_id, START, END)
+
+    by_range, deposits, everything = database.run(scenario)
+    assert [len(batch) for batch in by_range] == [3, 3, 3]
+    streamed = [row for batch in by_range for row in batch]
+    assert _order(streamed) == sorted(_order(streamed))
+    # get_by_date_range devuelve los escalares de la select de tabla: los ids
+    assert {row.id for row in streamed} == set(everything)
+    assert [len(batch) for batch in deposits] == [2, 2, 2, 1]
+    deposits = [row for batch in deposits for row in batch]
+    assert {row.kontorl_type for row in deposits} == {'DEPOSIT'}
+    assert _order(deposits) == sorted(_order(deposits))
+
+def test_portfolio_stream_is_ordered_by_date(database):
+    async def scenario(sessions):
+        from utils.database import PortfolioRepository
+
+        async with sessions() as session:
+            for day, asset in [(5, 'BTC'), (1, 'BTC'), (3, 'ETH'), (4, 'BTC'), (2, 'BTC')]:
+                await session.execute(text("""
+                    INSERT INTO portfolio_snapshots
+                        (user_id, date, asset, amount, value_usd, cost_basis_usd, unrealized_pnl, unrealized_pnl_percent)
+                    VALUES (:user_id, :day, :asset, 1, 1, 1, 0, 0)
+                """), {'user_id': database.user_id, 'day': date(2024, 1, day), 'asset': asset})
+            await session.commit()
+            return await _collect(PortfolioRepository(session).stream_by_asset(database.user_id, 'BTC', batch_size=3))
+
+    batches = database.run(scenario)
+    assert [[snapshot.date.day for snapshot in batch] for batch in batches] == [[1, 2, 4], [5]]
+
+class _Response:
+    def __init__(self, data):
+        self.data = data
+
+class _Query:
+    """Subconjunto del builder de supabase-py sobre una lista en memoria"""
+
+    _TERM = re.compile(r'(\w+)\.(gt|lt)\."((?:[^"\\]|\\.)*)"')
+
+    def __init__(self, rows, pages):
+        self.rows, self.pages = rows, pages
+        self.filters, self.ordering, self.count = [], [], None
+
+    def select(self, columns):
+        return self
+
+    def eq(self, key, value):
+        self.filters.append(lambda row: row[key] == value)
+        return self
+
+    def gte(self, key, value):
+        self.filters.append(lambda row: row[key] >= value)
+        return self
+
+    def lte(self, key, value):
+        self.filters.append(lambda row: row[key] <= value)
+        return self
+
+    def or_(self, expression):
+        # Los términos estrictos de postgrest_keyset_filter dan la clave completa
+        terms = self._TERM.findall(expression)
+        keys = [key for key, _, _ in terms]
+        values = tuple(value for _, _, value in terms)
+        if terms[0][1] == 'lt':
+            self.filters.append(lambda row: tuple(row[key] for key in keys) < values)
+        else:
+            self.filters.append(lambda row: tuple(row[key] for key in keys) > values)
+        return self
+
+    def order(self, key, desc=False):
+        self.ordering.append((key, desc))
+        return self
+
+    def limit(self, count):
+        self.count = count
+        return self
+
+    def execute(self):
+        rows = [row for row in self.rows if all(condition(row) for condition in self.filters)]
+        for key, desc in reversed(self.ordering):
+            rows.sort(key=lambda row: row[key], reverse=desc)
+        self.pages.append(len(rows[:self.count]))
+        return _Response(rows[:self.count])
+
+class _Client:
+    def __init__(self, rows):
+        self.rows, self.pages = rows, []
+
+    def table(self, name):
+        return _Query(self.rows, self.pages)
+
+ROWS = [
+    {'id': f'{index:02d}', 'user_id': 'user-1' if index % 5 else 'user-2',
+     'timestamp_utc': f'2023-03-{1 + index // 3:02d}T10:00:00+00:00'}
+    for index in range(20)
+]
+
+def test_supabase_pages_walk_the_whole_range(monkeypatch):
+    pytest.importorskip('supabase')
+    import utils.supabase as supabase_module
+
+    client = _Client(ROWS)
+    monkeypatch.setattr(supabase_module, 'supabase', client)
+    service = supabase_module.TransactionSupabaseService()
+
+    async def collect():
+        return [page async for page in service.iter_by_date_range(
+            'user-1', '2023-03-02T00:00:00+00:00', '2023-03-06T23:59:59+00:00', batch_size=4
+        )]
+
+    pages = asyncio.run(collect())
+    expected = sorted(
+        (row for row in ROWS if row['user_id'] == 'user-1' and '2023-03-02' <= row['timestamp_utc'] < '2023-03-07'),
+        key=lambda row: (row['timestamp_utc'], row['id'])
+    )
+    assert [row['id'] for page in pages for row in page] == [row['id'] for row in expected]
+    assert [len(page) for page in pages] == [4, 4, 4]
+    # Cada consulta pide una fila de más para saber si hay otra página
+    assert client.pages == [5, 5, 4]
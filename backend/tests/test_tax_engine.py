@@ -0,0 +1,286 @@
+"""
+Tests del motor fiscal: aritmética de punto fijo e inventarios de lotes frente a una referencia Decimal
+"""
+
+import random
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+
+import pytest
+
+from core.tax_engine.fixed_point import (
+    ROUNDING_MODES, SCALE, format_scaled, from_scaled, gain_components, round_div, to_scaled
+)
+from core.tax_engine.lots import create_inventory
+from core.tax_engine.models import DECIMAL_CONTEXT as EXACT
+from core.tax_engine.models import Lot, TaxReport, Transaction, quantize
+from core.tax_engine.tax_calculator import TaxCalculator
+
+QUANTUM = Decimal('1E-18')
+
+@pytest.mark.parametrize('rounding', ROUNDING_MODES)
+def test_round_div_matches_decimal(rounding):
+    rng = random.Random(rounding)
+    for _ in range(2000):
+        numerator = rng.randint(-10 ** 40, 10 ** 40)
+        denominator = rng.choice([rng.randint(1, 10 ** 20), -rng.randint(1, 10 ** 20), 2, -2, 10])
+        expected = EXACT.divide(Decimal(numerator), Decimal(denominator)).quantize(Decimal(1), rounding=rounding, context=EXACT)
+        assert round_div(numerator, denominator, rounding) == int(expected)
+
+@pytest.mark.parametrize('rounding', ROUNDING_MODES)
+def test_to_scaled_rounds_like_a_decimal_column(rounding):
+    rng = random.Random(rounding + 'scaled')
+    for _ in range(1000):
+        value = Decimal(rng.randint(-10 ** 30, 10 ** 30)).scaleb(-rng.randint(0, 30), EXACT)
+        assert from_scaled(to_scaled(value, rounding)) == value.quantize(QUANTUM, rounding=rounding, context=EXACT)
+
+def test_scaled_text_round_trip():
+    for value in ('0', '-0.000000000000000001', '123.45', '-98765432109876543210.5'):
+        scaled = to_scaled(Decimal(value))
+        assert Decimal(format_scaled(scaled)) == Decimal(value)
+        assert to_scaled(format_scaled(scaled)) == scaled
+    assert to_scaled(7) == 7 * SCALE
+    assert to_scaled(None) == 0
+
+def _reference_components(quantity, unit_cost, unit_price, fee, amount, rounding):
+    cost = quantize(EXACT.multiply(quantity, unit_cost), rounding)
+    gross = EXACT.multiply(quantity, unit_price)
+    if fee and amount:
+        gross = EXACT.subtract(gross, EXACT.divide(EXACT.multiply(fee, quantity), amount))
+    return cost, quantize(gross, rounding)
+
+@pytest.mark.parametrize('rounding', ROUNDING_MODES)
+def test_gain_components_match_decimal(rounding):
+    rng = random.Random(rounding + 'gain')
+
+    def value(integer_digits):
+        return Decimal(rng.randint(0, 10 ** (integer_digits + 18))).scaleb(-18, EXACT)
+
+    for _ in range(1000):
+        amount = value(4) or Decimal(1)
+        quantity = min(value(4), amount)
+        unit_cost, unit_price, fee = value(6), value(6), rng.choice([Decimal(0), value(2)])
+        components = gain_components(
+            to_scaled(quantity), to_scaled(unit_cost), to_scaled(unit_price), to_scaled(fee), to_scaled(amount), rounding
+        )
+        assert components is not None
+        cost, proceeds = _reference_components(quantity, unit_cost, unit_price, fee, amount, rounding)
+        assert components == (to_scaled(cost), to_scaled(proceeds))
+
+def _history(count, seed):
+    rng = random.Random(seed)
+    timestamp = datetime(2023, 1, 1, tzinfo=timezone.utc)
+    transactions = []
+    for index in range(count):
+        timestamp += timedelta(hours=rng.randint(1, 48))
+        asset = rng.choice(['BTC', 'ETH'])
+        amount = Decimal(rng.randint(1, 10 ** 8)).scaleb(-6)
+        price = Decimal(rng.randint(10 ** 6, 6 * 10 ** 10)).scaleb(-6)
+        if rng.random() < 0.55:
+            transactions.append(Transaction(f'b{index}', timestamp, 'BUY', asset, to_scaled(amount), to_scaled(price)))
+        else:
+            fee = Decimal(rng.randint(0, 10 ** 4)).scaleb(-3)
+            transactions.append(Transaction(f's{index}', timestamp, 'SELL', asset, to_scaled(amount), to_scaled(price), to_scaled(fee)))
+    return transactions
+
+def _reference_gains(transactions, method):
+    """FIFO/LIFO/HIFO con listas de Decimal, sin nada del motor"""
+    lots = {}
+    gains = []
+    for tx in transactions:
+        amount, price, fee = from_scaled(tx.amount), from_scaled(tx.unit_price), from_scaled(tx.fee)
+        if tx.tx_type == 'BUY':
+            lots.setdefault(tx.asset, []).append([tx.tx_id, amount, price])
+            continue
+        open_lots = lots.get(tx.asset, [])
+        remaining = amount
+        while remaining > 0 and open_lots:
+            if method == 'FIFO':
+                lot = open_lots[0]
+            elif method == 'LIFO':
+                lot = open_lots[-1]
+            else:
+                # Coste unitario más alto; a igualdad, el más antiguo
+                lot = max(open_lots, key=lambda candidate: (candidate[2], -open_lots.index(candidate)))
+            quantity = min(lot[1], remaining)
+            lot[1] -= quantity
+            remaining -= quantity
+            if not lot[1]:
+                open_lots.remove(lot)
+            gains.append((lot[0], tx.tx_id, quantity) + _reference_components(quantity, lot[2], price, fee, amount, 'ROUND_HALF_EVEN'))
+        if remaining > 0:
+            gains.append((None, tx.tx_id, remaining) + _reference_components(remaining, Decimal(0), price, fee, amount, 'ROUND_HALF_EVEN'))
+    return gains
+
+@pytest.mark.parametrize('method', ['FIFO', 'LIFO', 'HIFO'])
+@pytest.mark.parametrize('seed', [1, 2])
+def test_lot_engines_match_decimal_reference(method, seed):
+    transactions = _history(400, seed)
+    report = TaxReport(method=method, year=None)
+    TaxCalculator('user-1', 'ES').run_lot_engines(transactions, {method: (create_inventory(method), report)})
+    engine = [
+        (gain.lot_id, gain.sell_tx_id, from_scaled(gain.quantity), from_scaled(gain.cost_basis), from_scaled(gain.proceeds))
+        for gain in report.realized_gains
+    ]
+    assert engine == _reference_gains(transactions, method)
+
+def test_partial_lot_consumption():
+    inventory = create_inventory('FIFO')
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    inventory.add_lot(Lot('b0', 'BTC', start, to_scaled(Decimal('1')), SCALE))
+    inventory.add_lot(Lot('b1', 'BTC', start, to_scaled(Decimal('2')), SCALE))
+    consumed, uncovered = inventory.consume('BTC', to_scaled(Decimal('1.5')))
+    assert [(lot.lot_id, from_scaled(quantity)) for lot, quantity in consumed] == [('b0', 1), ('b1', Decimal('0.5'))]
+    assert uncovered == 0
+    assert inventory.balance('BTC') == Decimal('1.5')
+
+def _canonical(tx_id, tx_type, day, asset_in=None, amount_in=None, asset_out=None, amount_out=None,
+               unit_cost=None, rate=None, fee=None, fee_asset=None):
+    return {
+        'tx_id_kontrol': tx_id,
+        'timestamp_utc': datetime(2024, 1, day, tzinfo=timezone.utc),
+        'tx_type': tx_type,
+        'kontorl_type': 'EXCHANGE' if tx_type == 'SELL' and asset_in else 'TRADE',
+        'asset_in': asset_in,
+        'amount_in': Decimal(amount_in) if amount_in else None,
+        'asset_out': asset_out,
+        'amount_out': Decimal(amount_out) if amount_out else None,
+        'fiat_cost_basis_unit': Decimal(unit_cost) if unit_cost else None,
+        'exchange_rate': Decimal(rate) if rate else None,
+        'fees': Decimal(fee) if fee else Decimal('0'),
+        'metadata': {'fee_asset': fee_asset} if fee_asset else {},
+    }
+
+# 1 BTC a 20000; permuta de 0.5 BTC por 10 ETH (BTC a 30000); venta de los 10 ETH a 2000
+SWAP_HISTORY = [
+    _canonical('buy', 'BUY', 1, asset_in='BTC', amount_in='1', asset_out='EUR', amount_out='20000', unit_cost='20000'),
+    _canonical('swap', 'SELL', 2, asset_in='ETH', amount_in='10', asset_out='BTC', amount_out='0.5', rate='30000'),
+    _canonical('sell', 'SELL', 3, asset_in='EUR', amount_in='20000', asset_out='ETH', amount_out='10', rate='2000'),
+]
+
+def _events(rows):
+    from core.transaction_frame import TransactionFrame
+    frame_events = TransactionFrame.from_rows(rows).to_tax_transactions()
+    assert frame_events == [event for row in rows for event in Transaction.from_canonical(row)]
+    return frame_events
+
+def test_crypto_swap_opens_a_lot_for_the_received_asset():
+    events = _events(SWAP_HISTORY)
+    assert [(event.tx_id, event.tx_type, event.asset) for event in events] == [
+        ('buy', 'BUY', 'BTC'), ('swap', 'SELL', 'BTC'), ('swap', 'BUY', 'ETH'), ('sell', 'SELL', 'ETH')
+    ]
+    # Valor fiat de lo entregado (0.5 * 30000) entre lo recibido
+    assert events[2].unit_price == to_scaled(Decimal('1500'))
+
+    report = TaxReport(method='FIFO')
+    TaxCalculator('user-1', 'ES').run_lot_engines(events, {'FIFO': (create_inventory('FIFO'), report)})
+    assert report.warnings == []
+    assert [(gain.lot_id, from_scaled(gain.gain)) for gain in report.realized_gains] == [
+        ('buy', Decimal('5000')), ('swap', Decimal('5000'))
+    ]
+
+def test_swap_uses_the_recorded_cost_of_the_received_asset():
+    row = _canonical('swap', 'SELL', 2, asset_in='ETH', amount_in='10', asset_out='BTC', amount_out='0.5',
+                     unit_cost='1400', rate='30000')
+    assert _events([row])[1].unit_price == to_scaled(Decimal('1400'))
+
+def test_fiat_sale_opens_no_lot():
+    assert [event.tx_type for event in _events(SWAP_HISTORY[2:])] == ['SELL']
+
+@pytest.mark.parametrize('fee_asset, expected', [
+    (None, '12'),     # Sin divisa: ya en fiat
+    ('EUR', '12'),
+    ('BTC', '360000'),  # Asset entregado, a exchange_rate
+    ('ETH', '18000'),   # Asset recibido, a su coste (1500)
+    ('BNB', '0'),     # Sin precio en la operación: se ignora
+])
+def test_fees_are_converted_to_fiat(fee_asset, expected):
+    row = _canonical('swap', 'SELL', 2, asset_in='ETH', amount_in='10', asset_out='BTC', amount_out='0.5',
+                     rate='30000', fee='12', fee_asset=fee_asset)
+    sell, buy = _events([row])
+    assert sell.fee == to_scaled(Decimal(expected))
+    assert buy.fee == 0
+
+# Compras en 2022 y 2023, venta parcial en 2023 y venta en 2024
+HISTORY_BACKUP = (
+    '"Type","Buy","Cur.","Sell","Cur.","Fee","Cur.","Exchange","Group","Comment","Date"\n'
+    '"Trade","1","BTC","20000","EUR","","","Kraken","","","01.03.2022 10:00:00"\n'
+    '"Trade","1","BTC","25000","EUR","","","Kraken","","","01.03.2023 10:00:00"\n'
+    '"Trade","30000","EUR","0.5","BTC","","","Kraken","","","01.06.2023 10:00:00"\n'
+    '"Trade","50000","EUR","1","BTC","","","Kraken","","","01.03.2024 10:00:00"\n'
+).encode('utf-8')
+
+async def _load_history(session, user_id):
+    import io
+    from core.ingestion_service.bulk_loader import CanonicalTransactionLoader
+    from core.ingestion_service.cointracking_parser import CointrackingBackupParser
+    batches = CointrackingBackupParser(user_id=user_id).iter_csv_batches(io.BytesIO(HISTORY_BACKUP))
+    await CanonicalTransactionLoader(session).load(user_id, list(batches))
+
+async def _sell_less_in_2023(sessions):
+    from sqlalchemy import text
+    async with sessions() as session:
+        await session.execute(text(
+            "UPDATE canonical_transactions SET amount_out = 0.25 "
+            "WHERE tx_type = 'SELL' AND timestamp_utc < '2024-01-01'"
+        ))
+        await session.commit()
+
+async def _checkpoint_years(session):
+    from sqlalchemy import text
+    return (await session.execute(text("SELECT year FROM tax_lot_checkpoints ORDER BY year"))).scalars().all()
+
+async def _fifo_2024(calculator):
+    report = (await calculator.calculate_all_methods(2024, ['FIFO']))['FIFO']
+    return calculator.processed_transactions, from_scaled(report.total_cost_basis)
+
+def test_checkpoints_restore_the_open_lots(database):
+    async def scenario(sessions):
+        async with sessions() as session:
+            await _load_history(session, database.user_id)
+            calculator = TaxCalculator(database.user_id, 'ES', session=session)
+            full = await _fifo_2024(calculator)
+            years = await _checkpoint_years(session)
+            return full, years, await _fifo_2024(calculator)
+
+    full, years, restored = database.run(scenario)
+    assert years == [2022, 2023, 2024]
+    # Desde el checkpoint de 2023 sólo se recorre la venta de 2024
+    assert full == (4, Decimal('22500'))
+    assert restored == (1, Decimal('22500'))
+
+def test_changed_transactions_invalidate_later_checkpoints(database):
+    async def scenario(sessions):
+        async with sessions() as session:
+            await _load_history(session, database.user_id)
+            calculator = TaxCalculator(database.user_id, 'ES', session=session)
+            await _fifo_2024(calculator)
+            await _sell_less_in_2023(sessions)
+            return await _checkpoint_years(session), await _fifo_2024(calculator)
+
+    years, recalculated = database.run(scenario)
+    assert years == [2022]
+    assert recalculated == (3, Decimal('21250'))
+
+def test_checkpoints_from_a_stale_read_are_not_restored(database):
+    class ConcurrentChange(TaxCalculator):
+        """Las transacciones cambian entre la lectura del historial y el guardado"""
+
+        async def _save_checkpoints(self, rows):
+            await _sell_less_in_2023(self.sessions)
+            await super()._save_checkpoints(rows)
+
+    async def scenario(sessions):
+        async with sessions() as session:
+            await _load_history(session, database.user_id)
+            stale = ConcurrentChange(database.user_id, 'ES', session=session)
+            stale.sessions = sessions
+            await _fifo_2024(stale)
+            # El trigger llegó antes que los checkpoints: no ha borrado nada
+            years = await _checkpoint_years(session)
+            return years, await _fifo_2024(TaxCalculator(database.user_id, 'ES', session=session))
+
+    years, recalculated = database.run(scenario)
+    assert years == [2022, 2023, 2024]
+    # Los de 2023 y 2024 no corresponden al historial: se parte del de 2022
+    assert recalculated == (3, Decimal('21250'))
@@ -0,0 +1,84 @@
+"""
+Tests del frame columnar de transacciones (FixedPointArray y TransactionFrame)
+"""
+
+import random
+from datetime import datetime, timezone
+from decimal import Decimal
+
+import numpy as np
+import pytest
+
+from core.tax_engine.models import DECIMAL_CONTEXT as EXACT
+from core.transaction_frame import FixedPointArray, TransactionFrame
+
+def _random_decimals(count, seed=5):
+    rng = random.Random(seed)
+    values = []
+    for _ in range(count):
+        # Hasta 12 dígitos enteros y 18 decimales
+        digits = rng.randint(0, 18)
+        values.append(Decimal(rng.randint(-10 ** (12 + digits), 10 ** (12 + digits))).scaleb(-digits, EXACT))
+    return values
+
+def test_values_round_trip_exactly():
+    values = _random_decimals(500) + [Decimal('0'), Decimal('-0.000000000000000001'), Decimal('1E-18')]
+    array = FixedPointArray.from_values(values)
+    assert array.to_decimals() == values
+    assert np.all((array.atto >= 0) & (array.atto < 10 ** 18))
+
+def test_conversion_does_not_use_the_default_decimal_context():
+    # 20 dígitos enteros + 18 decimales: el contexto por defecto (28) los redondearía
+    value = Decimal('12345678901234567890.123456789012345678')
+    with pytest.raises(OverflowError):
+        FixedPointArray.from_values([value])
+    value = Decimal('9223372036854775807.999999999999999999')
+    assert FixedPointArray.from_values([value]).to_decimals() == [value]
+
+def test_more_than_18_decimals_round_half_even():
+    array = FixedPointArray.from_values([Decimal('0.0000000000000000005'), Decimal('0.0000000000000000015'), '2.5'])
+    assert array.to_scaled() == [0, 2, 25 * 10 ** 17]
+
+def test_none_is_zero_and_int64_overflow_is_rejected():
+    assert FixedPointArray.from_values([None, 3]).to_scaled() == [0, 3 * 10 ** 18]
+    with pytest.raises(OverflowError):
+        FixedPointArray.from_values([Decimal(2) ** 63])
+    with pytest.raises(OverflowError):
+        FixedPointArray.from_values([-(Decimal(2) ** 63) - 1])
+
+def test_arithmetic_and_total_match_decimal():
+    left, right = _random_decimals(300, seed=1), _random_decimals(300, seed=2)
+    a, b = FixedPointArray.from_values(left), FixedPointArray.from_values(right)
+    assert (a + b).to_decimals() == [EXACT.add(x, y) for x, y in zip(left, right)]
+    assert (a - b).to_decimals() == [EXACT.subtract(x, y) for x, y in zip(left, right)]
+    assert (-a).to_decimals() == [EXACT.minus(x) for x in left]
+    total = Decimal(0)
+    for value in left:
+        total = EXACT.add(total, value)
+    assert a.total() == total
+
+def test_total_does_not_overflow_the_fraction_sum():
+    values = [Decimal('0.999999999999999999')] * 20
+    assert FixedPointArray.from_values(values).total() == sum(values, Decimal(0))
+
+def test_total_does_not_overflow_the_integer_sum():
+    values = [Decimal('5e18')] * 3 + [Decimal('9223372036854775807.5'), Decimal('-1.25')]
+    assert FixedPointArray.from_values(values).total() == Decimal('24223372036854775806.25')
+
+def test_frame_from_rows():
+    rows = [
+        {'tx_id_kontrol': 'a', 'timestamp_utc': datetime(2024, 1, 1, tzinfo=timezone.utc), 'tx_type': 'BUY',
+         'kontorl_type': 'TRADE', 'asset_in': 'BTC', 'amount_in': Decimal('0.5'), 'exchange_id': 'kraken'},
+        {'tx_id_kontrol': 'b', 'timestamp_utc': datetime(2024, 1, 2), 'tx_type': 'SELL',
+         'kontorl_type': 'SALE', 'asset_out': 'BTC', 'amount_out': Decimal('0.25'),
+         'destination_address': ' BC1QXYZ '},
+    ]
+    frame = TransactionFrame.from_rows(rows)
+    assert len(frame) == 2
+    assert frame.tx_ids.tolist() == ['a', 'b']
+    assert frame.asset_in[0] == frame.asset_out[1]
+    assert frame.asset_in[1] == -1
+    assert frame.amount_in.to_decimals()[0] == Decimal('0.5')
+    assert frame.timestamps[1] - frame.timestamps[0] == 86_400_000_000
+    assert frame.addresses.decode(int(frame.destination_address[1])) == 'bc1qxyz'
+    assert frame.take(np.array([1])).tx_ids.tolist() == ['b']
@@ -0,0 +1,93 @@
+"""
+Tests de tx_identity: ids deterministas y numeración de repeticiones entre lotes
+"""
+
+import io
+
+import numpy as np
+import pytest
+
+from core.ingestion_service.cointracking_parser import CointrackingBackupParser
+from core.ingestion_service.tx_identity import IdentityCounter, batch_ordinals
+
+HEADER = b'"Type","Buy","Cur.","Sell","Cur.","Fee","Cur.","Exchange","Group","Comment","Date"\n'
+REPEATED = b'"Trade","0.5","BTC","15000","EUR","5","EUR","Kraken","","","15.03.2023 10:20:30"\n'
+OTHER = b'"Trade","1000","EUR","0.03","BTC","","","Kraken","","","16.03.2023 11:00:00"\n'
+
+# Diez compras idénticas con otra operación intercalada
+CSV = HEADER + REPEATED * 4 + OTHER + REPEATED * 6 + OTHER
+
+def _ids(chunk_size, workers=1, data=CSV, **kwargs):
+    parser = CointrackingBackupParser(user_id='user-1', chunk_size=chunk_size)
+    batches = parser.iter_csv_batches(io.BytesIO(data), workers=workers, **kwargs)
+    return [tx_id for batch in batches for tx_id in batch.frame['tx_id_kontrol']]
+
+def test_repeated_rows_get_distinct_ids():
+    ids = _ids(100)
+    assert len(ids) == 12
+    assert len(set(ids)) == 12
+    # Reimportar el mismo archivo da los mismos ids
+    assert _ids(100) == ids
+
+@pytest.mark.parametrize('chunk_size', [1, 3, 5])
+def test_ids_do_not_depend_on_chunk_size(chunk_size):
+    assert _ids(chunk_size) == _ids(100)
+
+def test_ids_do_not_depend_on_workers():
+    assert _ids(3, workers=2) == _ids(100)
+
+@pytest.mark.parametrize('resume_after', [1, 2, 3])
+def test_resumed_import_keeps_ids(resume_after):
+    parser = CointrackingBackupParser(user_id='user-1', chunk_size=3)
+    batches = list(parser.iter_csv_batches(io.BytesIO(CSV)))
+    checkpoint = batches[resume_after - 1]
+    done = [tx_id for batch in batches[:resume_after] for tx_id in batch.frame['tx_id_kontrol']]
+
+    # Reanudar con otro tamaño de lote no cambia los ids
+    rest = _ids(4, start_offset=checkpoint.byte_offset, start_row=checkpoint.rows_read)
+    assert done + rest == _ids(100)
+
+def test_counter_numbers_repeats_across_batches():
+    counter = IdentityCounter()
+    keys = np.array([7, 8, 7], dtype=np.uint64)
+    assert counter.ordinals(keys).tolist() == [0, 0, 1]
+    assert counter.ordinals(np.array([9, 7], dtype=np.uint64)).tolist() == [0, 2]
+    assert counter.ordinals(np.array([8, 9, 8], dtype=np.uint64)).tolist() == [1, 1, 2]
+    assert len(counter) == 3
+
+def test_counter_matches_single_pass_on_random_batches():
+    rng = np.random.default_rng(13)
+    keys = rng.integers(0, 50, size=2000).astype(np.uint64)
+    counter = IdentityCounter()
+    ordinals = np.concatenate([
+        counter.ordinals(batch) for batch in np.split(keys, np.sort(rng.choice(np.arange(1, 2000), size=40, replace=False)))
+    ])
+    assert ordinals.tolist() == batch_ordinals(keys.tolist()).tolist()
+
+@pytest.mark.parametrize('resume_after', [1, 2, 3])
+def test_resume_restores_the_counter_without_reading_the_prefix(resume_after):
+    parser = CointrackingBackupParser(user_id='user-1', chunk_size=3)
+    batches = list(parser.iter_csv_batches(io.BytesIO(CSV)))
+    checkpoint = batches[resume_after - 1]
+    done = [tx_id for batch in batches[:resume_after] for tx_id in batch.frame['tx_id_kontrol']]
+
+    # Lo anterior al checkpoint no se vuelve a parsear
+    unreadable = HEADER + b'\x00' * (checkpoint.byte_offset - len(HEADER)) + CSV[checkpoint.byte_offset:]
+    rest = _ids(
+        4, data=unreadable, start_offset=checkpoint.byte_offset, start_row=checkpoint.rows_read,
+        identity_changes=[batch.identity_changes for batch in batches[:resume_after]]
+    )
+    assert done + rest == _ids(100)
+
+def test_counter_restores_from_its_changes():
+    rng = np.random.default_rng(17)
+    batches = np.split(rng.integers(0, 50, size=1000).astype(np.uint64), 20)
+    counter = IdentityCounter()
+    changes = []
+    for batch in batches[:10]:
+        counter.ordinals(batch)
+        changes.append(counter.take_changes())
+    restored = IdentityCounter.restore(changes)
+    assert len(restored) == len(counter)
+    for batch in batches[10:]:
+        assert restored.ordinals(batch).tolist() == counter.ordinals(batch).tolist()
@@ -3,15 +3,19 @@ KONTROL Database Utilities
 Utilidades para conexión y gestión de base de datos con Supabase
 """
 
-from sqlalchemy import create_engine, MetaData
+from sqlalchemy import and_, create_engine, delete, MetaData, or_, select, text, update
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker, declarative_base
 from sqlalchemy.pool import StaticPool
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.sql import func
 import logging
-from typing import AsyncGenerator
+from decimal import Decimal
+from typing import Any, AsyncGenerator, AsyncIterator, Dict, List, Optional
 
 from config.settings import get_settings
 from models.database import Base
+from utils.pagination import Page, build_page, paginate_query
 
 logger = logging.getLogger(__name__)
 settings = get_settings()
@@ -113,12 +117,18 @@ class BaseRepository:
         )
         return result.scalar_one_or_none()
     
-    async def get_all(self, model_class, skip: int = 0, limit: int = 100):
-        """Obtener todos con paginación"""
+    async def get_all(self, model_class, limit: int = 100, cursor: Optional[str] = None) -> Page:
+        """Obtener todos con paginación keyset por id (cursor de la página anterior)"""
         result = await self.session.execute(
-            model_class.__table__.select().offset(skip).limit(limit)
+            paginate_query(select(model_class), [model_class.id], cursor, limit)
         )
-        return result.scalars().all()
+        return build_page(result.scalars().all(), ['id'], limit)
+
+    async def stream_scalars(self, query, batch_size: int = 5000) -> AsyncIterator[List[Any]]:
+        """Iterar un select en lotes de como máximo batch_size modelos (cursor de servidor, memoria acotada)"""
+        result = await self.session.stream_scalars(query.execution_options(yield_per=batch_size))
+        async for partition in result.partitions(batch_size):
+            yield partition
     
     async def update(self, model_instance):
         """Actualizar instancia"""
@@ -144,47 +154,66 @@ class UserRepository(BaseRepository):
         )
         return result.scalar_one_or_none()
     
-    async def get_by_jurisdiction(self, jurisdiction: str, skip: int = 0, limit: int = 100):
-        """Obtener usuarios por jurisdicción"""
+    async def get_by_jurisdiction(self, jurisdiction: str, limit: int = 100, cursor: Optional[str] = None) -> Page:
+        """Obtener usuarios por jurisdicción (keyset por id sobre idx_users_jurisdiction)"""
         from models.database import User
         result = await self.session.execute(
-            User.__table__.select()
-            .where(User.jurisdiction == jurisdiction)
-            .offset(skip)
-            .limit(limit)
+            paginate_query(select(User).where(User.jurisdiction == jurisdiction), [User.id], cursor, limit)
         )
-        return result.scalars().all()
+        return build_page(result.scalars().all(), ['id'], limit)
+
+    async def get_tax_season_users(self, tiers: List[str], year: int) -> List[tuple]:
+        """
+        Obtener (id, jurisdiction, transacciones hasta el año) de los usuarios de
+        los planes indicados, de mayor a menor historial (según transaction_digests)
+        """
+        from models.database import TransactionDigest, User
+        tx_count = func.coalesce(func.sum(TransactionDigest.row_count), 0)
+        result = await self.session.execute(
+            select(User.id, User.jurisdiction, tx_count)
+            .outerjoin(
+                TransactionDigest,
+                (TransactionDigest.user_id == User.id) & (TransactionDigest.year <= year)
+            )
+            .where(User.subscription_tier.in_(tiers))
+            .group_by(User.id, User.jurisdiction)
+            .order_by(tx_count.desc(), User.id)
+        )
+        return [tuple(row) for row in result.all()]
 
 # Repositorio específico para transacciones
 class TransactionRepository(BaseRepository):
     """Repositorio para gestión de transacciones"""
     
-    async def get_by_user(self, user_id: str, skip: int = 0, limit: int = 100):
-        """Obtener transacciones por usuario"""
+    async def get_by_user(self, user_id: str, limit: int = 100, cursor: Optional[str] = None) -> Page:
+        """
+        Obtener transacciones por usuario, de la más reciente a la más antigua.
+
+        Paginación keyset sobre (timestamp_utc, id) con idx_tx_user_timestamp:
+        cada página continúa desde el cursor de la anterior, sin OFFSET.
+        """
         from models.database import CanonicalTransaction
         result = await self.session.execute(
-            CanonicalTransaction.__table__.select()
-            .where(CanonicalTransaction.user_id == user_id)
-            .order_by(CanonicalTransaction.timestamp_utc.desc())
-            .offset(skip)
-            .limit(limit)
+            paginate_query(
+                select(CanonicalTransaction).where(CanonicalTransaction.user_id == user_id),
+                [CanonicalTransaction.timestamp_utc, CanonicalTransaction.id], cursor, limit, descending=True
+            )
         )
-        return result.scalars().all()
+        return build_page(result.scalars().all(), ['timestamp_utc', 'id'], limit)
     
-    async def get_by_asset(self, user_id: str, asset: str, skip: int = 0, limit: int = 100):
-        """Obtener transacciones por asset"""
+    async def get_by_asset(self, user_id: str, asset: str, limit: int = 100, cursor: Optional[str] = None) -> Page:
+        """Obtener transacciones por asset (keyset sobre idx_tx_user_asset_timestamp)"""
         from models.database import CanonicalTransaction
         result = await self.session.execute(
-            CanonicalTransaction.__table__.select()
-            .where(
-                CanonicalTransaction.user_id == user_id,
-                CanonicalTransaction.asset_in == asset
+            paginate_query(
+                select(CanonicalTransaction).where(
+                    CanonicalTransaction.user_id == user_id,
+                    CanonicalTransaction.asset_in == asset
+                ),
+                [CanonicalTransaction.timestamp_utc, CanonicalTransaction.id], cursor, limit, descending=True
             )
-            .order_by(CanonicalTransaction.timestamp_utc.desc())
-            .offset(skip)
-            .limit(limit)
         )
-        return result.scalars().all()
+        return build_page(result.scalars().all(), ['timestamp_utc', 'id'], limit)
     
     async def get_by_date_range(self, user_id: str, start_date, end_date):
         """Obtener transacciones por rango de fechas"""
@@ -199,7 +228,112 @@ class TransactionRepository(BaseRepository):
             .order_by(CanonicalTransaction.timestamp_utc.desc())
         )
         return result.scalars().all()
-    
+
+    async def stream_by_date_range(self, user_id: str, start_date, end_date,
+                                   batch_size: int = 5000) -> AsyncIterator[List[Any]]:
+        """Como get_by_date_range, pero en lotes y en orden cronológico, sin materializar el rango entero"""
+        from models.database import CanonicalTransaction
+        query = (
+            select(CanonicalTransaction)
+            .where(
+                CanonicalTransaction.user_id == user_id,
+                CanonicalTransaction.timestamp_utc >= start_date,
+                CanonicalTransaction.timestamp_utc <= end_date
+            )
+            .order_by(CanonicalTransaction.timestamp_utc.asc(), CanonicalTransaction.id.asc())
+        )
+        async for batch in self.stream_scalars(query, batch_size):
+            yield batch
+
+    async def stream_columns(self, user_id: str, columns, start_date=None, end_date=None, batch_size: int = 50000,
+                             kontorl_types=None):
+        """
+        Iterar columnas seleccionadas en lotes de tuplas, en orden cronológico (cursor de servidor).
+
+        Además de las columnas de la tabla admite 'fee_asset' (metadata->>'fee_asset').
+        """
+        from models.database import CanonicalTransaction
+        table = CanonicalTransaction.__table__
+        selected = [
+            table.c.metadata['fee_asset'].as_string().label(column) if column == 'fee_asset'
+            else getattr(CanonicalTransaction, column)
+            for column in columns
+        ]
+        query = (
+            select(*selected)
+            .where(CanonicalTransaction.user_id == user_id)
+            .order_by(CanonicalTransaction.timestamp_utc.asc(), CanonicalTransaction.id.asc())
+            .execution_options(yield_per=batch_size)
+        )
+        if start_date is not None:
+            query = query.where(CanonicalTransaction.timestamp_utc >= start_date)
+        if end_date is not None:
+            query = query.where(CanonicalTransaction.timestamp_utc <= end_date)
+        if kontorl_types is not None:
+            query = query.where(CanonicalTransaction.kontorl_type.in_(list(kontorl_types)))
+
+        result = await self.session.stream(query)
+        async for partition in result.partitions(batch_size):
+            yield partition
+
+    async def apply_transfer_matches(self, user_id: str, tx_ids: List[str], kontorl_types: List[str],
+                                     counterparts: List[str], confidences: List[Decimal]) -> int:
+        """
+        Reclasificar en bloque las transferencias emparejadas.
+
+        Un único UPDATE ... FROM unnest(...) fija kontorl_type y
+        data_confidence y guarda en metadata la transacción contrapartida.
+        Sólo se aplican los pares cuyos dos lados siguen sin clasificar
+        (WITHDRAWAL/DEPOSIT): las filas se bloquean antes de comprobarlo,
+        así que si otro proceso emparejó una de ellas entretanto el par se
+        descarta entero. Devuelve las filas actualizadas (dos por par).
+        """
+        if not tx_ids:
+            return 0
+        current = await self.session.execute(
+            text("""
+                SELECT tx_id_kontrol, kontorl_type FROM canonical_transactions
+                WHERE user_id = :user_id AND tx_id_kontrol = ANY(CAST(:tx_ids AS text[]))
+                ORDER BY tx_id_kontrol
+                FOR UPDATE
+            """),
+            {'user_id': user_id, 'tx_ids': tx_ids}
+        )
+        pending = {tx_id for tx_id, kontorl_type in current if kontorl_type in ('WITHDRAWAL', 'DEPOSIT')}
+        keep = [
+            position for position, (tx_id, counterpart) in enumerate(zip(tx_ids, counterparts))
+            if tx_id in pending and counterpart in pending
+        ]
+        if len(keep) < len(tx_ids):
+            logger.info(f"Transferencias de {user_id}: {len(tx_ids) - len(keep)} lados descartados (ya clasificados)")
+        if not keep:
+            await self.session.commit()
+            return 0
+
+        result = await self.session.execute(
+            text("""
+                UPDATE canonical_transactions t
+                SET kontorl_type = m.kontorl_type,
+                    data_confidence = m.confidence,
+                    metadata = coalesce(t.metadata, '{}'::jsonb) || jsonb_build_object('transfer_match', m.counterpart)
+                FROM unnest(
+                    CAST(:tx_ids AS text[]), CAST(:kontorl_types AS text[]),
+                    CAST(:counterparts AS text[]), CAST(:confidences AS numeric[])
+                ) AS m(tx_id_kontrol, kontorl_type, counterpart, confidence)
+                WHERE t.user_id = :user_id AND t.tx_id_kontrol = m.tx_id_kontrol
+                  AND t.kontorl_type IN ('WITHDRAWAL', 'DEPOSIT')
+            """),
+            {
+                'user_id': user_id,
+                'tx_ids': [tx_ids[position] for position in keep],
+                'kontorl_types': [kontorl_types[position] for position in keep],
+                'counterparts': [counterparts[position] for position in keep],
+                'confidences': [confidences[position] for position in keep]
+            }
+        )
+        await self.session.commit()
+        return result.rowcount
+
     async def get_by_kontorl_type(self, user_id: str, kontorl_type: str):
         """Obtener transacciones por tipo KONTROL"""
         from models.database import CanonicalTransaction
@@ -213,6 +347,21 @@ class TransactionRepository(BaseRepository):
         )
         return result.scalars().all()
 
+    async def stream_by_kontorl_type(self, user_id: str, kontorl_type: str,
+                                     batch_size: int = 5000) -> AsyncIterator[List[Any]]:
+        """Como get_by_kontorl_type, pero en lotes y en orden cronológico (idx_tx_user_type_timestamp)"""
+        from models.database import CanonicalTransaction
+        query = (
+            select(CanonicalTransaction)
+            .where(
+                CanonicalTransaction.user_id == user_id,
+                CanonicalTransaction.kontorl_type == kontorl_type
+            )
+            .order_by(CanonicalTransaction.timestamp_utc.asc(), CanonicalTransaction.id.asc())
+        )
+        async for batch in self.stream_scalars(query, batch_size):
+            yield batch
+
 # Repositorio específico para exchanges
 class ExchangeRepository(BaseRepository):
     """Repositorio para gestión de exchanges"""
@@ -323,6 +472,20 @@ class PortfolioRepository(BaseRepository):
         )
         return result.scalars().all()
 
+    async def stream_by_asset(self, user_id: str, asset: str, batch_size: int = 5000) -> AsyncIterator[List[Any]]:
+        """Como get_by_asset, pero en lotes y en orden cronológico"""
+        from models.database import PortfolioSnapshot
+        query = (
+            select(PortfolioSnapshot)
+            .where(
+                PortfolioSnapshot.user_id == user_id,
+                PortfolioSnapshot.asset == asset
+            )
+            .order_by(PortfolioSnapshot.date.asc(), PortfolioSnapshot.id.asc())
+        )
+        async for batch in self.stream_scalars(query, batch_size):
+            yield batch
+
 # Repositorio específico para reportes fiscales
 class TaxReportRepository(BaseRepository):
     """Repositorio para gestión de reportes fiscales"""
@@ -352,3 +515,234 @@ class TaxReportRepository(BaseRepository):
         )
         return result.scalars().all()
 
+
+    async def upsert_reports(self, rows: List[Dict[str, Any]]):
+        """Guardar varios reportes en una sola transacción (upsert por usuario, año y método)"""
+        from models.database import TaxReport
+        if not rows:
+            return
+        stmt = pg_insert(TaxReport).values(rows)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['user_id', 'year', 'method'],
+            set_={
+                'total_realized_gain': stmt.excluded.total_realized_gain,
+                'total_tax_amount': stmt.excluded.total_tax_amount,
+                'short_term_gains': stmt.excluded.short_term_gains,
+                'long_term_gains': stmt.excluded.long_term_gains,
+                'transaction_count': stmt.excluded.transaction_count,
+                'report_data': stmt.excluded.report_data,
+                'cache_key': stmt.excluded.cache_key,
+                'generated_at': func.now()
+            }
+        )
+        await self.session.execute(stmt)
+        await self.session.commit()
+
+    async def get_by_cache_keys(self, user_id: str, year: int, cache_keys: Dict[str, str]):
+        """Obtener los reportes de un año cuya clave de caché sigue vigente (método -> fila)"""
+        from models.database import TaxReport
+        if not cache_keys:
+            return {}
+        result = await self.session.execute(
+            select(TaxReport)
+            .where(
+                TaxReport.user_id == user_id,
+                TaxReport.year == year,
+                TaxReport.method.in_(list(cache_keys))
+            )
+        )
+        return {
+            report.method: report
+            for report in result.scalars().all()
+            if report.cache_key is not None and report.cache_key == cache_keys[report.method]
+        }
+
+# Repositorio específico para digests de transacciones
+class TransactionDigestRepository(BaseRepository):
+    """Repositorio de solo lectura para transaction_digests (mantenida por trigger)"""
+    
+    async def get_until(self, user_id: str, year: int):
+        """Obtener los digests de los años <= year, en orden"""
+        from models.database import TransactionDigest
+        result = await self.session.execute(
+            select(TransactionDigest)
+            .where(
+                TransactionDigest.user_id == user_id,
+                TransactionDigest.year <= year
+            )
+            .order_by(TransactionDigest.year.asc())
+        )
+        return result.scalars().all()
+
+# Repositorio específico para trabajos de sincronización
+class SyncJobRepository(BaseRepository):
+    """Repositorio para sync_jobs (progreso y checkpoints de importaciones)"""
+    
+    async def create_job(self, user_id: str, job_type: str, target_id: str = None, total_bytes: int = None):
+        """Crear un trabajo en estado running"""
+        from models.database import SyncJob
+        job = SyncJob(
+            user_id=user_id,
+            job_type=job_type,
+            target_id=target_id,
+            status='running',
+            total_bytes=total_bytes,
+            started_at=func.now()
+        )
+        return await self.create(job)
+    
+    async def get_job(self, job_id: str):
+        """Obtener un trabajo por ID"""
+        from models.database import SyncJob
+        result = await self.session.execute(select(SyncJob).where(SyncJob.id == job_id))
+        return result.scalar_one_or_none()
+    
+    async def get_resumable(self, user_id: str, job_type: str, target_id: str):
+        """Último trabajo sin completar de un usuario para el mismo objetivo (p.ej. checksum del archivo)"""
+        from models.database import SyncJob
+        result = await self.session.execute(
+            select(SyncJob)
+            .where(
+                SyncJob.user_id == user_id,
+                SyncJob.job_type == job_type,
+                SyncJob.target_id == target_id,
+                SyncJob.status.in_(['running', 'failed'])
+            )
+            .order_by(SyncJob.created_at.desc())
+            .limit(1)
+        )
+        return result.scalar_one_or_none()
+    
+    async def get_progress(self, job_id: str):
+        """Progreso de un trabajo (lectura por clave primaria de unas pocas columnas)"""
+        from models.database import SyncJob
+        result = await self.session.execute(
+            select(
+                SyncJob.status,
+                SyncJob.progress,
+                SyncJob.processed_items,
+                SyncJob.total_items,
+                SyncJob.checkpoint_row,
+                SyncJob.error_message,
+                SyncJob.updated_at
+            ).where(SyncJob.id == job_id)
+        )
+        row = result.one_or_none()
+        return dict(row._mapping) if row is not None else None
+    
+    async def save_checkpoint(
+        self,
+        job_id: str,
+        offset: int,
+        row: int,
+        processed_items: int,
+        progress: int,
+        identity_changes: Optional[bytes] = None
+    ):
+        """
+        Registrar el punto de reanudación de un trabajo.
+
+        No confirma: el llamador lo hace en la misma transacción que el lote
+        cargado, de modo que checkpoint y datos avanzan juntos. Los cambios
+        del contador de identidades del lote (si los hay) se guardan con él.
+        """
+        from models.database import SyncJob, SyncJobIdentity
+        await self.session.execute(
+            update(SyncJob)
+            .where(SyncJob.id == job_id)
+            .values(
+                checkpoint_offset=offset,
+                checkpoint_row=row,
+                processed_items=processed_items,
+                progress=progress
+            )
+        )
+        if identity_changes is not None:
+            stmt = pg_insert(SyncJobIdentity).values(job_id=job_id, checkpoint_offset=offset, changes=identity_changes)
+            await self.session.execute(stmt.on_conflict_do_update(
+                index_elements=['job_id', 'checkpoint_offset'],
+                set_={'changes': stmt.excluded.changes}
+            ))
+    
+    async def get_identity_changes(self, job_id: str, offset: int) -> Optional[List[bytes]]:
+        """Cambios del contador de identidades hasta un checkpoint, en orden (None si no se guardaron)"""
+        from models.database import SyncJobIdentity
+        result = await self.session.execute(
+            select(SyncJobIdentity.changes)
+            .where(
+                SyncJobIdentity.job_id == job_id,
+                SyncJobIdentity.checkpoint_offset <= offset
+            )
+            .order_by(SyncJobIdentity.checkpoint_offset.asc())
+        )
+        return result.scalars().all() or None
+    
+    async def clear_identity_changes(self, job_id: str):
+        """Borrar el estado del contador de identidades (sin confirmar)"""
+        from models.database import SyncJobIdentity
+        await self.session.execute(delete(SyncJobIdentity).where(SyncJobIdentity.job_id == job_id))
+    
+    async def set_status(self, job_id: str, status: str, error_message: str = None, **values):
+        """Cambiar el estado de un trabajo (completed/failed fijan completed_at)"""
+        from models.database import SyncJob
+        if status in ('completed', 'failed', 'cancelled'):
+            values['completed_at'] = func.now()
+        elif status == 'running':
+            values['completed_at'] = None
+        await self.session.execute(
+            update(SyncJob)
+            .where(SyncJob.id == job_id)
+            .values(status=status, error_message=error_message, **values)
+        )
+        await self.session.commit()
+
+# Repositorio específico para checkpoints de lotes
+class TaxCheckpointRepository(BaseRepository):
+    """Repositorio para los checkpoints de lotes abiertos a fin de año"""
+    
+    async def get_latest_before(self, user_id: str, method: str, year: int, history_digests: Dict[int, str]):
+        """
+        Obtener el checkpoint vigente más reciente anterior a un año.
+
+        Un checkpoint sólo es vigente si se calculó sobre el historial actual:
+        su history_digest debe coincidir con el de su año en history_digests
+        (año -> digest, ver report_cache.compute_history_digest). Así se
+        descartan los guardados a partir de una lectura ya desfasada.
+        """
+        from models.database import TaxLotCheckpoint
+        current = [
+            and_(TaxLotCheckpoint.year == checkpoint_year, TaxLotCheckpoint.history_digest == digest)
+            for checkpoint_year, digest in history_digests.items()
+            if checkpoint_year < year
+        ]
+        if not current:
+            return None
+        result = await self.session.execute(
+            select(TaxLotCheckpoint)
+            .where(
+                TaxLotCheckpoint.user_id == user_id,
+                TaxLotCheckpoint.method == method,
+                or_(*current)
+            )
+            .order_by(TaxLotCheckpoint.year.desc())
+            .limit(1)
+        )
+        return result.scalar_one_or_none()
+    
+    async def upsert_checkpoints(self, rows: List[Dict[str, Any]]):
+        """Guardar checkpoints (upsert por usuario, método y año)"""
+        from models.database import TaxLotCheckpoint
+        if not rows:
+            return
+        stmt = pg_insert(TaxLotCheckpoint).values(rows)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['user_id', 'method', 'year'],
+            set_={
+                'open_lots': stmt.excluded.open_lots,
+                'lot_count': stmt.excluded.lot_count,
+                'history_digest': stmt.excluded.history_digest,
+                'created_at': func.now()
+            }
+        )
+        await self.session.execute(stmt)
+        await self.session.commit()
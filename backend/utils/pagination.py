@@ -0,0 +1,141 @@
+"""
+KONTROL Pagination Utilities
+Paginación keyset (seek) con cursores opacos para repositorios SQLAlchemy y servicios Supabase
+"""
+
+import base64
+import binascii
+import json
+import uuid
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, List, Optional, Sequence
+
+from sqlalchemy import and_, or_
+
+class InvalidCursorError(ValueError):
+    """Cursor de paginación mal formado o de otro listado"""
+    pass
+
+@dataclass
+class Page:
+    """
+    Página de resultados.
+
+    Attributes:
+        items: Filas de la página
+        next_cursor: Cursor opaco de la página siguiente (None si es la última)
+    """
+    items: List[Any] = field(default_factory=list)
+    next_cursor: Optional[str] = None
+
+    @property
+    def has_more(self) -> bool:
+        return self.next_cursor is not None
+
+def encode_cursor(values: Sequence[Any]) -> str:
+    """Cursor opaco (base64 url-safe de JSON) con los valores de la clave de la última fila"""
+    payload = json.dumps([value if value is None else str(value) for value in values], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor: str, size: int) -> List[Optional[str]]:
+    """
+    Valores de la clave de un cursor (como texto).
+
+    Raises:
+        InvalidCursorError: Si el cursor no es válido o no tiene `size` valores
+    """
+    try:
+        payload = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        values = json.loads(payload.decode('utf-8'))
+    except (binascii.Error, UnicodeDecodeError, ValueError) as e:
+        raise InvalidCursorError(f"Cursor inválido: {cursor}") from e
+    if not isinstance(values, list) or len(values) != size or any(value is None for value in values):
+        raise InvalidCursorError(f"Cursor inválido: {cursor}")
+    return values
+
+def _coerce(column, value: str) -> Any:
+    """Convertir un valor del cursor al tipo Python de la columna"""
+    try:
+        python_type = column.type.python_type
+    except NotImplementedError:
+        return value
+    try:
+        if python_type is datetime:
+            return datetime.fromisoformat(value)
+        if python_type is uuid.UUID:
+            return uuid.UUID(value)
+        if python_type is int:
+            return int(value)
+    except ValueError as e:
+        raise InvalidCursorError(f"Valor de cursor inválido para {column.key}: {value}") from e
+    return value
+
+def keyset_condition(columns: Sequence[Any], values: Sequence[Any], descending: bool = False):
+    """
+    Filas posteriores a `values` en el orden de `columns`.
+
+    Equivale a (c1, c2, ...) > (v1, v2, ...) (o < si es descendente),
+    desarrollado como OR anidados y con una cota redundante sobre la
+    primera columna para que PostgreSQL acote el recorrido del índice.
+    """
+    condition = None
+    for column, value in zip(reversed(columns), reversed(values)):
+        strict = column < value if descending else column > value
+        condition = strict if condition is None else or_(strict, and_(column == value, condition))
+    bound = columns[0] <= values[0] if descending else columns[0] >= values[0]
+    return and_(bound, condition)
+
+def paginate_query(query, columns: Sequence[Any], cursor: Optional[str], limit: int, descending: bool = False):
+    """
+    Aplicar la paginación keyset a un select de SQLAlchemy.
+
+    Ordena por `columns` (la última debe ser única, p. ej. id) y pide una
+    fila de más para saber si hay página siguiente; el coste de la página
+    N es el de la primera. Convertir el resultado con build_page.
+    """
+    if cursor:
+        values = [_coerce(column, value) for column, value in zip(columns, decode_cursor(cursor, len(columns)))]
+        query = query.where(keyset_condition(columns, values, descending))
+    return query.order_by(*[column.desc() if descending else column.asc() for column in columns]).limit(limit + 1)
+
+def build_page(rows: Sequence[Any], keys: Sequence[str], limit: int) -> Page:
+    """Página a partir de las (limit + 1) filas de una consulta paginada (modelos o diccionarios)"""
+    items = list(rows[:limit])
+    if len(rows) <= limit or not items:
+        return Page(items)
+    last = items[-1]
+    if isinstance(last, dict):
+        values = [last.get(key) for key in keys]
+    else:
+        values = [getattr(last, key) for key in keys]
+    return Page(items, encode_cursor(values))
+
+def postgrest_keyset_filter(keys: Sequence[str], values: Sequence[str], descending: bool = False) -> str:
+    """
+    Filtro `or` de PostgREST equivalente a keyset_condition.
+
+    Los valores van entre comillas dobles para que las comas, los dos
+    puntos o los paréntesis no rompan la sintaxis del filtro.
+    """
+    operator = 'lt' if descending else 'gt'
+
+    def quoted(value: str) -> str:
+        return '"' + str(value).replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+    terms: List[str] = []
+    for key, value in zip(reversed(keys), reversed(values)):
+        inner = terms[0] if len(terms) == 1 else f"or({','.join(terms)})"
+        strict = f"{key}.{operator}.{quoted(value)}"
+        terms = [strict, f"and({key}.eq.{quoted(value)},{inner})"] if terms else [strict]
+    return ','.join(terms)
+
+def apply_postgrest_keyset(query, keys: Sequence[str], cursor: Optional[str], limit: int, descending: bool = False):
+    """Aplicar la paginación keyset a una consulta de supabase-py (convertir el resultado con build_page)"""
+    if cursor:
+        values = decode_cursor(cursor, len(keys))
+        query = (query.lte if descending else query.gte)(keys[0], values[0])
+        query = query.or_(postgrest_keyset_filter(keys, values, descending))
+    for key in keys:
+        query = query.order(key, desc=descending)
+    return query.limit(limit + 1)
@@ -4,9 +4,10 @@ Utilidades para integración con Supabase
 """
 
 import logging
-from typing import Optional, Dict, Any, List
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional
 from supabase import create_client, Client
 from config.settings import get_settings, SupabaseConfig
+from utils.pagination import Page, apply_postgrest_keyset, build_page
 
 logger = logging.getLogger(__name__)
 settings = get_settings()
@@ -43,7 +44,15 @@ def get_supabase_client() -> Client:
     return supabase
 
 class SupabaseService:
-    """Servicio base para operaciones con Supabase"""
+    """
+    Servicio base para operaciones con Supabase.
+
+    Los listados se paginan por keyset sobre `keyset_columns` (la última
+    única) en orden descendente o no según `keyset_descending`.
+    """
+
+    keyset_columns = ('id',)
+    keyset_descending = False
     
     def __init__(self, table_name: str):
         self.table_name = table_name
@@ -67,17 +76,14 @@ class SupabaseService:
             logger.error(f"Error obteniendo registro {id} de {self.table_name}: {e}")
             raise
     
-    async def get_by_user(self, user_id: str, limit: int = 100, offset: int = 0) -> List[Dict[str, Any]]:
-        """Obtener registros por usuario"""
+    async def get_by_user(self, user_id: str, limit: int = 100, cursor: Optional[str] = None) -> Page:
+        """Obtener registros por usuario (cursor de la página anterior)"""
         try:
-            response = (
-                self.client.table(self.table_name)
-                .select('*')
-                .eq('user_id', user_id)
-                .range(offset, offset + limit - 1)
-                .execute()
-            )
-            return response.data
+            query = self.client.table(self.table_name).select('*').eq('user_id', user_id)
+            response = apply_postgrest_keyset(
+                query, self.keyset_columns, cursor, limit, self.keyset_descending
+            ).execute()
+            return build_page(response.data, self.keyset_columns, limit)
         except Exception as e:
             logger.error(f"Error obteniendo registros de usuario {user_id} de {self.table_name}: {e}")
             raise
@@ -110,20 +116,50 @@ class SupabaseService:
             logger.error(f"Error eliminando registro {id} de {self.table_name}: {e}")
             raise
     
-    async def search(self, filters: Dict[str, Any], limit: int = 100, offset: int = 0) -> List[Dict[str, Any]]:
-        """Buscar registros con filtros"""
+    async def search(self, filters: Dict[str, Any], limit: int = 100, cursor: Optional[str] = None) -> Page:
+        """Buscar registros con filtros (cursor de la página anterior)"""
         try:
             query = self.client.table(self.table_name).select('*')
             
             for key, value in filters.items():
                 query = query.eq(key, value)
             
-            response = query.range(offset, offset + limit - 1).execute()
-            return response.data
+            response = apply_postgrest_keyset(
+                query, self.keyset_columns, cursor, limit, self.keyset_descending
+            ).execute()
+            return build_page(response.data, self.keyset_columns, limit)
         except Exception as e:
             logger.error(f"Error buscando en {self.table_name}: {e}")
             raise
 
+    async def iter_pages(self, build_query: Callable[[], Any], batch_size: int = 1000,
+                         descending: Optional[bool] = None) -> AsyncIterator[List[Dict[str, Any]]]:
+        """
+        Recorrer todas las páginas keyset de una consulta.
+
+        Args:
+            build_query: Crea la consulta filtrada (supabase-py modifica las
+                consultas en sitio, así que cada página necesita una nueva)
+            batch_size: Filas por página (PostgREST limita a 1000 por defecto)
+            descending: Orden de keyset_columns (por defecto keyset_descending)
+        """
+        descending = self.keyset_descending if descending is None else descending
+        cursor = None
+        while True:
+            try:
+                response = apply_postgrest_keyset(
+                    build_query(), self.keyset_columns, cursor, batch_size, descending
+                ).execute()
+            except Exception as e:
+                logger.error(f"Error paginando {self.table_name}: {e}")
+                raise
+            page = build_page(response.data, self.keyset_columns, batch_size)
+            if page.items:
+                yield page.items
+            if not page.has_more:
+                return
+            cursor = page.next_cursor
+
 class SupabaseAuthService:
     """Servicio de autenticación con Supabase"""
     
@@ -204,6 +240,20 @@ class SupabaseStorageService:
             logger.error(f"Error subiendo archivo {file_path}: {e}")
             raise
     
+    async def upload_local_file(self, file_path: str, local_path: str, content_type: str = "application/octet-stream") -> str:
+        """Subir un archivo local sin cargarlo entero en memoria"""
+        try:
+            with open(local_path, 'rb') as file_data:
+                response = self.client.storage.from_(self.bucket_name).upload(
+                    file_path,
+                    file_data,
+                    file_options={"content-type": content_type}
+                )
+            return response.get('path')
+        except Exception as e:
+            logger.error(f"Error subiendo archivo {file_path}: {e}")
+            raise
+    
     async def download_file(self, file_path: str) -> bytes:
         """Descargar archivo"""
         try:
@@ -301,10 +351,34 @@ class UserSupabaseService(SupabaseService):
 
 class TransactionSupabaseService(SupabaseService):
     """Servicio de transacciones con Supabase"""
+
+    # De la más reciente a la más antigua, sobre idx_tx_user_timestamp
+    keyset_columns = ('timestamp_utc', 'id')
+    keyset_descending = True
     
     def __init__(self):
         super().__init__('canonical_transactions')
     
+    async def upsert_transactions(self, user_id: str, transactions: List[Dict[str, Any]], source: str = None) -> List[Dict[str, Any]]:
+        """Guardar transacciones con tx_id_kontrol determinista (las ya existentes se ignoran)"""
+        from core.ingestion_service.tx_identity import compute_tx_id
+        if not transactions:
+            return []
+        rows = [
+            {**transaction, 'user_id': user_id, 'tx_id_kontrol': transaction.get('tx_id_kontrol') or compute_tx_id(user_id, transaction, source)}
+            for transaction in transactions
+        ]
+        try:
+            response = (
+                self.client.table(self.table_name)
+                .upsert(rows, on_conflict='tx_id_kontrol', ignore_duplicates=True)
+                .execute()
+            )
+            return response.data
+        except Exception as e:
+            logger.error(f"Error guardando transacciones de {user_id}: {e}")
+            raise
+    
     async def get_by_date_range(self, user_id: str, start_date: str, end_date: str) -> List[Dict[str, Any]]:
         """Obtener transacciones por rango de fechas"""
         try:
@@ -321,6 +395,21 @@ class TransactionSupabaseService(SupabaseService):
         except Exception as e:
             logger.error(f"Error obteniendo transacciones por rango: {e}")
             raise
+
+    async def iter_by_date_range(self, user_id: str, start_date: str, end_date: str,
+                                 batch_size: int = 1000) -> AsyncIterator[List[Dict[str, Any]]]:
+        """Como get_by_date_range, pero en páginas de batch_size filas y en orden cronológico"""
+        def build_query():
+            return (
+                self.client.table(self.table_name)
+                .select('*')
+                .eq('user_id', user_id)
+                .gte('timestamp_utc', start_date)
+                .lte('timestamp_utc', end_date)
+            )
+
+        async for rows in self.iter_pages(build_query, batch_size, descending=False):
+            yield rows
     
     async def get_by_asset(self, user_id: str, asset: str) -> List[Dict[str, Any]]:
         """Obtener transacciones por asset"""
@@ -0,0 +1,128 @@
+"""
+KONTROL Upload Utilities
+Recepción en streaming de archivos subidos a un temporal con spool a disco
+"""
+
+import hashlib
+import logging
+import tempfile
+from typing import AsyncIterable, Optional
+
+from config.settings import get_settings
+
+logger = logging.getLogger(__name__)
+
+# Bytes leídos del cliente por iteración
+UPLOAD_READ_SIZE = 1024 * 1024
+
+class UploadTooLargeError(ValueError):
+    """El archivo subido supera MAX_FILE_SIZE_MB"""
+
+class SpooledUpload:
+    """
+    Archivo subido, recibido por trozos en un SpooledTemporaryFile.
+
+    Los archivos pequeños se quedan en memoria y los grandes pasan a disco
+    al superar UPLOAD_SPOOL_MAX_MEMORY_MB, así que la memoria por subida es
+    constante. El hash SHA-256 y el límite de tamaño se calculan mientras
+    llegan los datos: una subida demasiado grande se corta en cuanto cruza
+    el límite, sin esperar a recibirla entera.
+
+    Uso:
+        with await SpooledUpload.receive(upload_file) as upload:
+            parser.iter_csv_batches(upload.stream())
+
+    Attributes:
+        filename: Nombre original del archivo
+        size: Bytes recibidos
+        sha256: Hash del contenido (hex), disponible tras completar la recepción
+    """
+
+    def __init__(self, filename: Optional[str] = None, max_size: Optional[int] = None, spool_size: Optional[int] = None):
+        settings = get_settings()
+        self.filename = filename
+        self.max_size = max_size if max_size is not None else settings.max_file_size_mb * 1024 * 1024
+        spool_size = spool_size if spool_size is not None else settings.upload_spool_max_memory_mb * 1024 * 1024
+        self.file = tempfile.SpooledTemporaryFile(max_size=spool_size, mode='w+b', prefix='kontrol-upload-')
+        self.size = 0
+        self.sha256: Optional[str] = None
+        self._digest = hashlib.sha256()
+
+    def __enter__(self) -> 'SpooledUpload':
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Liberar el temporal (memoria o disco)"""
+        self.file.close()
+
+    def write(self, data: bytes) -> None:
+        """
+        Añadir un trozo recibido.
+
+        Raises:
+            UploadTooLargeError: Si el acumulado supera el tamaño máximo
+        """
+        self.size += len(data)
+        if self.size > self.max_size:
+            raise UploadTooLargeError(
+                f"Archivo demasiado grande: supera {self.max_size // (1024 * 1024)} MB"
+            )
+        self._digest.update(data)
+        self.file.write(data)
+
+    def finish(self) -> 'SpooledUpload':
+        """Cerrar la recepción: fija el hash y rebobina el temporal"""
+        self.sha256 = self._digest.hexdigest()
+        self.file.seek(0)
+        return self
+
+    @classmethod
+    async def receive(
+        cls,
+        upload,
+        filename: Optional[str] = None,
+        max_size: Optional[int] = None
+    ) -> 'SpooledUpload':
+        """
+        Recibir una subida completa.
+
+        Args:
+            upload: UploadFile de FastAPI (read asíncrono) o iterable asíncrono
+                de bytes (p.ej. request.stream())
+            filename: Nombre del archivo (por defecto upload.filename)
+            max_size: Tamaño máximo en bytes (por defecto MAX_FILE_SIZE_MB)
+
+        Raises:
+            UploadTooLargeError: Si se supera el tamaño máximo (el temporal
+                se libera antes de propagar el error)
+        """
+        spooled = cls(filename or getattr(upload, 'filename', None), max_size)
+        try:
+            async for data in _iter_upload(upload):
+                spooled.write(data)
+        except BaseException:
+            spooled.close()
+            raise
+        spooled.finish()
+        logger.debug(f"Subida {spooled.filename}: {spooled.size} bytes, sha256 {spooled.sha256}")
+        return spooled
+
+    def stream(self):
+        """Stream binario rebobinado (lo que esperan los parsers)"""
+        self.file.seek(0)
+        return self.file
+
+async def _iter_upload(upload) -> AsyncIterable[bytes]:
+    if hasattr(upload, 'read'):
+        while True:
+            data = await upload.read(UPLOAD_READ_SIZE)
+            if not data:
+                return
+            yield data
+    else:
+        async for data in upload:
+            if data:
+                yield data